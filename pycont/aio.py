@@ -0,0 +1,1314 @@
+"""
+.. module:: aio
+   :platform: Unix
+   :synopsis: An asyncio version of the controller module, driving the pumps from an event loop.
+
+.. moduleauthor:: Jonathan Grizou <Jonathan.Grizou@gla.ac.uk>
+
+The classes of this module mirror PumpIO, C3000Controller and MultiPumpController, the methods talking to the pumps
+are coroutines::
+
+    controller = AsyncMultiPumpController.from_configfile('pump_setup_config.json')
+    await controller.smart_initialize()
+    await controller.pumps['water'].pump(0.5, from_valve='I', wait=True)
+    await asyncio.gather(controller.pumps['water'].wait_until_idle(), controller.pumps['acetone'].wait_until_idle())
+
+The serial port is read without blocking, its file descriptor is watched by the event loop. No thread is used.
+
+"""
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import inspect
+import collections
+
+from . import pump_protocol
+from . import dtprotocol
+from .transport import open_transport
+from .controller import (PumpIO, C3000Controller, C3000GroupController, C3000CommandSequence, MultiPumpController,
+                         PumpIOTimeOutError, ControllerRepeatedError, PumpHWError, PumpUnhealthyError, TransferProgress,
+                         C3000Broadcast, C3000ShadowState, valve_position_to_dtcommand, run_commands, VALVE_INPUT,
+                         VALVE_OUTPUT, VALVE_BYPASS, VALVE_EXTRA, VALVE_6WAY_LIST, DEFAULT_IO_BAUDRATE,
+                         DEFAULT_IO_TIMEOUT, MAX_REPEAT_WRITE_AND_READ, MAX_REPEAT_OPERATION, _check_move)
+from .operation import next_poll_time
+
+
+class AsyncPumpIO(PumpIO):
+    """
+    This class deals with the pump I/O instructions from an asyncio event loop.
+
+    The port is opened in non-blocking mode and its file descriptor is watched by the running event loop while a
+    response is awaited.
+
+    Args:
+        port (int): The port number
+
+        baudrate (int): Baudrate of the communication, default set to DEFAULT_IO_BAUDRATE(9600)
+
+        timeout (int): The timeout of communication, default set to DEFAULT_IO_TIMEOUT(1)
+
+    """
+    def __init__(self, port, baudrate=DEFAULT_IO_BAUDRATE, timeout=DEFAULT_IO_TIMEOUT):
+        self._response_waiter = None
+        super(AsyncPumpIO, self).__init__(port, baudrate, timeout)
+        self.lock = asyncio.Lock()
+
+    def open(self, port, baudrate=DEFAULT_IO_BAUDRATE, timeout=DEFAULT_IO_TIMEOUT):
+        """
+        Opens a non-blocking communication with the hardware.
+
+        Args:
+            port (int): The port number on which the communication will take place.
+
+            baudrate (int): The baudrate of the communication, default set to DEFAULT_IO_BAUDRATE(9600).
+
+            timeout (int): The timeout of the communication, default set to DEFAULT_IO_TIMEOUT(1). It is applied by
+                readline(), the port itself never blocks.
+
+        """
+        self._transport = open_transport(port, baudrate, 0)
+        self.logger.debug("Opening port '%s'", self.port,
+                          extra={'port': self.port,
+                                 'baudrate': self.baudrate,
+                                 'timeout': self.timeout})
+
+    def _on_readable(self):
+        try:
+            chunk = self._transport.read(self._transport.in_waiting or 1)
+        except ConnectionError:
+            chunk = b''
+        if chunk:
+            self._parser.feed(chunk)
+        if self._response_waiter is not None and not self._response_waiter.done():
+            msg = self._parser.next_frame()
+            if msg is not None:
+                self._response_waiter.set_result(msg)
+            elif not self._transport.is_open:
+                # The connection was lost, nothing can be received until the next write connects again
+                self._response_waiter.set_exception(PumpIOTimeOutError())
+
+    async def readline(self, timeout=None):
+        """
+        Reads a response frame from the serial communication, see PumpIO.readline()
+
+        Args:
+            timeout (float): The time to wait for the frame, default set to None for the timeout of the PumpIO.
+
+        Returns:
+            msg (bytes): The response frame, from '/0' to the ETX byte.
+
+        Raises:
+            PumpIOTimeOutError: If the response time is greater than the timeout threshold.
+
+        """
+        msg = self._parser.next_frame()
+        if msg is None:
+            if not self._transport.is_open:
+                self.logger.debug("Readline failed: not connected")
+                raise PumpIOTimeOutError
+            loop = asyncio.get_running_loop()
+            fd = self._transport.fileno()
+            self._response_waiter = loop.create_future()
+            loop.add_reader(fd, self._on_readable)
+            try:
+                msg = await asyncio.wait_for(self._response_waiter, self.timeout if timeout is None else timeout)
+            except asyncio.TimeoutError:
+                self.logger.debug("Readline timeout!")
+                raise PumpIOTimeOutError
+            finally:
+                loop.remove_reader(fd)
+                self._response_waiter = None
+        self.logger.debug("Received %s", msg)
+        return msg
+
+    async def write_without_reply(self, packet):
+        """
+        Coroutine version of PumpIO.write_without_reply()
+
+        Args:
+            packet (DTInstructionPacket): The packet to be written.
+
+        """
+        async with self.lock:
+            await self._settle()
+            self.write(packet)
+
+    async def write_and_readline(self, packet, timeout=None):
+        """
+        Writes a packet along the serial communication and waits for a response, see PumpIO.write_and_readline()
+
+        Args:
+            packet (DTInstructionPacket): The packet to be written.
+
+            timeout (float): The time to wait for the response, default set to None for the timeout of the PumpIO.
+
+        Returns:
+            response (str): The received response.
+
+        Raises:
+            PumpIOTimeOutError: If the response time is greater than the timeout threshold.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        frame = packet.to_string()
+        async with self.lock:
+            await self._settle()
+            self.write(packet)
+            deadline = time.monotonic() + timeout
+            candidate = None
+            while True:
+                try:
+                    response = await self.readline(max(0, deadline - time.monotonic()))
+                except PumpIOTimeOutError:
+                    if candidate is not None:
+                        return self._take_candidate(frame, candidate)
+                    self._owe_reply(frame)
+                    raise
+                (reply, candidate) = self._sort_response(frame, response, candidate)
+                if reply is not None:
+                    return reply
+
+    async def _settle(self):
+        """
+        Coroutine version of PumpIO._settle()
+        """
+        self._discard_received_frames()
+        while self._owed_replies:
+            remaining = self._late_reply_deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                self._discard_frame(await self.readline(remaining))
+            except PumpIOTimeOutError:
+                break
+
+
+class AsyncC3000Controller(C3000Controller):
+    """
+    This class represents the controller for a C3000 driven from an asyncio event loop.
+
+    All the methods talking to the pump are coroutines, the properties reading the pump (e.g. current_volume) return
+    awaitables. See C3000Controller for the arguments and the description of each method.
+
+    """
+
+    async def write_and_read_from_pump(self, packet, max_repeat=MAX_REPEAT_WRITE_AND_READ):
+        """
+        Coroutine version of C3000Controller.write_and_read_from_pump(), the backoff lets other tasks run. Deadlines
+        are set with asyncio.wait_for() on the calling coroutine.
+        """
+        report = pump_protocol.is_report_frame(packet.to_string())
+        for i in range(max_repeat):
+            self.logger.debug("Write and read %s/%s", i + 1, max_repeat)
+            if not self.retry_policy.allow_request():
+                raise PumpUnhealthyError('Pump {} is unhealthy'.format(self.name))
+
+            timeout = self.retry_policy.timeout(report)
+            start_time = time.monotonic()
+            try:
+                response = await self._io.write_and_readline(packet, timeout=timeout)
+                decoded_response = self._protocol.decode_packet(response)
+                if decoded_response is not None:
+                    self.retry_policy.record_success(time.monotonic() - start_time)
+                    return decoded_response
+                else:
+                    self.logger.debug("Decode error for {}, trying again!".format(response))
+            except PumpIOTimeOutError:
+                self.logger.debug("Timeout after %.3fs, trying again!", timeout)
+            self.retry_policy.record_failure()
+            if i + 1 < max_repeat:
+                await asyncio.sleep(self.retry_policy.backoff(i + 1))
+        self.logger.debug("Too many failed communication!")
+        raise ControllerRepeatedError('Repeated Error from pump {}'.format(self.name))
+
+    async def get_shadow_value(self, attribute, getter):
+        """
+        Coroutine version of C3000Controller.get_shadow_value(), the value is always read from the pump: the commands
+        sent from the event loop are not tracked in the shadow state.
+        """
+        return await getter()
+
+    def idle_operation(self):
+        """
+        Gets a handle on the move currently running on the pump, polled from the running event loop rather than by
+        the PumpOperationPoller.
+
+        Returns:
+            asyncio.Task: A task completing with True when the pump is idle.
+
+        """
+        async def wait_until_idle():
+            await self.wait_until_idle()
+            return True
+
+        return asyncio.ensure_future(wait_until_idle())
+
+    def _schedule_sequence(self, dtcommands):
+        """
+        Records the predicted duration of a sequence which has just been sent. The state of the pump is not tracked
+        from the event loop: the valve moves and the absolute moves are left out, so the pump is polled early
+        rather than late. The end of an unknown sequence (None) is not predicted.
+        """
+        if dtcommands is None:
+            self._schedule_completion(None)
+            return
+        dtcommands = [dtcommand for dtcommand in dtcommands
+                      if dtcommand.command.decode() not in (VALVE_INPUT, VALVE_OUTPUT, VALVE_BYPASS, VALVE_EXTRA)]
+        self._schedule_completion(run_commands(dtcommands, C3000ShadowState(), self._estimate_command_duration))
+
+    async def is_idle(self):
+        """
+        Coroutine version of C3000Controller.is_idle()
+        """
+        report_status_packet = self._protocol.forge_report_status_packet()
+        (_, status, _) = await self.write_and_read_from_pump(report_status_packet)
+        if status == pump_protocol.STATUS_IDLE_ERROR_FREE:
+            return True
+        elif status == pump_protocol.STATUS_BUSY_ERROR_FREE:
+            return False
+        elif status in pump_protocol.ERROR_STATUSES_BUSY:
+            raise PumpHWError(error_code=status, pump=self.name)
+        elif status in pump_protocol.ERROR_STATUSES_IDLE:
+            raise PumpHWError(error_code=status, pump=self.name)
+        else:
+            raise ValueError('The pump replied status {}, Not handled'.format(status))
+
+    async def is_busy(self):
+        """
+        Coroutine version of C3000Controller.is_busy()
+        """
+        return not await self.is_idle()
+
+    async def wait_until_idle(self):
+        """
+        Coroutine version of C3000Controller.wait_until_idle(), other tasks run while the pump is busy. The pump is
+        polled as by the PumpOperationPoller, see operation.next_poll_time().
+        """
+        busy = False
+        while True:
+            now = self._clock.time()
+            next_poll = next_poll_time(self, now, busy=busy)
+            if next_poll > now:
+                await asyncio.sleep(next_poll - now)
+            busy = await self.is_busy()
+            if not busy:
+                break
+        self._completion_time = None
+
+    async def is_initialized(self):
+        """
+        Coroutine version of C3000Controller.is_initialized()
+        """
+        initialized_packet = self._protocol.forge_report_initialized_packet()
+        (_, _, init_status) = await self.write_and_read_from_pump(initialized_packet)
+        return bool(int(init_status))
+
+    async def smart_initialize(self, valve_position=None, secure=True):
+        """
+        Coroutine version of C3000Controller.smart_initialize()
+        """
+        if not await self.is_initialized():
+            await self.initialize(valve_position, secure=secure)
+        await self.init_all_pump_parameters(secure=secure)
+
+    async def initialize(self, valve_position=None, max_repeat=MAX_REPEAT_OPERATION, secure=True):
+        """
+        Coroutine version of C3000Controller.initialize()
+        """
+        if valve_position is None:
+            valve_position = self.initialize_valve_position
+
+        for _ in range(max_repeat):
+
+            await self.initialize_valve_only()
+            await self.set_valve_position(valve_position, secure=secure)
+            await self.initialize_no_valve()
+
+            if await self.is_initialized():
+                return True
+
+        self.logger.debug("Too many failed attempts to initialize!")
+        raise ControllerRepeatedError('Repeated Error from pump {}'.format(self.name))
+
+    async def initialize_valve_right(self, operand_value=0, wait=True):
+        """
+        Coroutine version of C3000Controller.initialize_valve_right()
+        """
+        await self._initialize(self._protocol.forge_initialize_valve_right_packet(operand_value), wait)
+
+    async def initialize_valve_left(self, operand_value=0, wait=True):
+        """
+        Coroutine version of C3000Controller.initialize_valve_left()
+        """
+        await self._initialize(self._protocol.forge_initialize_valve_left_packet(operand_value), wait)
+
+    async def initialize_no_valve(self, operand_value=None, wait=True):
+        """
+        Coroutine version of C3000Controller.initialize_no_valve()
+        """
+        if operand_value is None:
+            if self.total_volume < 1:
+                operand_value = 1  # Half plunger stall force for syringes with volume of 500 uL or less
+            else:
+                operand_value = 0
+
+        await self._initialize(self._protocol.forge_initialize_no_valve_packet(operand_value), wait)
+
+    async def initialize_valve_only(self, operand_string='0,0', wait=True):
+        """
+        Coroutine version of C3000Controller.initialize_valve_only()
+        """
+        await self._initialize(self._protocol.forge_initialize_valve_only_packet(operand_string), wait)
+
+    async def _initialize(self, packet, wait):
+        await self.write_and_read_from_pump(packet)
+        self._schedule_completion(None)
+        if wait:
+            await self.wait_until_idle()
+
+    async def init_all_pump_parameters(self, secure=True):
+        """
+        Coroutine version of C3000Controller.init_all_pump_parameters()
+        """
+        await self.set_microstep_mode(self.micro_step_mode)
+        await self.wait_until_idle()  # just in case, but should not be needed
+
+        await self.set_top_velocity(self.default_top_velocity, secure=secure)
+        await self.wait_until_idle()  # just in case, but should not be needed
+
+    async def set_microstep_mode(self, micro_step_mode):
+        """
+        Coroutine version of C3000Controller.set_microstep_mode()
+        """
+        await self.write_and_read_from_pump(self._protocol.forge_microstep_mode_packet(micro_step_mode))
+
+    async def ensure_default_top_velocity(self, secure=True):
+        """
+        Coroutine version of C3000Controller.ensure_default_top_velocity()
+        """
+        if await self.get_top_velocity() != self.default_top_velocity:
+            await self.set_top_velocity(self.default_top_velocity, secure=secure)
+
+    async def set_top_velocity(self, top_velocity, max_repeat=MAX_REPEAT_OPERATION, secure=True):
+        """
+        Coroutine version of C3000Controller.set_top_velocity()
+        """
+        for i in range(max_repeat):
+            if await self.get_top_velocity() == top_velocity:
+                return True
+            else:
+                self.logger.debug("Top velocity not set, change attempt {}/{}".format(i + 1, max_repeat))
+            self.check_top_velocity_within_range(top_velocity)
+            await self.write_and_read_from_pump(self._protocol.forge_top_velocity_packet(top_velocity))
+            # if do not want to wait and check things went well, return now
+            if secure is False:
+                return True
+
+        self.logger.debug(f"[PUMP {self.name}] Too many failed attempts in set_top_velocity!")
+        raise ControllerRepeatedError(f'Repeated Error from pump {self.name}')
+
+    async def get_top_velocity(self):
+        """
+        Coroutine version of C3000Controller.get_top_velocity()
+        """
+        top_velocity_packet = self._protocol.forge_report_peak_velocity_packet()
+        (_, _, top_velocity) = await self.write_and_read_from_pump(top_velocity_packet)
+        return int(top_velocity)
+
+    async def get_plunger_position(self):
+        """
+        Coroutine version of C3000Controller.get_plunger_position()
+        """
+        plunger_position_packet = self._protocol.forge_report_plunger_position_packet()
+        (_, _, steps) = await self.write_and_read_from_pump(plunger_position_packet)
+        return int(steps)
+
+    @property
+    def current_steps(self):
+        """
+        Awaitable, see get_plunger_position()
+        """
+        return self.get_plunger_position()
+
+    async def _get_remaining_steps(self):
+        return self.number_of_steps - await self.get_plunger_position()
+
+    @property
+    def remaining_steps(self):
+        """
+        Awaitable, gets the remaining number of steps.
+        """
+        return self._get_remaining_steps()
+
+    async def get_volume(self):
+        """
+        Coroutine version of C3000Controller.get_volume()
+        """
+        return self.step_to_volume(await self.get_plunger_position())  # in ml
+
+    @property
+    def current_volume(self):
+        """
+        Awaitable, see get_volume()
+        """
+        return self.get_volume()
+
+    async def _get_remaining_volume(self):
+        return self.total_volume - await self.get_volume()
+
+    @property
+    def remaining_volume(self):
+        """
+        Awaitable, gets the remaining volume.
+        """
+        return self._get_remaining_volume()
+
+    async def is_volume_pumpable(self, volume_in_ml):
+        """
+        Coroutine version of C3000Controller.is_volume_pumpable()
+        """
+        steps = self.volume_to_step(volume_in_ml)
+        return steps <= await self.remaining_steps
+
+    async def execute_sequence(self, sequence, wait=False):
+        """
+        Coroutine version of C3000Controller.execute_sequence(), sequence.execute() is therefore awaitable.
+        """
+        if not await self._write_sequence(sequence, execute=True):
+            return False
+        self._schedule_sequence(sequence.dtcommands)
+
+        if wait:
+            await self.wait_until_idle()
+
+        return True
+
+    async def _write_sequence(self, sequence, execute):
+        return await self._write_checked(sequence.to_packet(execute=execute), sequence)
+
+    async def _write_checked(self, packet, sequence):
+        (_, status, _) = await self.write_and_read_from_pump(packet)
+        if status in (pump_protocol.STATUS_IDLE_INVALID_OPERAND, pump_protocol.STATUS_BUSY_INVALID_OPERAND):
+            self.logger.debug("[PUMP %s] Sequence %s rejected, invalid operand", self.name, sequence)
+            return False
+        elif status in pump_protocol.ERROR_STATUSES_IDLE or status in pump_protocol.ERROR_STATUSES_BUSY:
+            raise PumpHWError(error_code=status, pump=self.name)
+        return True
+
+    async def pump(self, volume_in_ml, from_valve=None, speed_in=None, wait=False, secure=True, chained=False):
+        """
+        Coroutine version of C3000Controller.pump()
+        """
+        if chained:
+            sequence = self.sequence()
+            sequence.velocity(speed_in if speed_in is not None else self.default_top_velocity)
+            if from_valve is not None:
+                sequence.valve(from_valve)
+            return await sequence.pump(volume_in_ml).execute(wait=wait)
+
+        if await self.is_volume_pumpable(volume_in_ml):
+
+            if speed_in is not None:
+                await self.set_top_velocity(speed_in, secure=secure)
+            else:
+                await self.ensure_default_top_velocity(secure=secure)
+
+            if from_valve is not None:
+                await self.set_valve_position(from_valve, secure=secure)
+
+            steps_to_pump = self.volume_to_step(volume_in_ml)
+            packet = self._protocol.forge_pump_packet(steps_to_pump)
+            await self.write_and_read_from_pump(packet)
+            self._schedule_completion(self.estimate_move_duration(
+                steps_to_pump, speed_in if speed_in is not None else self.default_top_velocity))
+
+            if wait:
+                await self.wait_until_idle()
+
+            return True
+        else:
+            return False
+
+    async def is_volume_deliverable(self, volume_in_ml):
+        """
+        Coroutine version of C3000Controller.is_volume_deliverable()
+        """
+        steps = self.volume_to_step(volume_in_ml)
+        return steps <= await self.current_steps
+
+    async def deliver(self, volume_in_ml, to_valve=None, speed_out=None, wait=False, secure=True, chained=False):
+        """
+        Coroutine version of C3000Controller.deliver()
+        """
+        if chained:
+            if volume_in_ml == 0:
+                return True
+            sequence = self.sequence()
+            sequence.velocity(speed_out if speed_out is not None else self.default_top_velocity)
+            if to_valve is not None:
+                sequence.valve(to_valve)
+            return await sequence.deliver(volume_in_ml).execute(wait=wait)
+
+        if await self.is_volume_deliverable(volume_in_ml):
+
+            if volume_in_ml == 0:
+                return True
+
+            if speed_out is not None:
+                await self.set_top_velocity(speed_out, secure=secure)
+            else:
+                await self.ensure_default_top_velocity(secure=secure)
+
+            if to_valve is not None:
+                await self.set_valve_position(to_valve, secure=secure)
+
+            steps_to_deliver = self.volume_to_step(volume_in_ml)
+            packet = self._protocol.forge_deliver_packet(steps_to_deliver)
+            await self.write_and_read_from_pump(packet)
+            self._schedule_completion(self.estimate_move_duration(
+                steps_to_deliver, speed_out if speed_out is not None else self.default_top_velocity))
+
+            if wait:
+                await self.wait_until_idle()
+
+            return True
+        else:
+            return False
+
+    async def arm_sequence(self, sequence):
+        """
+        Coroutine version of C3000Controller.arm_sequence(), sequence.arm() is therefore awaitable.
+        """
+        if not await self._write_sequence(sequence, execute=False):
+            return False
+        self._armed_commands = list(sequence.dtcommands)
+        return True
+
+    async def fire(self):
+        """
+        Coroutine version of C3000Controller.fire()
+        """
+        await self.write_and_read_from_pump(self._protocol.forge_execute_packet())
+        self.track_fired_sequence()
+
+    async def store_program(self, slot, sequence):
+        """
+        Coroutine version of C3000Controller.store_program(), sequence.store() is therefore awaitable.
+        """
+        if not 0 <= slot < pump_protocol.PROGRAM_SLOTS:
+            raise ValueError('Program slot must be in [0-{}], you entered {}'.format(
+                pump_protocol.PROGRAM_SLOTS - 1, slot))
+        sequence.to_packet()  # Checks the loops
+        packet = self._protocol.forge_store_program_packet(slot, sequence.dtcommands)
+        (_, status, _) = await self.write_and_read_from_pump(packet)
+        if status in (pump_protocol.STATUS_IDLE_INVALID_OPERAND, pump_protocol.STATUS_BUSY_INVALID_OPERAND):
+            self.logger.debug("[PUMP %s] Program %s rejected, invalid operand", self.name, sequence)
+            return False
+        elif status in pump_protocol.ERROR_STATUSES_IDLE or status in pump_protocol.ERROR_STATUSES_BUSY:
+            raise PumpHWError(error_code=status, pump=self.name)
+        self._programs[slot] = list(sequence.dtcommands)
+        return True
+
+    async def run_program(self, slot, wait=False):
+        """
+        Coroutine version of C3000Controller.run_program()
+        """
+        (_, status, _) = await self.write_and_read_from_pump(self._protocol.forge_run_program_packet(slot))
+        if status in (pump_protocol.STATUS_IDLE_INVALID_OPERAND, pump_protocol.STATUS_BUSY_INVALID_OPERAND):
+            return False
+        elif status in pump_protocol.ERROR_STATUSES_IDLE or status in pump_protocol.ERROR_STATUSES_BUSY:
+            raise PumpHWError(error_code=status, pump=self.name)
+        self._schedule_sequence(self._programs.get(slot))
+
+        if wait:
+            await self.wait_until_idle()
+
+        return True
+
+    async def transfer(self, volume_in_ml, from_valve, to_valve, speed_in=None, speed_out=None, chained=False,
+                       looped=False, progress=None):
+        """
+        Coroutine version of C3000Controller.transfer()
+        """
+        if looped:
+            sequence = await self.transfer_program(volume_in_ml, from_valve, to_valve, speed_in, speed_out)
+            await sequence.execute(wait=True)
+            return
+
+        async for transfer_progress in self.iter_transfer(volume_in_ml, from_valve, to_valve, speed_in, speed_out,
+                                                          chained):
+            if progress is not None:
+                progress(transfer_progress)
+
+    async def iter_transfer(self, volume_in_ml, from_valve, to_valve, speed_in=None, speed_out=None, chained=False):
+        """
+        Asynchronous generator version of C3000Controller.iter_transfer(), iterated with async for.
+        """
+        plan = await self.plan_transfer(volume_in_ml, from_valve, to_valve, speed_in, speed_out)
+        volume_transferred = 0.0
+        for (index, stroke) in enumerate(plan):
+            if chained:
+                await self._append_stroke(self.sequence(), *stroke).execute(wait=True)
+            else:
+                await self.pump(stroke.volume_in_ml, stroke.from_valve, speed_in=stroke.speed_in, wait=True)
+                await self.deliver(stroke.volume_in_ml, stroke.to_valve, speed_out=stroke.speed_out, wait=True)
+            volume_transferred += stroke.volume_in_ml
+            yield TransferProgress(index + 1, len(plan), volume_transferred, volume_in_ml)
+
+    async def plan_transfer(self, volume_in_ml, from_valve, to_valve, speed_in=None, speed_out=None,
+                            stroke_volume=None):
+        """
+        Coroutine version of C3000Controller.plan_transfer(), the room left in the syringe is read from the pump
+        when stroke_volume is None.
+        """
+        if stroke_volume is None:
+            stroke_volume = await self.remaining_volume
+        return C3000Controller.plan_transfer(self, volume_in_ml, from_valve, to_valve, speed_in, speed_out,
+                                             stroke_volume)
+
+    def _split_strokes(self, volume_in_ml, stroke_volume):
+        if stroke_volume is None:
+            # The room left in the syringe is read by the coroutines calling this method
+            raise ValueError('The stroke volume of pump {} must be given'.format(self.name))
+        return super(AsyncC3000Controller, self)._split_strokes(volume_in_ml, stroke_volume)
+
+    async def transfer_program(self, volume_in_ml, from_valve, to_valve, speed_in=None, speed_out=None,
+                               stroke_volume=None):
+        """
+        Coroutine version of C3000Controller.transfer_program(), the room left in the syringe is read from the pump
+        when stroke_volume is None.
+        """
+        if stroke_volume is None:
+            stroke_volume = await self.remaining_volume
+        return C3000Controller.transfer_program(self, volume_in_ml, from_valve, to_valve, speed_in, speed_out,
+                                                stroke_volume)
+
+    async def go_to_volume(self, volume_in_ml, speed=None, wait=False, secure=True, chained=False):
+        """
+        Coroutine version of C3000Controller.go_to_volume()
+        """
+        if self.is_volume_valid(volume_in_ml):
+
+            if chained:
+                sequence = self.sequence()
+                sequence.velocity(speed if speed is not None else self.default_top_velocity)
+                return await sequence.go_to_volume(volume_in_ml).execute(wait=wait)
+
+            if speed is not None:
+                await self.set_top_velocity(speed, secure=secure)
+            else:
+                await self.ensure_default_top_velocity(secure=secure)
+
+            steps = self.volume_to_step(volume_in_ml)
+            packet = self._protocol.forge_move_to_packet(steps)
+            await self.write_and_read_from_pump(packet)
+            self._schedule_completion(None)
+
+            if wait:
+                await self.wait_until_idle()
+
+            return True
+        else:
+            return False
+
+    async def go_to_max_volume(self, speed=None, wait=False):
+        """
+        Coroutine version of C3000Controller.go_to_max_volume()
+        """
+        return await self.go_to_volume(self.total_volume, speed=speed, wait=wait)
+
+    async def get_raw_valve_position(self):
+        """
+        Coroutine version of C3000Controller.get_raw_valve_position()
+        """
+        valve_position_packet = self._protocol.forge_report_valve_position_packet()
+        (_, _, raw_valve_position) = await self.write_and_read_from_pump(valve_position_packet)
+        return raw_valve_position
+
+    async def get_valve_position(self, max_repeat=MAX_REPEAT_OPERATION):
+        """
+        Coroutine version of C3000Controller.get_valve_position()
+        """
+        raw_valve_position = None
+        for i in range(max_repeat):
+            raw_valve_position = await self.get_raw_valve_position()
+            if raw_valve_position == 'i':
+                return VALVE_INPUT
+            elif raw_valve_position == 'o':
+                return VALVE_OUTPUT
+            elif raw_valve_position == 'b':
+                return VALVE_BYPASS
+            elif raw_valve_position == 'e':
+                return VALVE_EXTRA
+            elif raw_valve_position in VALVE_6WAY_LIST:
+                return raw_valve_position
+            self.logger.debug(f"Valve position request failed attempt {i+1}/{max_repeat}, {raw_valve_position} unknown")
+        raise ValueError(f'Valve position received was {raw_valve_position}. It is unknown')
+
+    async def set_valve_position(self, valve_position, max_repeat=MAX_REPEAT_OPERATION, secure=True):
+        """
+        Coroutine version of C3000Controller.set_valve_position()
+        """
+        for i in range(max_repeat):
+
+            if await self.get_valve_position() == valve_position:
+                return True
+            else:
+                self.logger.debug("Valve not in position, change attempt {}/{}".format(i + 1, max_repeat))
+
+            if valve_position == VALVE_INPUT:
+                valve_position_packet = self._protocol.forge_valve_input_packet()
+            elif valve_position == VALVE_OUTPUT:
+                valve_position_packet = self._protocol.forge_valve_output_packet()
+            elif valve_position == VALVE_BYPASS:
+                valve_position_packet = self._protocol.forge_valve_bypass_packet()
+            elif valve_position == VALVE_EXTRA:
+                valve_position_packet = self._protocol.forge_valve_extra_packet()
+            elif valve_position in VALVE_6WAY_LIST:
+                valve_position_packet = self._protocol.forge_valve_6way_packet(valve_position)
+            else:
+                raise ValueError('Valve position {} unknown'.format(valve_position))
+
+            await self.write_and_read_from_pump(valve_position_packet)
+            self._schedule_completion(pump_protocol.VALVE_MOVE_DURATION)
+
+            # if do not want to wait and check things went well, return now
+            if secure is False:
+                return True
+
+            await self.wait_until_idle()
+
+        self.logger.debug("[PUMP {}] Too many failed attempts in set_valve_position!".format(self.name))
+        raise ControllerRepeatedError('Repeated Error from pump {}'.format(self.name))
+
+    async def set_eeprom_config(self, operand_value):
+        """
+        Coroutine version of C3000Controller.set_eeprom_config()
+        """
+        await self.write_and_read_from_pump(self._protocol.forge_eeprom_config_packet(operand_value))
+        eeprom_sign_packet = self._protocol.forge_eeprom_lowlevel_config_packet(sub_command=20, operand_value="pycont1")
+        await self.write_and_read_from_pump(eeprom_sign_packet)
+
+        if operand_value == 1:
+            print("####################################################")
+            print("3-Way Y-Valve: Connect jumper to pin 5 (bottom pin) below address switch at back of pump")
+            print("Unpower and repower the pump to activate changes!")
+            print("####################################################")
+        else:
+            print("####################################################")
+            print("Unpower and repower the pump to make changes active!")
+            print("####################################################")
+
+    async def set_eeprom_lowlevel_config(self, command, operand):
+        """
+        Coroutine version of C3000Controller.set_eeprom_lowlevel_config()
+        """
+        eeprom_packet = self._protocol.forge_eeprom_lowlevel_config_packet(sub_command=command, operand_value=operand)
+        await self.write_and_read_from_pump(eeprom_packet)
+
+    async def flash_eeprom_3_way_y_valve(self):
+        """
+        Coroutine version of C3000Controller.flash_eeprom_3_way_y_valve()
+        """
+        await self.set_eeprom_config(1)
+
+    async def flash_eeprom_3_way_t_valve(self):
+        """
+        Coroutine version of C3000Controller.flash_eeprom_3_way_t_valve()
+        """
+        await self.set_eeprom_config(5)
+
+    async def flash_eeprom_4_way_nondist_valve(self):
+        """
+        Coroutine version of C3000Controller.flash_eeprom_4_way_nondist_valve()
+        """
+        await self.set_eeprom_config(2)
+
+    async def flash_eeprom_4_way_dist_valve(self):
+        """
+        Coroutine version of C3000Controller.flash_eeprom_4_way_dist_valve()
+        """
+        await self.set_eeprom_config(4)
+
+    async def get_eeprom_config(self):
+        """
+        Coroutine version of C3000Controller.get_eeprom_config()
+        """
+        (_, _, eeprom_config) = await self.write_and_read_from_pump(self._protocol.forge_report_eeprom_packet())
+        return eeprom_config
+
+    async def get_current_valve_config(self):
+        """
+        Coroutine version of C3000Controller.get_current_valve_config()
+        """
+        valve_config = (await self.get_eeprom_config()).split(',')[10]
+        if valve_config == "2013100":
+            return "3-WAY"
+        elif valve_config == "2033110":
+            return "4-WAY dist"
+        elif valve_config == "2130001":
+            return "4-WAY nondist"
+        else:
+            print(valve_config)
+            return "Unknown"
+
+    async def terminate(self):
+        """
+        Coroutine version of C3000Controller.terminate()
+        """
+        await self.write_and_read_from_pump(self._protocol.forge_terminate_packet())
+        self._schedule_completion(None)
+
+
+class AsyncC3000GroupController(C3000GroupController):
+    """
+    This class sends commands to several pumps of a hub in a single packet from an asyncio event loop, through the
+    broadcast address or one of the group addresses. See C3000GroupController for the arguments and the description of
+    each method.
+
+    """
+
+    async def write_to_pumps(self, dtcommands):
+        """
+        Coroutine version of C3000GroupController.write_to_pumps()
+        """
+        durations = [pump.estimate_sequence_duration(dtcommands) for pump in self.pumps]
+        await self._io.write_without_reply(self._protocol.forge_packet(list(dtcommands)))
+        for pump, duration in zip(self.pumps, durations):
+            pump.shadow.track_commands(dtcommands)
+            pump._schedule_completion(duration)
+
+    async def _apply_to_each_pump(self, command, *args, **kwargs):
+        returns = await asyncio.gather(*(getattr(pump, command)(*args, **kwargs) for pump in self.pumps))
+        return all(returns)
+
+    async def wait_until_idle(self):
+        """
+        Coroutine version of C3000GroupController.wait_until_idle(), the pumps are waited for concurrently.
+        """
+        await asyncio.gather(*(pump.wait_until_idle() for pump in self.pumps))
+
+    async def fire(self):
+        """
+        Coroutine version of C3000GroupController.fire()
+        """
+        await self._io.write_without_reply(self._protocol.forge_execute_packet())
+        for pump in self.pumps:
+            pump.track_fired_sequence()
+
+    async def terminate(self):
+        """
+        Coroutine version of C3000GroupController.terminate()
+        """
+        await self._io.write_without_reply(self._protocol.forge_terminate_packet())
+        for pump in self.pumps:
+            pump.shadow.invalidate()
+            pump._schedule_completion(None)
+            pump._armed_commands = None
+
+    async def initialize_valve_only(self, operand_string='0,0', wait=True):
+        """
+        Coroutine version of C3000GroupController.initialize_valve_only()
+        """
+        await self.write_to_pumps([dtprotocol.DTCommand(pump_protocol.CMD_INITIALIZE_VALVE_ONLY, operand_string)])
+        if wait:
+            await self.wait_until_idle()
+        return True
+
+    async def initialize_no_valve(self, operand_value=None, wait=True):
+        """
+        Coroutine version of C3000GroupController.initialize_no_valve()
+        """
+        if operand_value is None:
+            small_syringes = [pump.total_volume < 1 for pump in self.pumps]
+            if len(set(small_syringes)) > 1:
+                return await self._apply_to_each_pump('initialize_no_valve', wait=wait)
+            operand_value = 1 if small_syringes[0] else 0
+
+        await self.write_to_pumps([dtprotocol.DTCommand(pump_protocol.CMD_INITIALIZE_NO_VALVE, str(operand_value))])
+        if wait:
+            await self.wait_until_idle()
+        return True
+
+    async def set_top_velocity(self, top_velocity, secure=True):
+        """
+        Coroutine version of C3000GroupController.set_top_velocity()
+        """
+        for pump in self.pumps:
+            pump.check_top_velocity_within_range(top_velocity)
+        await self.write_to_pumps([dtprotocol.DTCommand(pump_protocol.CMD_TOPVELOCITY, str(int(top_velocity)))])
+        if secure:
+            return await self._apply_to_each_pump('set_top_velocity', top_velocity, secure=True)
+        return True
+
+    async def set_valve_position(self, valve_position, secure=True):
+        """
+        Coroutine version of C3000GroupController.set_valve_position(), the packet is always sent since the valve
+        positions are not tracked from the event loop.
+        """
+        await self.write_to_pumps([valve_position_to_dtcommand(valve_position)])
+        if secure:
+            await self.wait_until_idle()
+            return await self._apply_to_each_pump('set_valve_position', valve_position, secure=True)
+        return True
+
+    async def _move(self, volume_in_ml, valve_position, speed, wait, is_volume_movable, append_move):
+        if not self._are_alike('steps_per_ml') or (speed is None and not self._are_alike('default_top_velocity')):
+            return None
+        for pump in self.pumps:
+            movable = is_volume_movable(pump, volume_in_ml)
+            if inspect.isawaitable(movable):
+                movable = await movable
+            if not movable:
+                return None
+
+        sequence = C3000CommandSequence(self.pumps[0])
+        sequence.velocity(speed if speed is not None else self.pumps[0].default_top_velocity)
+        if valve_position is not None:
+            sequence.valve(valve_position)
+        append_move(sequence, volume_in_ml)
+        await self.write_to_pumps(sequence.dtcommands)
+
+        if wait:
+            await self.wait_until_idle()
+        return True
+
+    async def pump(self, volume_in_ml, from_valve=None, speed_in=None, wait=False, secure=True):
+        """
+        Coroutine version of C3000GroupController.pump()
+        """
+        moved = await self._move(volume_in_ml, from_valve, speed_in, wait,
+                                 AsyncC3000Controller.is_volume_pumpable, C3000CommandSequence.pump)
+        if moved is None:
+            return await self._apply_to_each_pump('pump', volume_in_ml, from_valve=from_valve, speed_in=speed_in,
+                                                  wait=wait, secure=secure)
+        return moved
+
+    async def deliver(self, volume_in_ml, to_valve=None, speed_out=None, wait=False, secure=True):
+        """
+        Coroutine version of C3000GroupController.deliver()
+        """
+        if volume_in_ml == 0:
+            return True
+        moved = await self._move(volume_in_ml, to_valve, speed_out, wait,
+                                 AsyncC3000Controller.is_volume_deliverable, C3000CommandSequence.deliver)
+        if moved is None:
+            return await self._apply_to_each_pump('deliver', volume_in_ml, to_valve=to_valve, speed_out=speed_out,
+                                                  wait=wait, secure=secure)
+        return moved
+
+    async def go_to_volume(self, volume_in_ml, speed=None, wait=False, secure=True):
+        """
+        Coroutine version of C3000GroupController.go_to_volume()
+        """
+        moved = await self._move(volume_in_ml, None, speed, wait,
+                                 C3000Controller.is_volume_valid, C3000CommandSequence.go_to_volume)
+        if moved is None:
+            return await self._apply_to_each_pump('go_to_volume', volume_in_ml, speed=speed, wait=wait,
+                                                  secure=secure)
+        return moved
+
+
+class AsyncMultiPumpController(MultiPumpController):
+    """
+    This class deals with controlling multiple pumps on one or more hubs from an asyncio event loop.
+
+    Commands applied to several pumps run concurrently, e.g. apply_command_to_all_pumps('wait_until_idle') waits for
+    all the pumps at once. See MultiPumpController for the arguments and the description of each method.
+
+    """
+
+    def _create_io(self, io_config):
+        return AsyncPumpIO.from_config(io_config)
+
+    def _create_pump(self, pump_io, pump_name, pump_config):
+        return AsyncC3000Controller.from_config(pump_io, pump_name, pump_config)
+
+    def _create_group_controller(self, hub, address, pumps):
+        return AsyncC3000GroupController(hub, address, pumps)
+
+    async def apply_command_to_pumps(self, pump_names, command, *args, **kwargs):
+        """
+        Coroutine version of MultiPumpController.apply_command_to_pumps(), the command runs on all pumps concurrently.
+        """
+        returns = {}
+        for pump_name in pump_names:
+            func = getattr(self.pumps[pump_name], command)
+            returns[pump_name] = func(*args, **kwargs)
+
+        awaited = [pump_name for pump_name, value in returns.items() if inspect.isawaitable(value)]
+        results = await asyncio.gather(*(returns[pump_name] for pump_name in awaited))
+        returns.update(zip(awaited, results))
+
+        return returns
+
+    async def are_pumps_initialized(self):
+        """
+        Coroutine version of MultiPumpController.are_pumps_initialized()
+        """
+        return all((await self.apply_command_to_all_pumps('is_initialized')).values())
+
+    async def smart_initialize(self, secure=True):
+        """
+        Coroutine version of MultiPumpController.smart_initialize()
+        """
+        if self.hardware_groups:
+            apply_command = self.apply_command_to_pumps_at_once
+        else:
+            apply_command = self.apply_command_to_pumps
+
+        initialized = await self.apply_command_to_all_pumps('is_initialized')
+        to_initialize = [pump_name for pump_name, is_initialized in initialized.items() if not is_initialized]
+
+        await apply_command(to_initialize, 'initialize_valve_only', wait=False)
+        await self.wait_until_all_pumps_idle()
+
+        await asyncio.gather(*(self.pumps[pump_name].set_valve_position(self.pumps[pump_name].initialize_valve_position,
+                                                                        secure=secure)
+                               for pump_name in to_initialize))
+        await self.wait_until_all_pumps_idle()
+
+        await apply_command(to_initialize, 'initialize_no_valve', wait=False)
+        await self.wait_until_all_pumps_idle()
+
+        await self.apply_command_to_all_pumps('init_all_pump_parameters', secure=secure)
+        await self.wait_until_all_pumps_idle()
+
+    async def run_on_hubs(self, pump_names, func):
+        """
+        Coroutine version of MultiPumpController.run_on_hubs(), the hubs are handled concurrently from the event loop.
+        The function may return an awaitable, e.g. be a coroutine function.
+
+        Raises:
+            Exception: The first exception raised by the function, once all the hubs are done.
+
+        """
+        async def run_on_hub(hub_pump_names):
+            returns = func(hub_pump_names)
+            if inspect.isawaitable(returns):
+                returns = await returns
+            return returns
+
+        returns = await asyncio.gather(*(run_on_hub(hub_pump_names)
+                                         for hub_pump_names in self.get_pumps_per_hub(pump_names).values()),
+                                       return_exceptions=True)
+        for hub_returns in returns:
+            if isinstance(hub_returns, Exception):
+                raise hub_returns
+        return returns
+
+    async def apply_command_to_pumps_at_once(self, pump_names, command, *args, **kwargs):
+        """
+        Coroutine version of MultiPumpController.apply_command_to_pumps_at_once(), the packets of the different
+        addresses are sent concurrently.
+        """
+        async def apply_to_addressed_pumps(controller, controller_pump_names):
+            func = getattr(controller, command, None)
+            if isinstance(controller, C3000GroupController):
+                try:
+                    inspect.signature(func).bind(*args, **kwargs)
+                except TypeError:
+                    func = None
+                if func is None:
+                    return await self.apply_command_to_pumps(controller_pump_names, command, *args, **kwargs)
+            result = func(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return {pump_name: result for pump_name in controller_pump_names}
+
+        returns = {}
+        for controller_returns in await asyncio.gather(*(apply_to_addressed_pumps(controller, controller_pump_names)
+                                                         for (controller, controller_pump_names)
+                                                         in self.get_addressing(pump_names))):
+            returns.update(controller_returns)
+
+        return {pump_name: returns[pump_name] for pump_name in pump_names}
+
+    async def arm(self, sequences):
+        """
+        Coroutine version of MultiPumpController.arm(), the sequences are loaded concurrently.
+        """
+        returns = await asyncio.gather(*(self.pumps[pump_name].arm_sequence(sequence)
+                                         for pump_name, sequence in sequences.items()))
+        return dict(zip(sequences.keys(), returns))
+
+    async def fire(self, pump_names=None):
+        """
+        Coroutine version of MultiPumpController.fire(), the hubs are triggered concurrently. With hardware_groups,
+        each hub is triggered by a single execute packet when possible.
+        """
+        if pump_names is None:
+            pump_names = [pump_name for pump_name, pump in self.pumps.items() if pump.is_armed()]
+
+        async def fire_on_hub(hub_pump_names):
+            hub = self.pumps[hub_pump_names[0]]._io
+            trigger = None
+            if self.hardware_groups and not self.is_hub_shared(hub):
+                other_armed_pumps = [pump_name for pump_name, pump in self.pumps.items()
+                                     if pump._io is hub and pump.is_armed() and pump_name not in hub_pump_names]
+                addressing = self.get_addressing(hub_pump_names)
+                if len(addressing) == 1 and isinstance(addressing[0][0], C3000GroupController):
+                    trigger = addressing[0][0]
+                elif not other_armed_pumps:
+                    all_hub_pump_names = [pump_name for pump_name, pump in self.pumps.items() if pump._io is hub]
+                    trigger = self._get_group_controller(hub, C3000Broadcast, all_hub_pump_names)
+
+            start_times = {}
+            if trigger is not None:
+                await trigger.fire()
+                now = self._clock.time()
+                start_times = {pump_name: now for pump_name in hub_pump_names}
+            else:
+                for pump_name in hub_pump_names:
+                    await self.pumps[pump_name].fire()
+                    start_times[pump_name] = self._clock.time()
+            return start_times
+
+        start_times = {}
+        for hub_start_times in await self.run_on_hubs(pump_names, fire_on_hub):
+            start_times.update(hub_start_times)
+        return start_times
+
+    async def wait_until_pumps_idle(self, pump_names):
+        """
+        Coroutine version of MultiPumpController.wait_until_pumps_idle(), the pumps are waited for concurrently.
+        """
+        completion_times = {}
+
+        async def wait_until_idle(pump_name):
+            await self.pumps[pump_name].wait_until_idle()
+            completion_times[pump_name] = self._clock.time()
+
+        await asyncio.gather(*(wait_until_idle(pump_name) for pump_name in pump_names))
+        return completion_times
+
+    async def run_pipelines(self, moves, wait=True):
+        """
+        Coroutine version of MultiPumpController.run_pipelines(), each pump runs its moves in its own task. A move
+        may return an awaitable, e.g. a functools.partial of AsyncC3000Controller.pump().
+        """
+        completion_times = {}
+
+        async def run_pipeline(pump_name, pump_moves):
+            pump = self.pumps[pump_name]
+            for move in pump_moves:
+                await pump.wait_until_idle()
+                started = move()
+                if inspect.isawaitable(started):
+                    started = await started
+                _check_move(pump_name, started)
+            if wait:
+                await pump.wait_until_idle()
+                completion_times[pump_name] = self._clock.time()
+
+        await asyncio.gather(*(run_pipeline(pump_name, pump_moves) for pump_name, pump_moves in moves.items()))
+        return completion_times
+
+    async def wait_until_all_pumps_idle(self):
+        """
+        Coroutine version of MultiPumpController.wait_until_all_pumps_idle()
+        """
+        await self.apply_command_to_all_pumps('wait_until_idle')
+
+    async def wait_until_group_idle(self, group_name):
+        """
+        Coroutine version of MultiPumpController.wait_until_group_idle()
+        """
+        return await self.wait_until_pumps_idle(self.groups[group_name])
+
+    async def terminate_all_pumps(self):
+        """
+        Coroutine version of MultiPumpController.terminate_all_pumps()
+        """
+        if self.hardware_groups:
+            await self.apply_command_to_pumps_at_once(list(self.pumps.keys()), 'terminate')
+        else:
+            await self.apply_command_to_all_pumps('terminate')
+
+    async def are_pumps_idle(self):
+        """
+        Coroutine version of MultiPumpController.are_pumps_idle()
+        """
+        return all((await self.apply_command_to_all_pumps('is_idle')).values())
+
+    async def are_pumps_busy(self):
+        """
+        Coroutine version of MultiPumpController.are_pumps_busy()
+        """
+        return not await self.are_pumps_idle()
+
+    async def pump(self, pump_names, volume_in_ml, from_valve=None, speed_in=None, wait=False, secure=True,
+                   chained=False):
+        """
+        Coroutine version of MultiPumpController.pump()
+        """
+        await self.apply_command_to_pumps(pump_names, 'pump', volume_in_ml, from_valve=from_valve, speed_in=speed_in,
+                                          wait=wait, secure=secure, chained=chained)
+
+    async def deliver(self, pump_names, volume_in_ml, to_valve=None, speed_out=None, wait=False, secure=True,
+                      chained=False):
+        """
+        Coroutine version of MultiPumpController.deliver()
+        """
+        await self.apply_command_to_pumps(pump_names, 'deliver', volume_in_ml, to_valve=to_valve, speed_out=speed_out,
+                                          wait=wait, secure=secure, chained=chained)
+
+    async def transfer(self, pump_names, volume_in_ml, from_valve, to_valve, speed_in=None, speed_out=None,
+                       secure=True, chained=False, progress=None):
+        """
+        Coroutine version of MultiPumpController.transfer(), the strokes are planned once, from the room left in
+        the syringes.
+        """
+        pumps = self.get_pumps(pump_names)
+        if not pumps:
+            return
+        # The pump with the least room left sets the volume of the strokes
+        remaining_volumes = await self.apply_command_to_pumps(pump_names, '_get_remaining_volume')
+        pump_name = min(pump_names, key=remaining_volumes.get)
+        plan = await self.pumps[pump_name].plan_transfer(volume_in_ml, from_valve, to_valve, speed_in, speed_out,
+                                                         stroke_volume=remaining_volumes[pump_name])
+
+        volume_transferred = 0.0
+        for (index, stroke) in enumerate(plan):
+            if chained:
+                await asyncio.gather(*(pump._append_stroke(pump.sequence(), *stroke).execute() for pump in pumps))
+                await self.wait_until_pumps_idle(pump_names)
+            else:
+                await self.pump(pump_names, stroke.volume_in_ml, from_valve, speed_in=speed_in, wait=True,
+                                secure=secure)
+                await self.deliver(pump_names, stroke.volume_in_ml, to_valve, speed_out=speed_out, wait=True,
+                                   secure=secure)
+            volume_transferred += stroke.volume_in_ml
+            if progress is not None:
+                progress(TransferProgress(index + 1, len(plan), volume_transferred, volume_in_ml))
+
+    async def parallel_transfer(self, pumps_and_volumes_dict: dict, from_valve: str, to_valve: str,
+                                speed_in=None, speed_out=None, secure=True, wait=False, sync=False, chained=False):
+        """
+        Coroutine version of MultiPumpController.parallel_transfer(), the strokes of each pump are planned once the
+        pumps are idle, and run in a task per pump unless sync is set.
+        """
+        pump_names = list(pumps_and_volumes_dict.keys())
+        for pump_name in pump_names:
+            if pump_name not in self.pumps:
+                self.logger.warning(f"Pump specified {pump_name} not found in the controller! (Available: {self.pumps}")
+                return False
+
+        await self.wait_until_pumps_idle(pump_names)
+        moves = {}
+        for pump_name, pump_target_volume in pumps_and_volumes_dict.items():
+            pump = self.pumps[pump_name]
+            plan = await pump.plan_transfer(pump_target_volume, from_valve, to_valve, speed_in, speed_out)
+            moves[pump_name] = collections.deque(self._get_stroke_moves(pump, plan, secure and sync, chained))
+
+        if sync:
+            while any(moves.values()):
+                started = [pump_name for pump_name in pump_names if moves[pump_name]]
+                results = await asyncio.gather(*(moves[pump_name].popleft()() for pump_name in started))
+                for (pump_name, result) in zip(started, results):
+                    _check_move(pump_name, result)
+                if any(moves.values()) or wait:
+                    await self.wait_until_pumps_idle(started)
+        else:
+            await self.run_pipelines(moves, wait=wait)
@@ -0,0 +1,107 @@
+"""
+.. module:: clock
+   :platform: Unix
+   :synopsis: A module providing the clocks used by the controllers to sleep and measure time.
+
+.. moduleauthor:: Jonathan Grizou <Jonathan.Grizou@gla.ac.uk>
+
+"""
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+
+class SystemClock(object):
+    """
+    This class represents the real time, measured with time.monotonic().
+    """
+    def time(self):
+        """
+        Gets the current time.
+
+        Returns:
+            now (float): The current time in seconds.
+
+        """
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        """
+        Sleeps for the given time.
+
+        Args:
+            seconds (float): The time to sleep, in seconds.
+
+        """
+        time.sleep(seconds)
+
+    def wait(self, condition, timeout):
+        """
+        Waits for a threading.Condition to be notified, at most timeout seconds. The condition must be acquired.
+
+        Args:
+            condition (threading.Condition): The condition.
+
+            timeout (float): The maximum time to wait, in seconds.
+
+        """
+        condition.wait(timeout)
+
+
+class VirtualClock(object):
+    """
+    This class represents a simulated time, which only advances when the program sleeps. Sleeping returns
+    immediately after moving the clock forward, so a program waiting on simulated pumps (see pycont.sim) runs as fast
+    as it computes while measuring the time it would take on real hardware.
+
+    The clock follows a single thread of control: concurrent sleeps are added up, not overlapped. The controllers on a
+    VirtualClock therefore handle their hubs, and poll their pumps, from the calling thread.
+
+    Args:
+        start (float): The initial time, default set to 0.
+
+    """
+    def __init__(self, start=0.0):
+        self._lock = threading.Lock()
+        self._now = float(start)
+
+    def time(self):
+        """
+        Gets the current simulated time.
+
+        Returns:
+            now (float): The current time in seconds.
+
+        """
+        return self._now
+
+    def sleep(self, seconds):
+        """
+        Moves the clock forward.
+
+        Args:
+            seconds (float): The time to sleep, in seconds.
+
+        """
+        if seconds > 0:
+            with self._lock:
+                self._now += seconds
+
+    def wait(self, condition, timeout):
+        """
+        Moves the clock forward by timeout, the condition is not waited for. The condition is released meanwhile so
+        other threads can notify it.
+
+        Args:
+            condition (threading.Condition): The condition.
+
+            timeout (float): The maximum time to wait, in seconds.
+
+        """
+        self.sleep(timeout)
+        condition.wait(0)
+
+
+#: The clock used when none is given
+DEFAULT_CLOCK = SystemClock()
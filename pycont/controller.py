@@ -11,12 +11,23 @@
 
 import time
 import json
-import serial
+import queue
+import inspect
+import itertools
+import functools
+import collections
 import threading
+import concurrent.futures
 
 from ._logger import create_logger
 
 from . import pump_protocol
+from . import dtprotocol
+from .clock import DEFAULT_CLOCK, VirtualClock
+from .operation import PumpOperation, all_of, get_poller, next_poll_time
+from . import retry
+from .retry import RetryPolicy, PumpDeadlineError
+from .transport import open_transport
 
 #: Represents the Broadcast of the C3000
 C3000Broadcast = '_'
@@ -41,6 +52,41 @@ C3000SwitchToAddress = {
     'BROADCAST': C3000Broadcast,
 }
 
+
+def dual_group_address(address):
+    """
+    Gets the address of the dual group of a pump, reaching pumps 1-2, 3-4, ... at once.
+
+    Args:
+        address (chr): The address of the pump, see C3000SwitchToAddress.
+
+    Returns:
+        group_address (chr): The group address ('A', 'C', 'E', ...).
+
+    """
+    base = ord(address) - ord('1')
+    return chr(ord('A') + 2 * (base // 2))
+
+
+def quad_group_address(address):
+    """
+    Gets the address of the quad group of a pump, reaching pumps 1-4, 5-8, ... at once.
+
+    Args:
+        address (chr): The address of the pump, see C3000SwitchToAddress.
+
+    Returns:
+        group_address (chr): The group address ('Q', 'U', 'Y' or ']').
+
+    """
+    base = ord(address) - ord('1')
+    return chr(ord('Q') + 4 * (base // 4))
+
+
+#: Commands of the pumps which can be sent to several pumps at once, see C3000GroupController
+GROUP_COMMANDS = ('terminate', 'pump', 'deliver', 'go_to_volume', 'set_valve_position', 'set_top_velocity',
+                  'initialize_valve_only', 'initialize_no_valve')
+
 #: Input for the valve
 VALVE_INPUT = 'I'
 #: Output for the valve
@@ -71,21 +117,50 @@ MAX_TOP_VELOCITY_MICRO_STEP_MODE_2 = 48000
 DEFAULT_IO_BAUDRATE = 9600
 #: Default timeout for I/O operations
 DEFAULT_IO_TIMEOUT = 1
+#: Longest time (in seconds) a read of the port blocks, the timeout of a response is enforced by PumpIO.readline()
+IO_READ_POLL_TIME = 0.01
 
 #: Specifies a time to wait
 WAIT_SLEEP_TIME = 0.1
+#: Time to wait between polls close to the predicted end of a move
+PREDICTIVE_WAIT_SLEEP_TIME = 0.01
+#: Polling starts this long (in seconds) before the predicted end of a move...
+PREDICTIVE_WAIT_MARGIN = 0.05
+#: ...plus this fraction of the predicted duration of the move
+PREDICTIVE_WAIT_RATIO = 0.05
+#: Time (in seconds) after a timeout during which the late reply of the pump is waited for before the next request
+LATE_REPLY_WINDOW = 0.1
+#: Time (in seconds) after a timeout during which a response is checked against the late reply of the pump
+LATE_REPLY_MAX_AGE = 5
 #: Sets the maximum number of attempts to Write and Read
 MAX_REPEAT_WRITE_AND_READ = 10
 #: Sets the maximum time to repeat a specific operation
 MAX_REPEAT_OPERATION = 10
 
+#: Priority of urgent requests in a PumpIODispatcher (lowest values are sent first)
+DISPATCHER_PRIORITY_HIGH = 0
+#: Default priority of requests in a PumpIODispatcher
+DISPATCHER_PRIORITY_NORMAL = 10
+#: Priority of background requests in a PumpIODispatcher
+DISPATCHER_PRIORITY_LOW = 20
+
 
 class PumpIO(object):
     """
     This class deals with the pump I/O instructions.
 
+    The input is not flushed before each request. Frames received outside of a transaction are discarded and counted
+    in stale_frames, the replies arriving after their request timed out are waited for during LATE_REPLY_WINDOW
+    before the next request and counted in late_frames, and responses which cannot answer the request sent (see
+    pump_protocol.is_reply_to()) are skipped.
+
+    The timed out requests are remembered for LATE_REPLY_MAX_AGE. A response which could answer one of them as well
+    as the request sent is only taken once the timeout is over: if a second reply comes meanwhile, the first one was
+    the late reply and is discarded. A late reply is thus not taken for the reply of the next request.
+
     Args:
-        port (int): The port number
+        port (int): The port number, or the address of a device server, e.g. 'tcp://192.168.0.10:4001' (see
+            pycont.transport)
 
         baudrate (int): Baudrate of the communication, default set to DEFAULT_IO_BAUDRATE(9600)
 
@@ -100,7 +175,15 @@ class PumpIO(object):
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
-        self._serial = None
+        self._transport = None
+        self._parser = dtprotocol.DTFrameParser()
+
+        self.late_reply_window = LATE_REPLY_WINDOW
+        # (time of the timeout, frame) of the requests which timed out, their reply may still come
+        self._owed_replies = collections.deque()
+        self._late_reply_deadline = None
+        self.stale_frames = 0
+        self.late_frames = 0
 
         self.open(port, baudrate, timeout)
 
@@ -109,13 +192,16 @@ class PumpIO(object):
         """
         Sets details laid out in the configuration .json file
 
+        The PumpIO is obtained from the process-wide pump_io_registry: a port already open in the process is shared
+        instead of being opened again. Call release() once done with it.
+
         Args:
             cls (Class): The initialising class.
 
             io_config (Dict): Dictionary holding the configuration data.
 
         Returns:
-            PumpIO: New PumpIO object with the variables set from the configuration file.
+            PumpIO: The PumpIO of the port, with the variables set from the configuration file.
 
         """
         port = io_config['port']
@@ -130,7 +216,7 @@ class PumpIO(object):
         else:
             timeout = DEFAULT_IO_TIMEOUT
 
-        return cls(port, baudrate, timeout)
+        return pump_io_registry.acquire(cls, port, baudrate, timeout)
 
     @classmethod
     def from_configfile(cls, io_configfile):
@@ -178,10 +264,11 @@ class PumpIO(object):
 
             baudrate (int): The baudrate of the communication, default set to DEFAULT_IO_BAUDRATE(9600).
 
-            timeout (int): The timeout of the communication, default set to DEFAULT_IO_TIMEOUT(1).
+            timeout (int): The timeout of the communication, default set to DEFAULT_IO_TIMEOUT(1). It is applied by
+                readline(), the reads of the port block at most IO_READ_POLL_TIME so the port is configured once.
 
         """
-        self._serial = serial.Serial(port, baudrate, timeout=timeout)
+        self._transport = open_transport(port, baudrate, IO_READ_POLL_TIME)
         self.logger.debug("Opening port '%s'", self.port,
                           extra={'port': self.port,
                                  'baudrate': self.baudrate,
@@ -191,56 +278,218 @@ class PumpIO(object):
         """
         Closes the communication with the hardware.
         """
-        self._serial.close()
+        self._transport.close()
         self.logger.debug("Closing port '%s'", self.port,
                           extra={'port': self.port,
                                  'baudrate': self.baudrate,
                                  'timeout': self.timeout})
 
+    def release(self):
+        """
+        Releases a PumpIO obtained from from_config(), the port is closed once released by all its users.
+        """
+        pump_io_registry.release(self)
+
     def flushInput(self):
         """
         Flushes the input buffer of the serial communication.
         """
-        self._serial.flushInput()
+        self._transport.reset_input_buffer()
+        self._parser.clear()
+
+    def _read_pending(self):
+        """
+        Reads the bytes already received, without waiting.
+
+        Returns:
+            data (bytes): The bytes received.
+
+        """
+        waiting = self._transport.in_waiting
+        return self._transport.read(waiting) if waiting else b''
+
+    def _owe_reply(self, frame):
+        """
+        Records that the reply to a timed out request may still come.
+
+        Args:
+            frame (bytes): The encoded packet of the request.
+
+        """
+        now = time.monotonic()
+        self._owed_replies.append((now, frame))
+        self._late_reply_deadline = now + self.late_reply_window
+
+    def _find_owed_reply(self, response):
+        while self._owed_replies and time.monotonic() - self._owed_replies[0][0] > LATE_REPLY_MAX_AGE:
+            self._owed_replies.popleft()
+        for (index, (_, frame)) in enumerate(self._owed_replies):
+            if pump_protocol.is_reply_to(frame, response):
+                return index
+        return None
+
+    def _discard_frame(self, frame):
+        index = self._find_owed_reply(frame)
+        if index is not None:
+            del self._owed_replies[index]
+            self.late_frames += 1
+            self.logger.debug("Discarding late reply %s", frame)
+        else:
+            self.stale_frames += 1
+            self.logger.debug("Discarding stale frame %s", frame)
+
+    def _sort_response(self, frame, response, candidate=None):
+        """
+        Sorts a response received while waiting for the reply to a request.
+
+        Args:
+            frame (bytes): The encoded packet of the request.
+
+            response (bytes): The response received.
+
+            candidate (bytes): The response received before, which could also be a late reply, default set to None.
+
+        Returns:
+            reply (bytes): The reply to the request, None if there is none yet.
+
+            candidate (bytes): The response which is the reply unless another one comes, None if there is none.
+
+        """
+        if not pump_protocol.is_reply_to(frame, response):
+            self._discard_frame(response)
+            return (None, candidate)
+        if candidate is not None:
+            # Two replies came, the first one was the late reply
+            self._discard_frame(candidate)
+        if self._find_owed_reply(response) is None:
+            return (response, None)
+        return (None, response)
+
+    def _take_candidate(self, frame, candidate):
+        """
+        Takes for the reply a response which could also be a late reply, no other reply having come before the
+        timeout. One of the two replies is still owed, it is the reply of the request from then on.
+
+        Args:
+            frame (bytes): The encoded packet of the request.
+
+            candidate (bytes): The response.
+
+        Returns:
+            reply (bytes): The candidate.
+
+        """
+        index = self._find_owed_reply(candidate)
+        if index is not None:
+            del self._owed_replies[index]
+        self._owed_replies.append((time.monotonic(), frame))
+        return candidate
+
+    def _discard_received_frames(self):
+        """
+        Discards the frames received since the last transaction. Partial frames are kept to be completed.
+        """
+        self._parser.feed(self._read_pending())
+        frame = self._parser.next_frame()
+        while frame is not None:
+            self._discard_frame(frame)
+            frame = self._parser.next_frame()
+
+    def _settle(self):
+        """
+        Discards the frames received since the last transaction and waits for the replies still owed to timed out
+        requests, until LATE_REPLY_WINDOW after the last timeout.
+        """
+        self._discard_received_frames()
+        while self._owed_replies:
+            remaining = self._late_reply_deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                self._discard_frame(self.readline(remaining))
+            except PumpIOTimeOutError:
+                break
 
     def write(self, packet):
         """
-        Writes a packet along the serial communication.
+        Writes a packet along the communication.
 
         Args:
-            packet (DTInstructionPacket): The packet to send along the serial communication.
+            packet (DTInstructionPacket): The packet to send along the serial communication. Frames forged by
+                C3000Protocol (DTFrame) are already encoded and are written as is.
 
-        .. note:: Unsure if this is the correct packet type (GAK).
+        Raises:
+            PumpIOConnectionError: The port or the device server cannot be reached.
 
         """
         str_to_send = packet.to_string()
-        self.logger.debug("Sending {}".format(str_to_send))
-        self._serial.write(str_to_send)
+        self.logger.debug("Sending %s", str_to_send)
+        try:
+            self._transport.write(str_to_send)
+        except OSError as err:
+            raise PumpIOConnectionError('Cannot write to {}: {}'.format(self.port, err)) from err
 
-    def readline(self):
+    def readline(self, timeout=None):
         """
-        Reads a line from the serial communication.
+        Reads a response frame from the serial communication.
+
+        Bytes are read as soon as they are available and the frame is returned as soon as its ETX byte is received,
+        without waiting for the line ending. Bytes received after the frame are kept for the next call.
+
+        Args:
+            timeout (float): The time to wait for the frame, default set to None for the timeout of the PumpIO.
+
+        Returns:
+            msg (bytes): The response frame, from '/0' to the ETX byte.
 
         Raises:
             PumpIOTimeOutError: If the response time is greater than the timeout threshold.
 
         """
-        msg = self._serial.readline()
+        if timeout is None:
+            timeout = self.timeout
+
+        msg = self._parser.next_frame()
+        deadline = time.monotonic() + timeout
+        while msg is None and time.monotonic() < deadline:
+            try:
+                chunk = self._transport.read(self._transport.in_waiting or 1)
+            except ConnectionError as err:
+                # Nothing can be received until the next write connects again
+                self.logger.debug("Readline failed: %s", err)
+                raise PumpIOConnectionError('Cannot read from {}: {}'.format(self.port, err)) from err
+            if chunk:
+                self._parser.feed(chunk)
+                msg = self._parser.next_frame()
         if msg:
-            self.logger.debug("Received {}".format(msg))
+            self.logger.debug("Received %s", msg)
             return msg
         else:
             self.logger.debug("Readline timeout!")
             raise PumpIOTimeOutError
 
+    def write_without_reply(self, packet):
+        """
+        Writes a packet which gets no response, i.e. sent to the broadcast or to a group address.
+
+        Args:
+            packet (DTInstructionPacket): The packet to be written.
+
+        """
+        with self.lock:
+            self._settle()
+            self.write(packet)
+
     ##
-    def write_and_readline(self, packet):
+    def write_and_readline(self, packet, timeout=None):
         """
         Writes a packet along the serial communication and waits for a response.
 
         Args:
             packet (DTInstructionPacket): The packet to be written.
 
+            timeout (float): The time to wait for the response, default set to None for the timeout of the PumpIO.
+
         .. note:: Unsure if this is the correct packet type (GAK).
 
         Returns:
@@ -249,16 +498,248 @@ class PumpIO(object):
         Raises:
             PumpIOTimeOutError: If the response time is greater than the timeout threshold.
         """
-        self.lock.acquire()
-        self.flushInput()
-        self.write(packet)
-        try:
-            response = self.readline()
-            self.lock.release()
-            return response
-        except PumpIOTimeOutError as err:
-            self.lock.release()
-            raise err
+        if timeout is None:
+            timeout = self.timeout
+        frame = packet.to_string()
+        with self.lock:
+            self._settle()
+            self.write(packet)
+            deadline = time.monotonic() + timeout
+            candidate = None
+            while True:
+                try:
+                    response = self.readline(max(0, deadline - time.monotonic()))
+                except PumpIOTimeOutError:
+                    if candidate is not None:
+                        return self._take_candidate(frame, candidate)
+                    # The reply may still come, it must not be taken for the reply of the next request
+                    self._owe_reply(frame)
+                    raise
+                (reply, candidate) = self._sort_response(frame, response, candidate)
+                if reply is not None:
+                    return reply
+
+
+class PumpIODispatcher(object):
+    """
+    This class owns the communication of one hub in a dedicated thread, which sends the requests of all callers from
+    a priority queue. Callers get a concurrent.futures.Future back instead of blocking on the I/O lock.
+
+    Identical report queries waiting in the queue (e.g. several threads polling the status of the same pump) are
+    coalesced and answered by a single transaction.
+
+    The dispatcher exposes write_and_readline() and can therefore be given to a C3000Controller in place of a PumpIO.
+
+    Args:
+        pump_io (PumpIO): The I/O of the hub.
+
+    """
+    def __init__(self, pump_io):
+        self.logger = create_logger(self.__class__.__name__)
+
+        self._io = pump_io
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+
+        self._pending_reports_lock = threading.Lock()
+        self._pending_reports = {}
+
+        self._thread = threading.Thread(target=self._run, name='{}-{}'.format(self.__class__.__name__, self.port))
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def port(self):
+        """
+        The port of the underlying PumpIO.
+        """
+        return self._io.port
+
+    def submit(self, packet, priority=DISPATCHER_PRIORITY_NORMAL, reply=True, timeout=None):
+        """
+        Queues a packet to be written, its response will be read by the dispatcher thread.
+
+        Args:
+            packet (DTInstructionPacket): The packet to be written.
+
+            priority (int): Priority of the request, lowest first, default set to DISPATCHER_PRIORITY_NORMAL.
+
+            reply (bool): The packet gets a response, default set to True. False for broadcast and group addresses.
+
+            timeout (float): The time to wait for the response, default set to None for the timeout of the PumpIO.
+                Coalesced report queries use the timeout of the first one.
+
+        Returns:
+            future (concurrent.futures.Future): Resolves to the received response (None without reply), or raises
+                PumpIOTimeOutError.
+
+        """
+        future = concurrent.futures.Future()
+        frame = packet.to_string()
+        if reply and pump_protocol.is_report_frame(frame):
+            with self._pending_reports_lock:
+                waiting = self._pending_reports.get(frame)
+                if waiting is not None:
+                    waiting.append(future)
+                    return future
+                self._pending_reports[frame] = [future]
+        self._queue.put((priority, next(self._counter), packet, future, reply, timeout))
+        return future
+
+    def write_and_readline(self, packet, timeout=None):
+        """
+        Writes a packet through the dispatcher and waits for a response, see PumpIO.write_and_readline()
+
+        Args:
+            packet (DTInstructionPacket): The packet to be written.
+
+            timeout (float): The time to wait for the response, default set to None for the timeout of the PumpIO.
+
+        Returns:
+            response (str): The received response.
+
+        Raises:
+            PumpIOTimeOutError: If the response time is greater than the timeout threshold.
+
+        """
+        return self.submit(packet, timeout=timeout).result()
+
+    def write_without_reply(self, packet):
+        """
+        Writes a packet which gets no response through the dispatcher, see PumpIO.write_without_reply()
+
+        Args:
+            packet (DTInstructionPacket): The packet to be written.
+
+        """
+        self.submit(packet, reply=False).result()
+
+    def close(self):
+        """
+        Stops the dispatcher thread once the requests already queued are sent. The PumpIO is left open.
+        """
+        self._queue.put((float('inf'), next(self._counter), None, None, False, None))
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            (_, _, packet, future, reply, timeout) = self._queue.get()
+            if packet is None:
+                return
+
+            frame = packet.to_string()
+            if reply and pump_protocol.is_report_frame(frame):
+                with self._pending_reports_lock:
+                    futures = self._pending_reports.pop(frame)
+            else:
+                futures = [future]
+
+            futures = [f for f in futures if f.set_running_or_notify_cancel()]
+            if not futures:
+                continue
+
+            try:
+                if reply:
+                    response = self._io.write_and_readline(packet, timeout)
+                else:
+                    response = self._io.write_without_reply(packet)
+            except Exception as err:
+                for f in futures:
+                    f.set_exception(err)
+            else:
+                for f in futures:
+                    f.set_result(response)
+
+
+class PumpIORegistry(object):
+    """
+    This class holds the PumpIO open in the process, by port, so the controllers using the pumps of a same hub share
+    its connection and its lock instead of opening the port again.
+
+    A port is opened when first acquired and closed when released by all the controllers which acquired it.
+
+    """
+    def __init__(self):
+        self.logger = create_logger(self.__class__.__name__)
+
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def __contains__(self, port):
+        return port in self._entries
+
+    def acquire(self, io_class, port, baudrate=DEFAULT_IO_BAUDRATE, timeout=DEFAULT_IO_TIMEOUT):
+        """
+        Gets the PumpIO of a port, opening it if no other controller uses it.
+
+        Args:
+            io_class (Class): The class of PumpIO to open, e.g. PumpIO or AsyncPumpIO.
+
+            port (str): The port.
+
+            baudrate (int): Baudrate of the communication, default set to DEFAULT_IO_BAUDRATE(9600).
+
+            timeout (int): The timeout of communication, default set to DEFAULT_IO_TIMEOUT(1). A shared PumpIO keeps
+                the timeout it was opened with.
+
+        Returns:
+            PumpIO: The PumpIO of the port.
+
+        Raises:
+            ValueError: The port is already open with another class or baudrate.
+
+        """
+        with self._lock:
+            entry = self._entries.get(port)
+            if entry is None:
+                entry = self._entries[port] = [io_class(port, baudrate, timeout), 0]
+            else:
+                pump_io = entry[0]
+                if type(pump_io) is not io_class or pump_io.baudrate != baudrate:
+                    raise ValueError('Port {} is already open as {} at {} baud'.format(
+                        port, type(pump_io).__name__, pump_io.baudrate))
+                self.logger.debug("Sharing port '%s'", port)
+            entry[1] += 1
+            return entry[0]
+
+    def is_shared(self, pump_io):
+        """
+        Determines if a PumpIO is used by several controllers of the process.
+
+        Args:
+            pump_io (PumpIO): The PumpIO.
+
+        Returns:
+            True (bool): The PumpIO was acquired more times than released.
+
+            False (bool): A single controller uses the PumpIO, or it was not acquired from the registry.
+
+        """
+        with self._lock:
+            entry = self._entries.get(pump_io.port)
+            return entry is not None and entry[0] is pump_io and entry[1] > 1
+
+    def release(self, pump_io):
+        """
+        Releases a PumpIO, it is closed once released as many times as acquired. A PumpIO which was not acquired from
+        the registry is closed at once.
+
+        Args:
+            pump_io (PumpIO): The PumpIO.
+
+        """
+        with self._lock:
+            entry = self._entries.get(pump_io.port)
+            if entry is not None and entry[0] is pump_io:
+                entry[1] -= 1
+                if entry[1] > 0:
+                    return
+                del self._entries[pump_io.port]
+        pump_io.close()
+
+
+#: The PumpIO open in the process, see PumpIO.from_config()
+pump_io_registry = PumpIORegistry()
 
 
 class PumpIOTimeOutError(Exception):
@@ -268,6 +749,14 @@ class PumpIOTimeOutError(Exception):
     pass
 
 
+class PumpIOConnectionError(PumpIOTimeOutError):
+    """
+    Exception for when the hub cannot be reached, e.g. its device server is down. As no response can come, the
+    requests are retried as after a timeout.
+    """
+    pass
+
+
 class ControllerRepeatedError(Exception):
     """
     Exception for when there has been too many repeat attempts.
@@ -275,6 +764,14 @@ class ControllerRepeatedError(Exception):
     pass
 
 
+class PumpUnhealthyError(ControllerRepeatedError):
+    """
+    Exception for when a pump failed repeatedly and is not contacted until its recovery time is over, see
+    RetryPolicy.
+    """
+    pass
+
+
 class PumpHWError(Exception):
     """
     Exception for when the pump encounters an hardware error.
@@ -307,79 +804,599 @@ class PumpHWError(Exception):
             print("** ERROR ** Unknown error")
 
 
-class C3000Controller(object):
+class C3000ShadowState(object):
     """
-    This class represents the main controller for the C3000.
-    The controller is what controls the pumps.
-
-    Args:
-        pump_io (PumpIO): PumpIO object for communication.
-
-        name (str): The name of the controller.
-
-        address (str): Address of the controller.
-
-        total_volume (float): Total volume of the pump.
+    This class holds the last known state of a pump, as set by the commands sent to it and by the reports read from
+    it. Unknown values are None.
 
-        micro_step_mode (int): The mode which the microstep will use, default set to MICRO_STEP_MODE_2 (2)
+    Attributes:
+        valve_position (str): Position of the valve.
 
-        top_velocity (int): The top velocity of the pump, default set to 6000
+        top_velocity (int): Top velocity of the plunger.
 
-        initialize_valve_position (chr): Sets the valve position, default set to VALVE_INPUT ('I')
+        plunger_position (int): Position of the plunger in steps, once the current move is over.
 
-    Raises:
-        ValueError: Invalid microstep mode.
+        initialized (bool): Whether the pump is initialized.
 
     """
-    def __init__(self, pump_io, name, address, total_volume, micro_step_mode=MICRO_STEP_MODE_2, top_velocity=6000,
-                 initialize_valve_position=VALVE_INPUT):
-        self.logger = create_logger(self.__class__.__name__)
-
-        self._io = pump_io
+    def __init__(self):
+        self.invalidate()
 
-        self.name = name
+    def __str__(self):
+        return "valve: {} top velocity: {} plunger position: {} initialized: {}".format(
+            self.valve_position, self.top_velocity, self.plunger_position, self.initialized)
 
-        self.address = address
-        self._protocol = pump_protocol.C3000Protocol(self.address)
+    def invalidate(self):
+        """
+        Forgets everything known about the pump.
+        """
+        self.valve_position = None
+        self.top_velocity = None
+        self.plunger_position = None
+        self.initialized = None
 
-        self.initialize_valve_position = initialize_valve_position
+    def copy(self):
+        """
+        Returns:
+            C3000ShadowState: A copy of the state.
 
-        self.micro_step_mode = micro_step_mode
-        if self.micro_step_mode == MICRO_STEP_MODE_0:
-            self.number_of_steps = int(N_STEP_MICRO_STEP_MODE_0)  # float
-        elif self.micro_step_mode == MICRO_STEP_MODE_2:
-            self.number_of_steps = int(N_STEP_MICRO_STEP_MODE_2)  # float
-        else:
-            raise ValueError('Microstep mode {} is not handled'.format(self.micro_step_mode))
+        """
+        state = C3000ShadowState()
+        state.__dict__.update(self.__dict__)
+        return state
 
-        self.total_volume = float(total_volume)  # in ml (float)
-        self.steps_per_ml = int(self.number_of_steps / self.total_volume)
+    def to_tuple(self):
+        """
+        Returns:
+            (valve_position, top_velocity, plunger_position, initialized) (tuple): The state as a tuple.
 
-        self.default_top_velocity = top_velocity
+        """
+        return self.valve_position, self.top_velocity, self.plunger_position, self.initialized
 
-    @classmethod
-    def from_config(cls, pump_io, pump_name, pump_config):
+    def track_command(self, dtcommand):
         """
-        Obtains the configuration data.
+        Updates the state with the effect of a single command, loops excluded (see track_commands()).
 
         Args:
-            cls (Class): The initialising class.
+            dtcommand (DTCommand): The command.
+
+        """
+        command = dtcommand.command.decode()
+        operand = dtcommand.operand.decode() if dtcommand.operand is not None else None
+        if command == pump_protocol.CMD_TOPVELOCITY:
+            self.top_velocity = int(operand)
+        elif command in (VALVE_INPUT, VALVE_OUTPUT, VALVE_BYPASS, VALVE_EXTRA):
+            self.valve_position = operand if operand in VALVE_6WAY_LIST else command
+        elif command == pump_protocol.CMD_MOVE_TO:
+            self.plunger_position = int(operand)
+        elif command == pump_protocol.CMD_PUMP and self.plunger_position is not None:
+            self.plunger_position += int(operand)
+        elif command == pump_protocol.CMD_DELIVER and self.plunger_position is not None:
+            self.plunger_position -= int(operand)
+        elif command in (pump_protocol.CMD_INITIALIZE_VALVE_RIGHT, pump_protocol.CMD_INITIALIZE_VALVE_LEFT,
+                         pump_protocol.CMD_INITIALIZE_NO_VALVE):
+            # The plunger is homed, the valve may have been moved on the way
+            self.plunger_position = 0
+            self.valve_position = None
+        elif command == pump_protocol.CMD_INITIALIZE_VALVE_ONLY:
+            self.valve_position = None
+
+    def track_commands(self, dtcommands):
+        """
+        Updates the state with the effect of commands accepted by the pump, loops included.
 
-            pump_io (PumpIO): PumpIO object.
+        Args:
+            dtcommands (list): List of DTCommand, in the order they are sent.
 
-            pump_name (str): Name of the pump.
+        """
+        run_commands(dtcommands, self)
 
-            pump_config (Dict): Dictionary containing the pump configuration data.
 
-        Returns:
-            C3000Controller: New C3000Controller object with the data set from the configuration.
+def parse_loops(dtcommands):
+    """
+    Nests the commands of a sequence according to its loops.
 
-        """
-        pump_config['address'] = C3000SwitchToAddress[pump_config['switch']]
-        del(pump_config['switch'])
+    Args:
+        dtcommands (list): List of DTCommand, in the order they are sent.
 
-        pump_config['total_volume'] = float(pump_config['volume'])  # in ml (float)
-        del(pump_config['volume'])
+    Returns:
+        items (list): The DTCommand outside of any loop, and a (repeat, items) tuple for each loop, repeat being 0
+            for a loop running until terminated.
+
+    Raises:
+        ValueError: The loops are not balanced.
+
+    """
+    stack = [[]]
+    for dtcommand in dtcommands:
+        command = dtcommand.command.decode()
+        if command == pump_protocol.CMD_LOOP_START:
+            stack.append([])
+        elif command == pump_protocol.CMD_LOOP_END:
+            if len(stack) == 1:
+                raise ValueError('Loop end without loop start')
+            items = stack.pop()
+            stack[-1].append((int(dtcommand.operand) if dtcommand.operand is not None else 0, items))
+        else:
+            stack[-1].append(dtcommand)
+    if len(stack) > 1:
+        raise ValueError('Loop start without loop end')
+    return stack[0]
+
+
+def run_commands(dtcommands, state, cost=None):
+    """
+    Plays commands on a shadow state as the pump executes them, loops included.
+
+    A loop is played until two iterations in a row have the same cost and the same effect, the remaining iterations
+    are then accounted for at once, so long loops are cheap to play.
+
+    Args:
+        dtcommands (list): List of DTCommand, in the order they are sent.
+
+        state (C3000ShadowState): The state, updated in place.
+
+        cost (function): Called with each command and the state before it, returns its cost (e.g. its duration) or
+            None if unknown. Default set to None.
+
+    Returns:
+        total (float): The total cost, None if the cost of a command is unknown or if a loop runs until terminated.
+
+    Raises:
+        ValueError: The loops are not balanced.
+
+    """
+    return _run_items(parse_loops(dtcommands), state, cost)
+
+
+def _add_cost(total, cost, times=1):
+    if total is None or cost is None:
+        return None
+    return total + cost * times
+
+
+def _run_items(items, state, cost):
+    total = 0.0
+    for item in items:
+        if isinstance(item, tuple):
+            (repeat, loop_items) = item
+            total = _add_cost(total, _run_loop(repeat, loop_items, state, cost))
+        else:
+            total = _add_cost(total, cost(item, state) if cost is not None else 0.0)
+            state.track_command(item)
+    return total
+
+
+def _run_loop(repeat, items, state, cost):
+    if repeat == 0:
+        # Runs until terminated, the state afterwards is unknown
+        state.invalidate()
+        return None
+
+    total = 0.0
+    previous = None
+    for iteration in range(repeat):
+        before = state.to_tuple()
+        iteration_cost = _run_items(items, state, cost)
+        total = _add_cost(total, iteration_cost)
+        after = state.to_tuple()
+        if before[2] is not None and after[2] is not None:
+            drift = after[2] - before[2]
+        else:
+            drift = None
+        same_state = before[:2] + before[3:] == after[:2] + after[3:]
+        if same_state and previous == (iteration_cost, drift):
+            remaining = repeat - iteration - 1
+            total = _add_cost(total, iteration_cost, remaining)
+            if drift is not None:
+                state.plunger_position += drift * remaining
+            break
+        previous = (iteration_cost, drift)
+    return total
+
+
+class C3000CommandSequence(object):
+    """
+    This class chains several commands for one pump into a single packet, sent to the pump in one round trip.
+    The pump executes the commands one after the other, e.g.
+    ``pump.sequence().velocity(6000).valve('I').pump(0.5).execute()`` sends '/1V6000IP2400R'.
+
+    .. note:: Volumes are not checked against the plunger position before sending, the pump itself rejects a
+              move out of range with an invalid operand error, in which case execute() returns False.
+
+    Args:
+        pump (C3000Controller): The pump the sequence is built for.
+
+    """
+    def __init__(self, pump):
+        self._pump = pump
+        self.dtcommands = []
+        self._loop_depth = 0
+
+    def __str__(self):
+        return self.to_packet().to_string().decode()
+
+    def loop_start(self):
+        """
+        Appends the start of a loop, closed by loop_end().
+
+        Returns:
+            C3000CommandSequence: The sequence itself, for chaining.
+
+        Raises:
+            ValueError: Too many nested loops.
+
+        """
+        if self._loop_depth >= pump_protocol.MAX_LOOP_DEPTH:
+            raise ValueError('Loops cannot be nested more than {} times'.format(pump_protocol.MAX_LOOP_DEPTH))
+        self.dtcommands.append(dtprotocol.DTCommand(pump_protocol.CMD_LOOP_START))
+        self._loop_depth += 1
+        return self
+
+    def loop_end(self, repeat):
+        """
+        Appends the end of the loop, the pump runs the commands since the matching loop_start() repeat times.
+
+        Args:
+            repeat (int): Number of times the loop runs, 0 to run it until the pump is terminated.
+
+        Returns:
+            C3000CommandSequence: The sequence itself, for chaining.
+
+        Raises:
+            ValueError: No loop is open, or repeat is out of range.
+
+        """
+        if self._loop_depth == 0:
+            raise ValueError('No loop to end')
+        if not 0 <= repeat <= pump_protocol.MAX_LOOP_REPEAT:
+            raise ValueError('Loop repeat must be in [0-{}], you entered {}'.format(
+                pump_protocol.MAX_LOOP_REPEAT, repeat))
+        self.dtcommands.append(dtprotocol.DTCommand(pump_protocol.CMD_LOOP_END, str(int(repeat))))
+        self._loop_depth -= 1
+        return self
+
+    def repeat(self, repeat):
+        """
+        Turns the whole sequence into a loop, e.g.
+        ``pump.sequence().valve('I').pump(1).valve('O').deliver(1).repeat(200)`` runs 200 strokes on the pump from
+        a single packet.
+
+        Args:
+            repeat (int): Number of times the sequence runs, 0 to run it until the pump is terminated.
+
+        Returns:
+            C3000CommandSequence: The sequence itself, for chaining.
+
+        Raises:
+            ValueError: A loop is open, too many nested loops, or repeat is out of range.
+
+        """
+        if self._loop_depth > 0:
+            raise ValueError('Cannot repeat a sequence with an open loop')
+        depth = 0
+        for dtcommand in self.dtcommands:
+            if dtcommand.command.decode() == pump_protocol.CMD_LOOP_START:
+                depth += 1
+                if depth >= pump_protocol.MAX_LOOP_DEPTH:
+                    raise ValueError('Loops cannot be nested more than {} times'.format(
+                        pump_protocol.MAX_LOOP_DEPTH))
+            elif dtcommand.command.decode() == pump_protocol.CMD_LOOP_END:
+                depth -= 1
+        self.dtcommands.insert(0, dtprotocol.DTCommand(pump_protocol.CMD_LOOP_START))
+        self._loop_depth += 1
+        return self.loop_end(repeat)
+
+    def delay(self, seconds):
+        """
+        Appends a pause, e.g. to let the liquid settle after a pick-up.
+
+        Args:
+            seconds (float): The duration of the pause, in seconds.
+
+        Returns:
+            C3000CommandSequence: The sequence itself, for chaining.
+
+        Raises:
+            ValueError: The duration is negative.
+
+        """
+        if seconds < 0:
+            raise ValueError('Delay must be positive, you entered {}'.format(seconds))
+        milliseconds = int(round(seconds * 1000))
+        # Longer delays are split, a single delay command is limited to MAX_DELAY
+        while True:
+            delay = min(milliseconds, pump_protocol.MAX_DELAY)
+            self.dtcommands.append(dtprotocol.DTCommand(pump_protocol.CMD_DELAY, str(delay)))
+            milliseconds -= delay
+            if milliseconds <= 0:
+                return self
+
+    def velocity(self, top_velocity):
+        """
+        Appends a change of top velocity.
+
+        Args:
+            top_velocity (int): The top velocity.
+
+        Returns:
+            C3000CommandSequence: The sequence itself, for chaining.
+
+        Raises:
+            ValueError: Top velocity is out of range.
+
+        """
+        self._pump.check_top_velocity_within_range(top_velocity)
+        self.dtcommands.append(dtprotocol.DTCommand(pump_protocol.CMD_TOPVELOCITY, str(int(top_velocity))))
+        return self
+
+    def valve(self, valve_position):
+        """
+        Appends a change of valve position.
+
+        Args:
+            valve_position (str): Position of the valve.
+
+        Returns:
+            C3000CommandSequence: The sequence itself, for chaining.
+
+        Raises:
+            ValueError: The valve position is invalid/unknown.
+
+        """
+        self.dtcommands.append(valve_position_to_dtcommand(valve_position))
+        return self
+
+    def pump(self, volume_in_ml):
+        """
+        Appends a relative pick-up of the given volume.
+
+        Args:
+            volume_in_ml (float): Volume to pump (in mL).
+
+        Returns:
+            C3000CommandSequence: The sequence itself, for chaining.
+
+        """
+        steps = self._pump.volume_to_step(volume_in_ml)
+        self.dtcommands.append(dtprotocol.DTCommand(pump_protocol.CMD_PUMP, str(steps)))
+        return self
+
+    def deliver(self, volume_in_ml):
+        """
+        Appends a relative dispense of the given volume.
+
+        Args:
+            volume_in_ml (float): Volume to deliver (in mL).
+
+        Returns:
+            C3000CommandSequence: The sequence itself, for chaining.
+
+        """
+        steps = self._pump.volume_to_step(volume_in_ml)
+        self.dtcommands.append(dtprotocol.DTCommand(pump_protocol.CMD_DELIVER, str(steps)))
+        return self
+
+    def go_to_volume(self, volume_in_ml):
+        """
+        Appends an absolute move of the plunger to the given volume.
+
+        Args:
+            volume_in_ml (float): The target volume (in mL).
+
+        Returns:
+            C3000CommandSequence: The sequence itself, for chaining.
+
+        Raises:
+            ValueError: The volume is not valid for this syringe.
+
+        """
+        if not self._pump.is_volume_valid(volume_in_ml):
+            raise ValueError('Volume {} is not valid for pump {}'.format(volume_in_ml, self._pump.name))
+        steps = self._pump.volume_to_step(volume_in_ml)
+        self.dtcommands.append(dtprotocol.DTCommand(pump_protocol.CMD_MOVE_TO, str(steps)))
+        return self
+
+    def to_packet(self, execute=True):
+        """
+        Compiles the sequence into a single packet.
+
+        Args:
+            execute (bool): Appends the execute command, True by default.
+
+        Returns:
+            DTInstructionPacket: The packet holding all the commands of the sequence.
+
+        Raises:
+            ValueError: A loop is not closed.
+
+        """
+        if self._loop_depth > 0:
+            raise ValueError('Sequence has {} loop(s) not closed'.format(self._loop_depth))
+        return self._pump._protocol.forge_packet(list(self.dtcommands), execute=execute)
+
+    def execute(self, wait=False):
+        """
+        Sends the sequence to the pump, see C3000Controller.execute_sequence()
+
+        Args:
+            wait (bool): Waits for the pump to be idle, default set to False.
+
+        Returns:
+            True (bool): The sequence was accepted by the pump.
+
+            False (bool): The pump rejected an operand of the sequence, e.g. a volume out of range.
+
+        """
+        return self._pump.execute_sequence(self, wait=wait)
+
+    def arm(self):
+        """
+        Loads the sequence into the pump without starting it, see C3000Controller.arm_sequence()
+
+        Returns:
+            True (bool): The sequence was accepted by the pump.
+
+            False (bool): The pump rejected an operand of the sequence, e.g. a volume out of range.
+
+        """
+        return self._pump.arm_sequence(self)
+
+    def store(self, slot):
+        """
+        Stores the sequence in the EEPROM of the pump, see C3000Controller.store_program()
+
+        Args:
+            slot (int): The program slot.
+
+        Returns:
+            True (bool): The program was accepted by the pump.
+
+            False (bool): The pump rejected an operand of the program.
+
+        """
+        return self._pump.store_program(slot, self)
+
+
+#: A stroke of a transfer plan, see C3000Controller.plan_transfer(). Speeds set to None use the default top velocity
+TransferStroke = collections.namedtuple('TransferStroke', ['volume_in_ml', 'from_valve', 'to_valve', 'speed_in',
+                                                           'speed_out'])
+#: Progress of a transfer, reported after each stroke, see C3000Controller.iter_transfer()
+TransferProgress = collections.namedtuple('TransferProgress', ['stroke', 'strokes', 'volume_transferred',
+                                                               'volume_in_ml'])
+
+
+def valve_position_to_dtcommand(valve_position):
+    """
+    Creates the command setting the valve to the given position.
+
+    Args:
+        valve_position (str): Position of the valve.
+
+    Returns:
+        DTCommand: The valve command.
+
+    Raises:
+        ValueError: The valve position is invalid/unknown.
+
+    """
+    if valve_position in (VALVE_INPUT, VALVE_OUTPUT, VALVE_BYPASS, VALVE_EXTRA):
+        return dtprotocol.DTCommand(valve_position)
+    elif valve_position in VALVE_6WAY_LIST:
+        return dtprotocol.DTCommand(pump_protocol.CMD_VALVE_INPUT, valve_position)
+    else:
+        raise ValueError('Valve position {} unknown'.format(valve_position))
+
+
+class C3000Controller(object):
+    """
+    This class represents the main controller for the C3000.
+    The controller is what controls the pumps.
+
+    Args:
+        pump_io (PumpIO): PumpIO object for communication.
+
+        name (str): The name of the controller.
+
+        address (str): Address of the controller.
+
+        total_volume (float): Total volume of the pump.
+
+        micro_step_mode (int): The mode which the microstep will use, default set to MICRO_STEP_MODE_2 (2)
+
+        top_velocity (int): The top velocity of the pump, default set to 6000
+
+        initialize_valve_position (chr): Sets the valve position, default set to VALVE_INPUT ('I')
+
+        shadow_state (bool): Trusts the last known state of the pump (see C3000ShadowState) to skip redundant queries
+            and commands, default set to False. The state is forgotten on errors, timeouts and terminate().
+
+        clock (SystemClock or VirtualClock): The clock used to sleep and predict the end of the moves, default set to
+            DEFAULT_CLOCK (the real time).
+
+        retry_policy (RetryPolicy or Dict): The timeouts and retries of the communication with the pump, or the
+            arguments of a RetryPolicy, default set to None for a RetryPolicy bounded by the timeout of pump_io.
+
+        poller (PumpOperationPoller or PumpReactor): Completes the operations of the pump (see operation=True),
+            default set to None for the poller shared by the pumps on the same clock.
+
+    Raises:
+        ValueError: Invalid microstep mode.
+
+    """
+    def __init__(self, pump_io, name, address, total_volume, micro_step_mode=MICRO_STEP_MODE_2, top_velocity=6000,
+                 initialize_valve_position=VALVE_INPUT, shadow_state=False, clock=None, retry_policy=None,
+                 poller=None):
+        self.logger = create_logger(self.__class__.__name__)
+
+        self._io = pump_io
+
+        self._clock = clock if clock is not None else DEFAULT_CLOCK
+        self._poller = poller if poller is not None else get_poller(self._clock)
+
+        if retry_policy is None:
+            retry_policy = RetryPolicy(max_timeout=getattr(pump_io, 'timeout', DEFAULT_IO_TIMEOUT), clock=self._clock)
+        elif isinstance(retry_policy, dict):
+            retry_policy = RetryPolicy(**dict({'max_timeout': getattr(pump_io, 'timeout', DEFAULT_IO_TIMEOUT),
+                                                'clock': self._clock}, **retry_policy))
+        self.retry_policy = retry_policy
+
+        self.name = name
+
+        self.address = address
+        self._protocol = pump_protocol.C3000Protocol(self.address)
+
+        self.initialize_valve_position = initialize_valve_position
+
+        self.micro_step_mode = micro_step_mode
+        if self.micro_step_mode == MICRO_STEP_MODE_0:
+            self.number_of_steps = int(N_STEP_MICRO_STEP_MODE_0)  # float
+        elif self.micro_step_mode == MICRO_STEP_MODE_2:
+            self.number_of_steps = int(N_STEP_MICRO_STEP_MODE_2)  # float
+        else:
+            raise ValueError('Microstep mode {} is not handled'.format(self.micro_step_mode))
+
+        self.total_volume = float(total_volume)  # in ml (float)
+        self.steps_per_ml = int(self.number_of_steps / self.total_volume)
+
+        self.default_top_velocity = top_velocity
+
+        self.shadow_state = shadow_state
+        self.shadow = C3000ShadowState()
+
+        # Motion model parameters (microstep mode 0 units), see pump_protocol.estimate_move_duration()
+        self.start_velocity = pump_protocol.DEFAULT_START_VELOCITY
+        self.cutoff_velocity = pump_protocol.DEFAULT_CUTOFF_VELOCITY
+        self.slope = pump_protocol.DEFAULT_SLOPE
+        self._move_start_time = None
+        self._completion_time = None
+        self._armed_commands = None
+        # Commands of the programs stored in EEPROM by this controller, by slot
+        self._programs = {}
+
+    @classmethod
+    def from_config(cls, pump_io, pump_name, pump_config):
+        """
+        Obtains the configuration data.
+
+        Args:
+            cls (Class): The initialising class.
+
+            pump_io (PumpIO): PumpIO object.
+
+            pump_name (str): Name of the pump.
+
+            pump_config (Dict): Dictionary containing the pump configuration data.
+
+        Returns:
+            C3000Controller: New C3000Controller object with the data set from the configuration.
+
+        """
+        pump_config['address'] = C3000SwitchToAddress[pump_config['switch']]
+        del(pump_config['switch'])
+
+        pump_config['total_volume'] = float(pump_config['volume'])  # in ml (float)
+        del(pump_config['volume'])
 
         return cls(pump_io, pump_name, **pump_config)
 
@@ -387,6 +1404,12 @@ class C3000Controller(object):
         """
         Writes packets to and reads the response from the pump.
 
+        The response to a report query is waited for as long as the retry policy of the pump decides from the
+        latencies observed so far, the response to a command for the longest timeout of the policy (see
+        RetryPolicy.timeout()), and failed attempts are retried after an exponential backoff. If the circuit breaker of
+        the policy is enabled, a pump failing repeatedly is reported unhealthy at once instead of being retried, so it
+        does not hold the hub for the other pumps.
+
         Args:
             packet (DTInstructionPacket): The packet to be written.
 
@@ -396,25 +1419,72 @@ class C3000Controller(object):
             decoded_response (str): The decoded response.
 
         Raises:
-            PumpIOTimeOutError: If the response itme is greater than the timeout threshold.
-
             ControllerRepeatedError: Error in decoding.
 
+            PumpUnhealthyError: The pump failed repeatedly and the circuit breaker is enabled, see RetryPolicy.
+
+            PumpDeadlineError: The deadline of the current operation is over, see retry.deadline().
+
         """
+        report = pump_protocol.is_report_frame(packet.to_string())
         for i in range(max_repeat):
-            self.logger.debug("Write and read {}/{}".format(i + 1, max_repeat))
+            self.logger.debug("Write and read %s/%s", i + 1, max_repeat)
+            if not self.retry_policy.allow_request():
+                self.shadow.invalidate()
+                raise PumpUnhealthyError('Pump {} is unhealthy'.format(self.name))
+
+            timeout = self.retry_policy.timeout(report)
+            remaining = retry.remaining_time()
+            if remaining is not None:
+                if remaining <= 0:
+                    raise PumpDeadlineError('Deadline exceeded on pump {}'.format(self.name))
+                timeout = min(timeout, remaining)
+
+            start_time = self._clock.time()
             try:
-                response = self._io.write_and_readline(packet)
+                response = self._io.write_and_readline(packet, timeout=timeout)
                 decoded_response = self._protocol.decode_packet(response)
                 if decoded_response is not None:
+                    self.retry_policy.record_success(self._clock.time() - start_time)
                     return decoded_response
                 else:
                     self.logger.debug("Decode error for {}, trying again!".format(response))
             except PumpIOTimeOutError:
-                self.logger.debug("Timeout, trying again!")
+                self.logger.debug("Timeout after %.3fs, trying again!", timeout)
+                # The packet may or may not have been executed
+                self.shadow.invalidate()
+            self.retry_policy.record_failure()
+            if i + 1 < max_repeat:
+                self._sleep(self.retry_policy.backoff(i + 1))
         self.logger.debug("Too many failed communication!")
+        self.shadow.invalidate()
         raise ControllerRepeatedError('Repeated Error from pump {}'.format(self.name))
 
+    def get_shadow_value(self, attribute, getter):
+        """
+        Returns a value of the shadow state if it is trusted and known, reads it from the pump otherwise.
+
+        Args:
+            attribute (str): Name of the C3000ShadowState attribute, e.g. 'valve_position'.
+
+            getter (function): Function reading the value from the pump.
+
+        Returns:
+            The known or read value.
+
+        """
+        if self.shadow_state:
+            value = getattr(self.shadow, attribute)
+            if value is not None:
+                return value
+        return getter()
+
+    def invalidate_shadow_state(self):
+        """
+        Forgets the last known state of the pump, the next operations will query it again.
+        """
+        self.shadow.invalidate()
+
     def volume_to_step(self, volume_in_ml):
         """
         Determines the number of steps for a given volume.
@@ -461,8 +1531,10 @@ class C3000Controller(object):
         elif status == pump_protocol.STATUS_BUSY_ERROR_FREE:
             return False
         elif status in pump_protocol.ERROR_STATUSES_BUSY:
+            self.shadow.invalidate()
             raise PumpHWError(error_code=status, pump=self.name)
         elif status in pump_protocol.ERROR_STATUSES_IDLE:
+            self.shadow.invalidate()
             raise PumpHWError(error_code=status, pump=self.name)
         else:
             raise ValueError('The pump replied status {}, Not handled'.format(status))
@@ -482,12 +1554,155 @@ class C3000Controller(object):
         """
         return not self.is_idle()
 
-    def wait_until_idle(self):
+    def _sleep(self, seconds):
+        """
+        Sleeps on the clock of the pump, at most until the deadline of the current operation, see retry.sleep().
+        """
+        retry.sleep(seconds, self._clock)
+
+    def wait_until_idle(self, deadline=None):
+        """
+        Waits until the pump is idle.
+
+        If the end of the current move is predicted (see estimated_completion_time()), sleeps until shortly before it
+        and then polls the pump more and more often as the predicted end gets closer, down to every
+        PREDICTIVE_WAIT_SLEEP_TIME (0.01). Long moves and programs are thus polled a few times only. Otherwise, or if
+        the pump is still busy well after the predicted end, polls every WAIT_SLEEP_TIME (0.1).
+
+        Args:
+            deadline (float): Time allowed in seconds, default set to None for no other limit than the deadline of the
+                current operation, see retry.deadline().
+
+        Raises:
+            PumpDeadlineError: The pump is still busy at the deadline.
+
+        """
+        if deadline is not None:
+            with retry.deadline(deadline, self._clock):
+                return self.wait_until_idle()
+
+        completion_time = self.estimated_completion_time()
+        if completion_time is None:
+            while self.is_busy():
+                self._sleep(WAIT_SLEEP_TIME)
+        else:
+            duration = completion_time - self._move_start_time
+            early = PREDICTIVE_WAIT_MARGIN + PREDICTIVE_WAIT_RATIO * duration
+            delay = completion_time - early - self._clock.time()
+            if delay > 0:
+                self._sleep(delay)
+            fast_poll_until = completion_time + early
+            while self.is_busy():
+                now = self._clock.time()
+                if now < completion_time:
+                    # Halves the time left to the predicted end, long moves are only polled a few times
+                    self._sleep(max((completion_time - now) / 2, PREDICTIVE_WAIT_SLEEP_TIME))
+                elif now < fast_poll_until:
+                    self._sleep(min(max((now - completion_time) / 2, PREDICTIVE_WAIT_SLEEP_TIME), WAIT_SLEEP_TIME))
+                else:
+                    self._sleep(WAIT_SLEEP_TIME)
+        self._completion_time = None
+
+    def estimate_move_duration(self, steps, top_velocity=None):
+        """
+        Estimates the time taken by a plunger move, see pump_protocol.estimate_move_duration()
+
+        Args:
+            steps (int): Length of the move, in steps.
+
+            top_velocity (int): Top velocity of the move, default set to None for the last known top velocity.
+
+        Returns:
+            duration (float): The estimated duration in seconds, None if the top velocity is unknown.
+
+        """
+        if top_velocity is None:
+            top_velocity = self.shadow.top_velocity
+            if top_velocity is None:
+                return None
+        return pump_protocol.estimate_move_duration(steps, top_velocity, self.start_velocity, self.cutoff_velocity,
+                                                    self.slope, self.micro_step_mode)
+
+    def estimate_sequence_duration(self, dtcommands):
         """
-        Waits until the pump is not busy for WAIT_SLEEP_TIME, default set to 0.1
+        Estimates the time taken by a list of commands, starting from the last known state of the pump.
+
+        Args:
+            dtcommands (list): List of DTCommand, in the order they are sent, loops and delays included.
+
+        Returns:
+            duration (float): The estimated duration in seconds, None if it cannot be estimated.
+
+        """
+        return run_commands(dtcommands, self.shadow.copy(), self._estimate_command_duration)
+
+    def _estimate_command_duration(self, dtcommand, state):
+        command = dtcommand.command.decode()
+        operand = dtcommand.operand.decode() if dtcommand.operand is not None else None
+        if command == pump_protocol.CMD_TOPVELOCITY:
+            return 0.0
+        elif command in (VALVE_INPUT, VALVE_OUTPUT, VALVE_BYPASS, VALVE_EXTRA):
+            new_valve_position = operand if operand in VALVE_6WAY_LIST else command
+            return pump_protocol.VALVE_MOVE_DURATION if new_valve_position != state.valve_position else 0.0
+        elif command in (pump_protocol.CMD_PUMP, pump_protocol.CMD_DELIVER, pump_protocol.CMD_MOVE_TO):
+            if state.top_velocity is None:
+                return None
+            if command == pump_protocol.CMD_MOVE_TO:
+                if state.plunger_position is None:
+                    return None
+                steps = int(operand) - state.plunger_position
+            else:
+                steps = int(operand)
+            return self.estimate_move_duration(steps, state.top_velocity)
+        elif command == pump_protocol.CMD_DELAY:
+            return int(operand) / 1000.0
+        return None
+
+    def estimated_completion_time(self):
+        """
+        Gets the predicted end of the last move sent to the pump.
+
+        Returns:
+            completion_time (float): The predicted end, on the clock of the pump. None if no move is pending or
+                its end cannot be predicted.
+
         """
-        while self.is_busy():
-            time.sleep(WAIT_SLEEP_TIME)
+        return self._completion_time
+
+    def _schedule_completion(self, duration):
+        """
+        Records the predicted duration of a move which has just been sent.
+
+        Args:
+            duration (float): The predicted duration in seconds, None if unknown.
+
+        """
+        if duration is None:
+            self._move_start_time = None
+            self._completion_time = None
+            return
+        now = self._clock.time()
+        if self._completion_time is not None and self._completion_time > now:
+            # The pump first finishes what it was doing
+            now = self._completion_time
+        self._move_start_time = now
+        self._completion_time = now + duration
+
+    def idle_operation(self):
+        """
+        Gets a handle on the move currently running on the pump.
+
+        Returns:
+            PumpOperation: An operation completing with True when the pump is idle. Its completion is detected by the
+                poller shared by all the pumps on the real time clock.
+
+        """
+        return self._poller.watch(self)
+
+    def _to_operation(self, accepted):
+        if accepted:
+            return self.idle_operation()
+        return PumpOperation.completed(False, [self])
 
     def is_initialized(self):
         """
@@ -501,7 +1716,8 @@ class C3000Controller(object):
         """
         initialized_packet = self._protocol.forge_report_initialized_packet()
         (_, _, init_status) = self.write_and_read_from_pump(initialized_packet)
-        return bool(int(init_status))
+        self.shadow.initialized = bool(int(init_status))
+        return self.shadow.initialized
 
     def smart_initialize(self, valve_position=None, secure=True):
         """
@@ -557,9 +1773,7 @@ class C3000Controller(object):
             wait (bool): Whether or not to wait until the pump is idle, default set to True.
 
         """
-        self.write_and_read_from_pump(self._protocol.forge_initialize_valve_right_packet(operand_value))
-        if wait:
-            self.wait_until_idle()
+        self._initialize(self._protocol.forge_initialize_valve_right_packet(operand_value), wait)
 
     def initialize_valve_left(self, operand_value=0, wait=True):
         """
@@ -571,9 +1785,7 @@ class C3000Controller(object):
             wait (bool): Whether or not to wait until the pump is idle, default set to True.
 
         """
-        self.write_and_read_from_pump(self._protocol.forge_initialize_valve_left_packet(operand_value))
-        if wait:
-            self.wait_until_idle()
+        self._initialize(self._protocol.forge_initialize_valve_left_packet(operand_value), wait)
 
     def initialize_no_valve(self, operand_value=None, wait=True):
         """
@@ -592,9 +1804,7 @@ class C3000Controller(object):
             else:
                 operand_value = 0
 
-        self.write_and_read_from_pump(self._protocol.forge_initialize_no_valve_packet(operand_value))
-        if wait:
-            self.wait_until_idle()
+        self._initialize(self._protocol.forge_initialize_no_valve_packet(operand_value), wait)
 
     def initialize_valve_only(self, operand_string='0,0', wait=True):
         """
@@ -606,7 +1816,13 @@ class C3000Controller(object):
             wait (bool): Whether or not to wait until the pump is idle, default set to True.
 
         """
-        self.write_and_read_from_pump(self._protocol.forge_initialize_valve_only_packet(operand_string))
+        self._initialize(self._protocol.forge_initialize_valve_only_packet(operand_string), wait)
+
+    def _initialize(self, packet, wait):
+        self.write_and_read_from_pump(packet)
+        self.shadow.track_commands(packet.dtcommands)
+        # Initialisation moves cannot be predicted, the pump is polled until idle
+        self._schedule_completion(None)
         if wait:
             self.wait_until_idle()
 
@@ -633,6 +1849,8 @@ class C3000Controller(object):
 
         """
         self.write_and_read_from_pump(self._protocol.forge_microstep_mode_packet(micro_step_mode))
+        # Velocities and positions are expressed in a different unit in each microstep mode
+        self.shadow.invalidate()
 
     def check_top_velocity_within_range(self, top_velocity):
         """
@@ -687,7 +1905,7 @@ class C3000Controller(object):
             secure (bool): Ensures that everything is correct, default set to True.
 
         """
-        if self.get_top_velocity() != self.default_top_velocity:
+        if self.get_shadow_value('top_velocity', self.get_top_velocity) != self.default_top_velocity:
             self.set_top_velocity(self.default_top_velocity, secure=secure)
 
     def set_top_velocity(self, top_velocity, max_repeat=MAX_REPEAT_OPERATION, secure=True):
@@ -709,6 +1927,9 @@ class C3000Controller(object):
 
 
         """
+        if self.shadow_state and self.shadow.top_velocity == top_velocity:
+            return True
+
         for i in range(max_repeat):
             if self.get_top_velocity() == top_velocity:
                 return True
@@ -718,6 +1939,7 @@ class C3000Controller(object):
             self.write_and_read_from_pump(self._protocol.forge_top_velocity_packet(top_velocity))
             # if do not want to wait and check things went well, return now
             if secure is False:
+                self.shadow.top_velocity = top_velocity
                 return True
 
         self.logger.debug(f"[PUMP {self.name}] Too many failed attempts in set_top_velocity!")
@@ -733,7 +1955,8 @@ class C3000Controller(object):
         """
         top_velocity_packet = self._protocol.forge_report_peak_velocity_packet()
         (_, _, top_velocity) = self.write_and_read_from_pump(top_velocity_packet)
-        return int(top_velocity)
+        self.shadow.top_velocity = int(top_velocity)
+        return self.shadow.top_velocity
 
     def get_plunger_position(self):
         """
@@ -744,7 +1967,10 @@ class C3000Controller(object):
 
         """
         plunger_position_packet = self._protocol.forge_report_plunger_position_packet()
-        (_, _, steps) = self.write_and_read_from_pump(plunger_position_packet)
+        (_, status, steps) = self.write_and_read_from_pump(plunger_position_packet)
+        # While moving the reported position is not where the plunger will end
+        if status == pump_protocol.STATUS_IDLE_ERROR_FREE:
+            self.shadow.plunger_position = int(steps)
         return int(steps)
 
     @property
@@ -760,59 +1986,268 @@ class C3000Controller(object):
         Gets the remaining number of steps.
 
         Returns:
-            (int): self.number_of_steps - self.current_steps
+            (int): self.number_of_steps - self.current_steps
+
+        """
+        return self.number_of_steps - self.current_steps
+
+    def get_volume(self):
+        """
+        See step_to_volume()
+
+        Returns:
+            (float): self.step_to_volume(self.get_plunger_position())
+
+        """
+        return self.step_to_volume(self.get_plunger_position())  # in ml
+
+    @property
+    def current_volume(self):
+        """
+        See get_volume()
+
+        Returns:
+            (float): self.get_volume()
+
+        """
+        return self.get_volume()
+
+    @property
+    def remaining_volume(self):
+        """
+        Gets the remaining volume.
+
+        Returns:
+            (float): self.total_volume - self.current_volume
+        """
+        return self.total_volume - self.current_volume
+
+    def is_volume_pumpable(self, volume_in_ml):
+        """
+        Determines if the volume is pumpable.
+
+        Args:
+            volume_in_ml (float): The supplied volume.
+
+        Returns:
+            True (bool): If the number of steps is <= to the remaining steps.
+
+            False (bool): The number of steps is > than the remaining steps.
+
+        """
+        steps = self.volume_to_step(volume_in_ml)
+        return steps <= self.number_of_steps - self.get_shadow_value('plunger_position', self.get_plunger_position)
+
+    def sequence(self):
+        """
+        Starts a new command sequence for this pump, see C3000CommandSequence.
+
+        Returns:
+            C3000CommandSequence: An empty command sequence.
+
+        """
+        return C3000CommandSequence(self)
+
+    def execute_sequence(self, sequence, wait=False):
+        """
+        Sends all the commands of a sequence in a single packet.
+
+        Args:
+            sequence (C3000CommandSequence): The sequence to execute.
+
+            wait (bool): Waits for the pump to be idle, default set to False.
+
+        Returns:
+            True (bool): The sequence was accepted by the pump.
+
+            False (bool): The pump rejected an operand of the sequence, e.g. a volume out of range.
+
+        Raises:
+            PumpHWError: The pump replied with any other error status.
+
+        """
+        duration = self.estimate_sequence_duration(sequence.dtcommands)
+        if not self._write_sequence(sequence, execute=True):
+            return False
+
+        self.shadow.track_commands(sequence.dtcommands)
+        self._schedule_completion(duration)
+
+        if wait:
+            self.wait_until_idle()
+
+        return True
+
+    def _write_sequence(self, sequence, execute):
+        return self._write_checked(sequence.to_packet(execute=execute), sequence)
+
+    def _write_checked(self, packet, sequence):
+        (_, status, _) = self.write_and_read_from_pump(packet)
+        if status in (pump_protocol.STATUS_IDLE_INVALID_OPERAND, pump_protocol.STATUS_BUSY_INVALID_OPERAND):
+            self.logger.debug("[PUMP %s] Sequence %s rejected, invalid operand", self.name, sequence)
+            return False
+        elif status in pump_protocol.ERROR_STATUSES_IDLE or status in pump_protocol.ERROR_STATUSES_BUSY:
+            self.shadow.invalidate()
+            raise PumpHWError(error_code=status, pump=self.name)
+        return True
+
+    def arm_sequence(self, sequence):
+        """
+        Loads all the commands of a sequence into the pump without executing them. They are started by fire(), or by
+        an execute command sent to a group address (see MultiPumpController.fire()), so that several pumps start
+        at the same time.
+
+        Args:
+            sequence (C3000CommandSequence): The sequence to load.
+
+        Returns:
+            True (bool): The sequence was accepted by the pump.
+
+            False (bool): The pump rejected an operand of the sequence, e.g. a volume out of range.
+
+        Raises:
+            PumpHWError: The pump replied with any other error status.
+
+        """
+        if not self._write_sequence(sequence, execute=False):
+            return False
+        self._armed_commands = list(sequence.dtcommands)
+        return True
+
+    def is_armed(self):
+        """
+        Determines if a sequence is loaded and waits to be started, see arm_sequence().
+
+        Returns:
+            True (bool): A sequence is loaded.
+
+            False (bool): No sequence is loaded.
+
+        """
+        return self._armed_commands is not None
+
+    def fire(self):
+        """
+        Starts the sequence loaded with arm_sequence().
+        """
+        self.write_and_read_from_pump(self._protocol.forge_execute_packet())
+        self.track_fired_sequence()
+
+    def track_fired_sequence(self):
+        """
+        Records that the loaded sequence has just been started, e.g. by an execute command sent to a group address.
+        """
+        if self._armed_commands is None:
+            return
+        dtcommands, self._armed_commands = self._armed_commands, None
+        self._schedule_completion(self.estimate_sequence_duration(dtcommands))
+        self.shadow.track_commands(dtcommands)
+
+    def store_program(self, slot, sequence):
+        """
+        Stores a sequence in the EEPROM of the pump, as a program started later with run_program(). Stored programs
+        are kept across power cycles.
+
+        .. warning:: The EEPROM wears out with writes, store a program once and run it many times.
+
+        Args:
+            slot (int): The program slot, in [0, PROGRAM_SLOTS - 1].
+
+            sequence (C3000CommandSequence): The sequence to store, see C3000CommandSequence.repeat() for loops.
+
+        Returns:
+            True (bool): The program was accepted by the pump.
+
+            False (bool): The pump rejected an operand of the program.
+
+        Raises:
+            ValueError: The slot is out of range or a loop is not closed.
+
+            PumpHWError: The pump replied with any other error status.
+
+        """
+        if not 0 <= slot < pump_protocol.PROGRAM_SLOTS:
+            raise ValueError('Program slot must be in [0-{}], you entered {}'.format(
+                pump_protocol.PROGRAM_SLOTS - 1, slot))
+        sequence.to_packet()  # Checks the loops
+        packet = self._protocol.forge_store_program_packet(slot, sequence.dtcommands)
+        if not self._write_checked(packet, sequence):
+            return False
+        self._programs[slot] = list(sequence.dtcommands)
+        return True
+
+    def run_program(self, slot, wait=False, operation=False, deadline=None):
+        """
+        Runs a program stored in EEPROM with a single command. The pump then runs on its own, the host only polls it
+        around the predicted end of the program, see estimated_progress() to follow it meanwhile.
+
+        The shadow state and the predicted end are only known for the programs stored by this controller, see
+        store_program().
+
+        Args:
+            slot (int): The program slot.
+
+            wait (bool): Waits for the pump to be idle, default set to False.
+
+            operation (bool): Returns a PumpOperation completing when the pump is idle instead of a bool, default
+                set to False.
+
+            deadline (float): Time allowed in seconds for the call, waiting included, default set to None. Raises
+                PumpDeadlineError once over, see retry.deadline().
+
+        Returns:
+            True (bool): The program was started.
 
-        """
-        return self.number_of_steps - self.current_steps
+            False (bool): The pump rejected the slot.
 
-    def get_volume(self):
-        """
-        See step_to_volume()
+            PumpOperation: With operation set to True, its result is one of the above once the pump is idle.
 
-        Returns:
-            (float): self.step_to_volume(self.get_plunger_position())
+        Raises:
+            PumpHWError: The pump replied with any other error status.
 
         """
-        return self.step_to_volume(self.get_plunger_position())  # in ml
+        if deadline is not None:
+            with retry.deadline(deadline, self._clock):
+                return self.run_program(slot, wait, operation)
 
-    @property
-    def current_volume(self):
-        """
-        See get_volume()
+        if operation:
+            return self._to_operation(self.run_program(slot, wait))
 
-        Returns:
-            (float): self.get_volume()
+        dtcommands = self._programs.get(slot)
+        duration = self.estimate_sequence_duration(dtcommands) if dtcommands is not None else None
+        if not self._write_checked(self._protocol.forge_run_program_packet(slot), 'program {}'.format(slot)):
+            return False
 
-        """
-        return self.get_volume()
+        if dtcommands is not None:
+            self.shadow.track_commands(dtcommands)
+        else:
+            self.shadow.invalidate()
+        self._schedule_completion(duration)
 
-    @property
-    def remaining_volume(self):
-        """
-        Gets the remaining volume.
+        if wait:
+            self.wait_until_idle()
 
-        Returns:
-            (float): self.total_volume - self.current_volume
-        """
-        return self.total_volume - self.current_volume
+        return True
 
-    def is_volume_pumpable(self, volume_in_ml):
+    def estimated_progress(self):
         """
-        Determines if the volume is pumpable.
-
-        Args:
-            volume_in_ml (float): The supplied volume.
+        Estimates, without querying the pump, the fraction of the last move, sequence or program already done.
 
         Returns:
-            True (bool): If the number of steps is <= to the remaining steps.
-
-            False (bool): The number of steps is > than the remaining steps.
+            progress (float): The fraction done, in [0, 1]. None if nothing is pending or its end cannot be predicted.
 
         """
-        steps = self.volume_to_step(volume_in_ml)
-        return steps <= self.remaining_steps
+        completion_time = self._completion_time
+        move_start_time = self._move_start_time
+        if completion_time is None or move_start_time is None:
+            return None
+        duration = completion_time - move_start_time
+        if duration <= 0:
+            return 1.0
+        return min(max((self._clock.time() - move_start_time) / duration, 0.0), 1.0)
 
-    def pump(self, volume_in_ml, from_valve=None, speed_in=None, wait=False, secure=True):
+    def pump(self, volume_in_ml, from_valve=None, speed_in=None, wait=False, secure=True, chained=False,
+             operation=False, deadline=None):
         """
         Sends the signal to initiate the pump sequence.
 
@@ -829,12 +2264,37 @@ class C3000Controller(object):
 
             secure (bool): Ensures everything is correct, default set to True.
 
+            chained (bool): Sends velocity, valve and move as one command sequence in a single round trip, default
+                set to False. The volume is then checked by the pump itself and secure is ignored.
+
+            operation (bool): Returns a PumpOperation completing when the pump is idle instead of a bool, default
+                set to False.
+
+            deadline (float): Time allowed in seconds for the call, waiting included, default set to None. Raises
+                PumpDeadlineError once over, see retry.deadline().
+
         Returns:
             True (bool): The supplied volume is pumpable.
 
             False (bool): Supplied volume is not pumpable.
 
+            PumpOperation: With operation set to True, its result is one of the above once the pump is idle.
+
         """
+        if deadline is not None:
+            with retry.deadline(deadline, self._clock):
+                return self.pump(volume_in_ml, from_valve, speed_in, wait, secure, chained, operation)
+
+        if operation:
+            return self._to_operation(self.pump(volume_in_ml, from_valve, speed_in, wait, secure, chained))
+
+        if chained:
+            sequence = self.sequence()
+            sequence.velocity(speed_in if speed_in is not None else self.default_top_velocity)
+            if from_valve is not None:
+                sequence.valve(from_valve)
+            return sequence.pump(volume_in_ml).execute(wait=wait)
+
         if self.is_volume_pumpable(volume_in_ml):
 
             if speed_in is not None:
@@ -848,6 +2308,9 @@ class C3000Controller(object):
             steps_to_pump = self.volume_to_step(volume_in_ml)
             packet = self._protocol.forge_pump_packet(steps_to_pump)
             self.write_and_read_from_pump(packet)
+            self._schedule_completion(self.estimate_move_duration(steps_to_pump))
+            if self.shadow.plunger_position is not None:
+                self.shadow.plunger_position += steps_to_pump
 
             if wait:
                 self.wait_until_idle()
@@ -870,9 +2333,10 @@ class C3000Controller(object):
 
         """
         steps = self.volume_to_step(volume_in_ml)
-        return steps <= self.current_steps
+        return steps <= self.get_shadow_value('plunger_position', self.get_plunger_position)
 
-    def deliver(self, volume_in_ml, to_valve=None, speed_out=None, wait=False, secure=True):
+    def deliver(self, volume_in_ml, to_valve=None, speed_out=None, wait=False, secure=True, chained=False,
+                operation=False, deadline=None):
         """
         Delivers the volume payload.
 
@@ -889,7 +2353,39 @@ class C3000Controller(object):
 
             secure (bool): Ensures that everything is correct, default set to False.
 
+            chained (bool): Sends velocity, valve and move as one command sequence in a single round trip, default
+                set to False. The volume is then checked by the pump itself and secure is ignored.
+
+            operation (bool): Returns a PumpOperation completing when the pump is idle instead of a bool, default
+                set to False.
+
+            deadline (float): Time allowed in seconds for the call, waiting included, default set to None. Raises
+                PumpDeadlineError once over, see retry.deadline().
+
+        Returns:
+            True (bool): The supplied volume is deliverable.
+
+            False (bool): The supplied volume is not deliverable.
+
+            PumpOperation: With operation set to True, its result is one of the above once the pump is idle.
+
         """
+        if deadline is not None:
+            with retry.deadline(deadline, self._clock):
+                return self.deliver(volume_in_ml, to_valve, speed_out, wait, secure, chained, operation)
+
+        if operation:
+            return self._to_operation(self.deliver(volume_in_ml, to_valve, speed_out, wait, secure, chained))
+
+        if chained:
+            if volume_in_ml == 0:
+                return True
+            sequence = self.sequence()
+            sequence.velocity(speed_out if speed_out is not None else self.default_top_velocity)
+            if to_valve is not None:
+                sequence.valve(to_valve)
+            return sequence.deliver(volume_in_ml).execute(wait=wait)
+
         if self.is_volume_deliverable(volume_in_ml):
 
             if volume_in_ml == 0:
@@ -906,6 +2402,9 @@ class C3000Controller(object):
             steps_to_deliver = self.volume_to_step(volume_in_ml)
             packet = self._protocol.forge_deliver_packet(steps_to_deliver)
             self.write_and_read_from_pump(packet)
+            self._schedule_completion(self.estimate_move_duration(steps_to_deliver))
+            if self.shadow.plunger_position is not None:
+                self.shadow.plunger_position -= steps_to_deliver
 
             if wait:
                 self.wait_until_idle()
@@ -914,9 +2413,87 @@ class C3000Controller(object):
         else:
             return False
 
-    def transfer(self, volume_in_ml, from_valve, to_valve, speed_in=None, speed_out=None):
+    def transfer(self, volume_in_ml, from_valve, to_valve, speed_in=None, speed_out=None, chained=False,
+                 deadline=None, looped=False, progress=None):
+        """
+        Transfers the desired volume in mL, in as many strokes as needed, see iter_transfer().
+
+        Args:
+            volume_in_ml (float): The volume to transfer.
+
+            from_valve (chr): The valve to transfer from.
+
+            to_valve (chr): The valve to transfer to.
+
+            speed_in (int): The speed of transfer to valve, default set to None.
+
+            speed_out (int): The speed of transfer from the valve, default set to None.
+
+            chained (bool): Sends each stroke (pump and deliver) as one command sequence, default set to False.
+
+            deadline (float): Time allowed in seconds for the whole transfer, default set to None. Raises
+                PumpDeadlineError once over, see retry.deadline().
+
+            looped (bool): Sends the whole transfer as one command sequence, the strokes being repeated by the pump
+                itself (see transfer_program()), default set to False.
+
+            progress (function): Called with a TransferProgress after each stroke, default set to None. Not called
+                when looped.
+
+        """
+        if deadline is not None:
+            with retry.deadline(deadline, self._clock):
+                return self.transfer(volume_in_ml, from_valve, to_valve, speed_in, speed_out, chained,
+                                     looped=looped, progress=progress)
+
+        if looped:
+            self.transfer_program(volume_in_ml, from_valve, to_valve, speed_in, speed_out).execute(wait=True)
+            return
+
+        for transfer_progress in self.iter_transfer(volume_in_ml, from_valve, to_valve, speed_in, speed_out,
+                                                    chained):
+            if progress is not None:
+                progress(transfer_progress)
+
+    def iter_transfer(self, volume_in_ml, from_valve, to_valve, speed_in=None, speed_out=None, chained=False):
+        """
+        Transfers the desired volume in mL, one stroke at a time, as planned by plan_transfer().
+
+        The plan is made once, the plunger position being read at most once, so the strokes follow each other without
+        any query but the polls detecting the end of each stroke. Chained, each stroke is a single packet sent as
+        soon as the previous stroke is over.
+
+        Args:
+            volume_in_ml (float): The volume to transfer.
+
+            from_valve (chr): The valve to transfer from.
+
+            to_valve (chr): The valve to transfer to.
+
+            speed_in (int): The speed of transfer to valve, default set to None.
+
+            speed_out (int): The speed of transfer from the valve, default set to None.
+
+            chained (bool): Sends each stroke (pump and deliver) as one command sequence, default set to False.
+
+        Yields:
+            TransferProgress: The progress of the transfer, once each stroke is over.
+
+        """
+        plan = self.plan_transfer(volume_in_ml, from_valve, to_valve, speed_in, speed_out)
+        volume_transferred = 0.0
+        for (index, stroke) in enumerate(plan):
+            if chained:
+                self._append_stroke(self.sequence(), *stroke).execute(wait=True)
+            else:
+                self.pump(stroke.volume_in_ml, stroke.from_valve, speed_in=stroke.speed_in, wait=True)
+                self.deliver(stroke.volume_in_ml, stroke.to_valve, speed_out=stroke.speed_out, wait=True)
+            volume_transferred += stroke.volume_in_ml
+            yield TransferProgress(index + 1, len(plan), volume_transferred, volume_in_ml)
+
+    def plan_transfer(self, volume_in_ml, from_valve, to_valve, speed_in=None, speed_out=None, stroke_volume=None):
         """
-        Transfers the desired volume in mL.
+        Splits a transfer into strokes. The strokes are computed in steps, so they add up exactly to the volume.
 
         Args:
             volume_in_ml (float): The volume to transfer.
@@ -929,14 +2506,76 @@ class C3000Controller(object):
 
             speed_out (int): The speed of transfer from the valve, default set to None.
 
+            stroke_volume (float): The volume of a stroke, default set to None for the volume left in the syringe.
+
+        Returns:
+            plan (list): The TransferStroke, full strokes first and the partial stroke last.
+
+        Raises:
+            ValueError: The syringe has no room left.
+
+        """
+        (stroke_steps, strokes, rest_steps) = self._split_strokes(volume_in_ml, stroke_volume)
+        plan = [TransferStroke(self.step_to_volume(stroke_steps), from_valve, to_valve, speed_in, speed_out)] * strokes
+        if rest_steps > 0:
+            plan.append(TransferStroke(self.step_to_volume(rest_steps), from_valve, to_valve, speed_in, speed_out))
+        return plan
+
+    def _split_strokes(self, volume_in_ml, stroke_volume):
+        if stroke_volume is None:
+            stroke_steps = self.number_of_steps - self.get_shadow_value('plunger_position', self.get_plunger_position)
+        else:
+            stroke_steps = self.volume_to_step(stroke_volume)
+        if stroke_steps <= 0:
+            raise ValueError('Pump {} has no room left for a stroke'.format(self.name))
+        (strokes, rest_steps) = divmod(self.volume_to_step(volume_in_ml), stroke_steps)
+        return stroke_steps, strokes, rest_steps
+
+    def _append_stroke(self, sequence, volume_in_ml, from_valve, to_valve, speed_in, speed_out):
+        sequence.velocity(speed_in if speed_in is not None else self.default_top_velocity)
+        sequence.valve(from_valve).pump(volume_in_ml)
+        sequence.velocity(speed_out if speed_out is not None else self.default_top_velocity)
+        sequence.valve(to_valve).deliver(volume_in_ml)
+        return sequence
+
+    def transfer_program(self, volume_in_ml, from_valve, to_valve, speed_in=None, speed_out=None,
+                         stroke_volume=None):
         """
-        volume_transferred = min(volume_in_ml, self.remaining_volume)
-        self.pump(volume_transferred, from_valve, speed_in=speed_in, wait=True)
-        self.deliver(volume_transferred, to_valve, speed_out=speed_out, wait=True)
+        Compiles a transfer into a single command sequence: the full strokes are run by a loop on the pump, followed
+        by the last partial stroke. The sequence can be executed, armed or stored in EEPROM (see store_program()).
+
+        Args:
+            volume_in_ml (float): The volume to transfer.
+
+            from_valve (chr): The valve to transfer from.
+
+            to_valve (chr): The valve to transfer to.
+
+            speed_in (int): The speed of transfer to valve, default set to None.
+
+            speed_out (int): The speed of transfer from the valve, default set to None.
+
+            stroke_volume (float): The volume of a stroke, default set to None for the volume left in the syringe.
+
+        Returns:
+            C3000CommandSequence: The transfer program.
 
-        remaining_volume_to_transfer = volume_in_ml - volume_transferred
-        if remaining_volume_to_transfer > 0:
-            self.transfer(remaining_volume_to_transfer, from_valve, to_valve, speed_in, speed_out)
+        Raises:
+            ValueError: The syringe has no room left.
+
+        """
+        (stroke_steps, strokes, rest_steps) = self._split_strokes(volume_in_ml, stroke_volume)
+        sequence = self.sequence()
+        while strokes > 0:
+            repeat = min(strokes, pump_protocol.MAX_LOOP_REPEAT)
+            sequence.loop_start()
+            self._append_stroke(sequence, self.step_to_volume(stroke_steps), from_valve, to_valve, speed_in,
+                                speed_out)
+            sequence.loop_end(repeat)
+            strokes -= repeat
+        if rest_steps > 0:
+            self._append_stroke(sequence, self.step_to_volume(rest_steps), from_valve, to_valve, speed_in, speed_out)
+        return sequence
 
     def is_volume_valid(self, volume_in_ml):
         """
@@ -953,7 +2592,8 @@ class C3000Controller(object):
         """
         return 0 <= volume_in_ml <= self.total_volume
 
-    def go_to_volume(self, volume_in_ml, speed=None, wait=False, secure=True):
+    def go_to_volume(self, volume_in_ml, speed=None, wait=False, secure=True, chained=False, operation=False,
+                     deadline=None):
         """
         Moves the pump to the desired volume.
 
@@ -968,14 +2608,37 @@ class C3000Controller(object):
 
             secure (bool): Ensures that everything is correct, default set to True.
 
+            chained (bool): Sends velocity and move as one command sequence in a single round trip, default set to
+                False.
+
+            operation (bool): Returns a PumpOperation completing when the pump is idle instead of a bool, default
+                set to False.
+
+            deadline (float): Time allowed in seconds for the call, waiting included, default set to None. Raises
+                PumpDeadlineError once over, see retry.deadline().
+
         Returns:
             True (bool): The supplied volume is valid.
 
             False (bool): THe supplied volume is not valid.
 
+            PumpOperation: With operation set to True, its result is one of the above once the pump is idle.
+
         """
+        if deadline is not None:
+            with retry.deadline(deadline, self._clock):
+                return self.go_to_volume(volume_in_ml, speed, wait, secure, chained, operation)
+
+        if operation:
+            return self._to_operation(self.go_to_volume(volume_in_ml, speed, wait, secure, chained))
+
         if self.is_volume_valid(volume_in_ml):
 
+            if chained:
+                sequence = self.sequence()
+                sequence.velocity(speed if speed is not None else self.default_top_velocity)
+                return sequence.go_to_volume(volume_in_ml).execute(wait=wait)
+
             if speed is not None:
                 self.set_top_velocity(speed, secure=secure)
             else:
@@ -984,6 +2647,11 @@ class C3000Controller(object):
             steps = self.volume_to_step(volume_in_ml)
             packet = self._protocol.forge_move_to_packet(steps)
             self.write_and_read_from_pump(packet)
+            if self.shadow.plunger_position is not None:
+                self._schedule_completion(self.estimate_move_duration(steps - self.shadow.plunger_position))
+            else:
+                self._schedule_completion(None)
+            self.shadow.plunger_position = steps
 
             if wait:
                 self.wait_until_idle()
@@ -1039,16 +2707,21 @@ class C3000Controller(object):
         for i in range(max_repeat):
             raw_valve_position = self.get_raw_valve_position()
             if raw_valve_position == 'i':
-                return VALVE_INPUT
+                valve_position = VALVE_INPUT
             elif raw_valve_position == 'o':
-                return VALVE_OUTPUT
+                valve_position = VALVE_OUTPUT
             elif raw_valve_position == 'b':
-                return VALVE_BYPASS
+                valve_position = VALVE_BYPASS
             elif raw_valve_position == 'e':
-                return VALVE_EXTRA
+                valve_position = VALVE_EXTRA
             elif raw_valve_position in VALVE_6WAY_LIST:
-                return raw_valve_position
-            self.logger.debug(f"Valve position request failed attempt {i+1}/{max_repeat}, {raw_valve_position} unknown")
+                valve_position = raw_valve_position
+            else:
+                self.logger.debug(f"Valve position request failed attempt {i+1}/{max_repeat}, "
+                                  f"{raw_valve_position} unknown")
+                continue
+            self.shadow.valve_position = valve_position
+            return valve_position
         raise ValueError(f'Valve position received was {raw_valve_position}. It is unknown')
 
     def set_valve_position(self, valve_position, max_repeat=MAX_REPEAT_OPERATION, secure=True):
@@ -1071,6 +2744,9 @@ class C3000Controller(object):
             ControllerRepeatedError: Too many failed attempts in set_valve_position.
 
         """
+        if self.shadow_state and self.shadow.valve_position == valve_position:
+            return True
+
         for i in range(max_repeat):
 
             if self.get_valve_position() == valve_position:
@@ -1092,9 +2768,11 @@ class C3000Controller(object):
                 raise ValueError('Valve position {} unknown'.format(valve_position))
 
             self.write_and_read_from_pump(valve_position_packet)
+            self._schedule_completion(pump_protocol.VALVE_MOVE_DURATION)
 
             # if do not want to wait and check things went well, return now
             if secure is False:
+                self.shadow.valve_position = valve_position
                 return True
 
             self.wait_until_idle()
@@ -1145,69 +2823,282 @@ class C3000Controller(object):
         """
         self.set_eeprom_config(1)
 
-    def flash_eeprom_3_way_t_valve(self):
+    def flash_eeprom_3_way_t_valve(self):
+        """
+        Sets the EEPROM config of the pump to use a 3-way T valve (I/O operations)
+        """
+        self.set_eeprom_config(5)
+
+    def flash_eeprom_4_way_nondist_valve(self):
+        """
+        Sets the EEPROM config of the pump to use a 4-way Non-Dist valve (I/O/E operations)
+        Note in this configuration it is not possible to pump to E!
+        valve position E connects E with O while B connects E and I (90-degrees)
+        """
+        self.set_eeprom_config(2)
+
+    def flash_eeprom_4_way_dist_valve(self):
+        """
+        Sets the EEPROM config of the pump to use a 4-way Dist Valve (I/O/E operations)
+        """
+        self.set_eeprom_config(4)
+
+    def get_eeprom_config(self):
+        """
+        Gets the EEPROM configuration.
+
+        Returns:
+            eeprom_config (int): The configuration of the EEPROM.
+
+        """
+        (_, _, eeprom_config) = self.write_and_read_from_pump(self._protocol.forge_report_eeprom_packet())
+        return eeprom_config
+
+    def get_current_valve_config(self):
+        """
+        Infers the current valve configuration based on the EEPROM data.
+        """
+        current_eeprom_config = self.get_eeprom_config().split(',')
+        valve_config = current_eeprom_config[10]
+        # Valve config: IOBEXYZ
+        # [I]nput, [O]utput, [B]ypass, [E]xtra positions: n*90 deg (e.g. 0 -> 0 deg, 2 -> 180 deg)
+        # [X], [Y] allow plunger movement in [B] and [E], respectively (Y=1 for DIST to enable delivering to E!)
+        # [Z] swap the bypass and extra position on a 4-position valve if a [Y] initialization command is issued.
+
+        if valve_config == "2013100":
+            # flash_eeprom_3_way_t_valve() AND flash_eeprom_3_way_y_valve(). Difference is jumper J2-5, check with ?28
+            current_valve_config = "3-WAY"
+        elif valve_config == "2033110":
+            # flash_eeprom_4_way_dist_valve()
+            current_valve_config = "4-WAY dist"
+        elif valve_config == "2130001":
+            # flash_eeprom_4_way_nondist_valve()
+            current_valve_config = "4-WAY nondist"
+        else:
+            # e.g. DEBUG:pycont.DTStatus:Received /0`10,75,14,62,1,1,20,10,48,210,2013010,0,0,0,0,0,25,20,15,0000000
+            print(valve_config)
+            current_valve_config = "Unknown"
+
+        return current_valve_config
+
+    def terminate(self):
+        """
+        Sends the command to terminate the current action.
+        """
+        self.write_and_read_from_pump(self._protocol.forge_terminate_packet())
+        # The plunger stopped wherever it was
+        self.shadow.invalidate()
+        self._schedule_completion(None)
+        self._armed_commands = None
+
+
+class C3000GroupController(object):
+    """
+    This class sends commands to several pumps of a hub in a single packet, through the broadcast address or one of
+    the group addresses of the C-series (see dual_group_address() and quad_group_address()).
+
+    The pumps do not reply to these packets. The commands are therefore checked against the state of each pump before
+    being sent, and tracked by the controllers of the pumps (shadow state and predicted end of the moves). The methods
+    otherwise behave as their C3000Controller counterparts, and fall back to one packet per pump when the pumps differ
+    (e.g. syringe volume or default top velocity).
+
+    Args:
+        pump_io (PumpIO): The I/O of the hub.
+
+        address (chr): The broadcast or group address.
+
+        pumps (list): The controllers (C3000Controller) of the pumps reached by the address.
+
+    """
+    def __init__(self, pump_io, address, pumps):
+        self.logger = create_logger(self.__class__.__name__)
+
+        self._io = pump_io
+
+        self.address = address
+        self.name = 'group {}'.format(address)
+        self._protocol = pump_protocol.C3000Protocol(self.address)
+
+        self.pumps = list(pumps)
+
+    def write_to_pumps(self, dtcommands):
+        """
+        Sends commands to all the pumps at once, and tracks them in the controllers of the pumps.
+
+        Args:
+            dtcommands (list): List of DTCommand, in the order they are executed.
+
+        """
+        durations = [pump.estimate_sequence_duration(dtcommands) for pump in self.pumps]
+        self._io.write_without_reply(self._protocol.forge_packet(list(dtcommands)))
+        for pump, duration in zip(self.pumps, durations):
+            pump.shadow.track_commands(dtcommands)
+            pump._schedule_completion(duration)
+
+    def _are_alike(self, attribute):
+        return len(set(getattr(pump, attribute) for pump in self.pumps)) == 1
+
+    def _apply_to_each_pump(self, command, *args, **kwargs):
+        returns = [getattr(pump, command)(*args, **kwargs) for pump in self.pumps]
+        return all(returns)
+
+    def wait_until_idle(self):
+        """
+        Waits until all the pumps are idle.
+        """
+        for pump in self.pumps:
+            pump.wait_until_idle()
+
+    def fire(self):
+        """
+        Starts the sequences loaded into the pumps (see C3000Controller.arm_sequence()) with a single packet.
+        """
+        self._io.write_without_reply(self._protocol.forge_execute_packet())
+        for pump in self.pumps:
+            pump.track_fired_sequence()
+
+    def terminate(self):
+        """
+        Sends the command to terminate the current action of all the pumps.
+        """
+        self._io.write_without_reply(self._protocol.forge_terminate_packet())
+        for pump in self.pumps:
+            pump.shadow.invalidate()
+            pump._schedule_completion(None)
+            pump._armed_commands = None
+
+    def initialize_valve_only(self, operand_string='0,0', wait=True):
+        """
+        Initialises the valves of all the pumps, see C3000Controller.initialize_valve_only()
+        """
+        self.write_to_pumps([dtprotocol.DTCommand(pump_protocol.CMD_INITIALIZE_VALVE_ONLY, operand_string)])
+        if wait:
+            self.wait_until_idle()
+        return True
+
+    def initialize_no_valve(self, operand_value=None, wait=True):
+        """
+        Initialises the plungers of all the pumps, see C3000Controller.initialize_no_valve()
+        """
+        if operand_value is None:
+            small_syringes = [pump.total_volume < 1 for pump in self.pumps]
+            if len(set(small_syringes)) > 1:
+                return self._apply_to_each_pump('initialize_no_valve', wait=wait)
+            operand_value = 1 if small_syringes[0] else 0
+
+        self.write_to_pumps([dtprotocol.DTCommand(pump_protocol.CMD_INITIALIZE_NO_VALVE, str(operand_value))])
+        if wait:
+            self.wait_until_idle()
+        return True
+
+    def set_top_velocity(self, top_velocity, secure=True):
         """
-        Sets the EEPROM config of the pump to use a 3-way T valve (I/O operations)
+        Sets the top velocity of all the pumps, see C3000Controller.set_top_velocity()
+
+        Raises:
+            ValueError: Top velocity is out of range for one of the pumps.
+
         """
-        self.set_eeprom_config(5)
+        for pump in self.pumps:
+            pump.check_top_velocity_within_range(top_velocity)
+        self.write_to_pumps([dtprotocol.DTCommand(pump_protocol.CMD_TOPVELOCITY, str(int(top_velocity)))])
+        if secure:
+            return self._apply_to_each_pump('set_top_velocity', top_velocity, secure=True)
+        return True
 
-    def flash_eeprom_4_way_nondist_valve(self):
+    def set_valve_position(self, valve_position, secure=True):
         """
-        Sets the EEPROM config of the pump to use a 4-way Non-Dist valve (I/O/E operations)
-        Note in this configuration it is not possible to pump to E!
-        valve position E connects E with O while B connects E and I (90-degrees)
+        Sets the valve of all the pumps, see C3000Controller.set_valve_position()
+
+        Raises:
+            ValueError: The valve position is invalid/unknown.
+
         """
-        self.set_eeprom_config(2)
+        if all(pump.shadow_state and pump.shadow.valve_position == valve_position for pump in self.pumps):
+            return True
+        self.write_to_pumps([valve_position_to_dtcommand(valve_position)])
+        if secure:
+            self.wait_until_idle()
+            return self._apply_to_each_pump('set_valve_position', valve_position, secure=True)
+        return True
 
-    def flash_eeprom_4_way_dist_valve(self):
+    def _move(self, volume_in_ml, valve_position, speed, wait, is_volume_movable, append_move):
+        if not self._are_alike('steps_per_ml') or (speed is None and not self._are_alike('default_top_velocity')):
+            return None
+        if not all(is_volume_movable(pump, volume_in_ml) for pump in self.pumps):
+            return None
+
+        sequence = C3000CommandSequence(self.pumps[0])
+        sequence.velocity(speed if speed is not None else self.pumps[0].default_top_velocity)
+        if valve_position is not None:
+            sequence.valve(valve_position)
+        append_move(sequence, volume_in_ml)
+        self.write_to_pumps(sequence.dtcommands)
+
+        if wait:
+            self.wait_until_idle()
+        return True
+
+    def pump(self, volume_in_ml, from_valve=None, speed_in=None, wait=False, secure=True):
         """
-        Sets the EEPROM config of the pump to use a 4-way Dist Valve (I/O/E operations)
+        Pumps the volume with all the pumps, see C3000Controller.pump()
+
+        Velocity, valve and move are sent in a single packet, as with chained=True, secure is therefore ignored.
+
+        Returns:
+            True (bool): The supplied volume is pumpable by all the pumps.
+
+            False (bool): Supplied volume is not pumpable by some of the pumps, the pumps are then handled one by
+                one.
+
         """
-        self.set_eeprom_config(4)
+        moved = self._move(volume_in_ml, from_valve, speed_in, wait,
+                           C3000Controller.is_volume_pumpable, C3000CommandSequence.pump)
+        if moved is None:
+            return self._apply_to_each_pump('pump', volume_in_ml, from_valve=from_valve, speed_in=speed_in,
+                                            wait=wait, secure=secure)
+        return moved
 
-    def get_eeprom_config(self):
+    def deliver(self, volume_in_ml, to_valve=None, speed_out=None, wait=False, secure=True):
         """
-        Gets the EEPROM configuration.
+        Delivers the volume with all the pumps, see C3000Controller.deliver()
+
+        Velocity, valve and move are sent in a single packet, as with chained=True, secure is therefore ignored.
 
         Returns:
-            eeprom_config (int): The configuration of the EEPROM.
+            True (bool): The supplied volume is deliverable by all the pumps.
 
-        """
-        (_, _, eeprom_config) = self.write_and_read_from_pump(self._protocol.forge_report_eeprom_packet())
-        return eeprom_config
+            False (bool): Supplied volume is not deliverable by some of the pumps, the pumps are then handled one by
+                one.
 
-    def get_current_valve_config(self):
         """
-        Infers the current valve configuration based on the EEPROM data.
+        if volume_in_ml == 0:
+            return True
+        moved = self._move(volume_in_ml, to_valve, speed_out, wait,
+                           C3000Controller.is_volume_deliverable, C3000CommandSequence.deliver)
+        if moved is None:
+            return self._apply_to_each_pump('deliver', volume_in_ml, to_valve=to_valve, speed_out=speed_out,
+                                            wait=wait, secure=secure)
+        return moved
+
+    def go_to_volume(self, volume_in_ml, speed=None, wait=False, secure=True):
         """
-        current_eeprom_config = self.get_eeprom_config().split(',')
-        valve_config = current_eeprom_config[10]
-        # Valve config: IOBEXYZ
-        # [I]nput, [O]utput, [B]ypass, [E]xtra positions: n*90 deg (e.g. 0 -> 0 deg, 2 -> 180 deg)
-        # [X], [Y] allow plunger movement in [B] and [E], respectively (Y=1 for DIST to enable delivering to E!)
-        # [Z] swap the bypass and extra position on a 4-position valve if a [Y] initialization command is issued.
+        Moves all the pumps to the volume, see C3000Controller.go_to_volume()
 
-        if valve_config == "2013100":
-            # flash_eeprom_3_way_t_valve() AND flash_eeprom_3_way_y_valve(). Difference is jumper J2-5, check with ?28
-            current_valve_config = "3-WAY"
-        elif valve_config == "2033110":
-            # flash_eeprom_4_way_dist_valve()
-            current_valve_config = "4-WAY dist"
-        elif valve_config == "2130001":
-            # flash_eeprom_4_way_nondist_valve()
-            current_valve_config = "4-WAY nondist"
-        else:
-            # e.g. DEBUG:pycont.DTStatus:Received /0`10,75,14,62,1,1,20,10,48,210,2013010,0,0,0,0,0,25,20,15,0000000
-            print(valve_config)
-            current_valve_config = "Unknown"
+        Velocity and move are sent in a single packet, as with chained=True, secure is therefore ignored.
 
-        return current_valve_config
+        Returns:
+            True (bool): The supplied volume is valid for all the pumps.
+
+            False (bool): The supplied volume is not valid for some of the pumps, the pumps are then handled one
+                by one.
 
-    def terminate(self):
-        """
-        Sends the command to terminate the current action.
         """
-        self.write_and_read_from_pump(self._protocol.forge_terminate_packet())
+        moved = self._move(volume_in_ml, None, speed, wait,
+                           C3000Controller.is_volume_valid, C3000CommandSequence.go_to_volume)
+        if moved is None:
+            return self._apply_to_each_pump('go_to_volume', volume_in_ml, speed=speed, wait=wait, secure=secure)
+        return moved
 
 
 class MultiPumpController(object):
@@ -1217,34 +3108,123 @@ class MultiPumpController(object):
     Args:
         setup_config (Dict): The configuration of the setup.
 
+        clock (SystemClock or VirtualClock): The clock of the controller and its pumps, default set to DEFAULT_CLOCK
+            (the real time). On a VirtualClock the hubs are handled one after the other, see concurrent_hubs.
+
+        reactor (PumpReactor): Drives the I/O of all the hubs, and polls the pumps, from a single thread (see
+            pycont.reactor), default set to None for one worker thread per hub. The hubs are then handled one after
+            the other and the dispatcher setting of the hubs is ignored.
+
     """
-    def __init__(self, setup_config):
+    def __init__(self, setup_config, clock=None, reactor=None):
         self.logger = create_logger(self.__class__.__name__)
+        self._clock = clock if clock is not None else DEFAULT_CLOCK
+        self.reactor = reactor
         self.pumps = {}
         self._io = []
+        self._hub_executors = {}
+        self._hub_executors_lock = threading.Lock()
+        self._hub_worker = threading.local()
+        self._group_controllers = {}
+        # Concurrent sleeps add up on a VirtualClock, the hubs are then handled from a single thread
+        self.concurrent_hubs = reactor is None and not isinstance(self._clock, VirtualClock)
 
         # Sets groups and default configs if provided in the config dictionary
         self.groups = setup_config['groups'] if 'groups' in setup_config else {}
         self.default_config = setup_config['default'] if 'default' in setup_config else {}
+        # Sends the commands to groups through the broadcast and group addresses of the pumps
+        self.hardware_groups = setup_config.get('hardware_groups', False)
 
         if "hubs" in setup_config:  # This implements the "new" behaviour with multiple hubs
             for hub_config in setup_config["hubs"]:
                 # Each hub has its own I/O config. Create a PumpIO object per each hub and reuse it with -1 after append
-                self._io.append(PumpIO.from_config(hub_config['io']))
+                self._io.append(self._create_io(hub_config['io']))
                 for pump_name, pump_config in list(hub_config['pumps'].items()):
                     full_pump_config = self.default_pump_config(pump_config)
-                    self.pumps[pump_name] = C3000Controller.from_config(self._io[-1], pump_name, full_pump_config)
+                    self.pumps[pump_name] = self._create_pump(self._io[-1], pump_name, full_pump_config)
         else:  # This implements the "old" behaviour with one hub per object instance / json file
-            self._io = PumpIO.from_config(setup_config['io'])
+            self._io = self._create_io(setup_config['io'])
             for pump_name, pump_config in list(setup_config['pumps'].items()):
                 full_pump_config = self.default_pump_config(pump_config)
-                self.pumps[pump_name] = C3000Controller.from_config(self._io, pump_name, full_pump_config)
+                self.pumps[pump_name] = self._create_pump(self._io, pump_name, full_pump_config)
 
         # Adds pumps as attributes
         self.set_pumps_as_attributes()
 
+    def _create_io(self, io_config):
+        """
+        Creates the I/O of a hub from its configuration.
+
+        If the configuration sets "dispatcher" to true, the PumpIO is owned by a PumpIODispatcher thread. With a
+        reactor, the PumpIO is driven by the reactor.
+
+        Args:
+            io_config (Dict): Dictionary holding the I/O configuration data.
+
+        Returns:
+            PumpIO, PumpIODispatcher or ReactorIO: The I/O to give to the pumps of the hub.
+
+        """
+        pump_io = PumpIO.from_config(io_config)
+        if self.reactor is not None:
+            return self.reactor.add_hub(pump_io)
+        if io_config.get('dispatcher', False):
+            return PumpIODispatcher(pump_io)
+        return pump_io
+
+    def _release_io(self, pump_io):
+        """
+        Releases the I/O of a hub created by _create_io().
+
+        Args:
+            pump_io (PumpIO or PumpIODispatcher): The I/O of the hub.
+
+        """
+        if isinstance(pump_io, PumpIODispatcher):
+            pump_io.close()
+            pump_io = pump_io._io
+        pump_io.release()
+
+    def close(self):
+        """
+        Stops the worker threads of the hubs and releases their I/O, the ports are closed unless another controller
+        of the process still uses them. The reactor, if any, is left running.
+        """
+        with self._hub_executors_lock:
+            (executors, self._hub_executors) = (self._hub_executors, {})
+        for executor in executors.values():
+            executor.shutdown()
+        for pump_io in (self._io if isinstance(self._io, list) else [self._io]):
+            self._release_io(pump_io)
+        self._io = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _create_pump(self, pump_io, pump_name, pump_config):
+        """
+        Creates the controller of a pump from its configuration, see C3000Controller.from_config()
+
+        Args:
+            pump_io (PumpIO): The I/O of the hub the pump is on.
+
+            pump_name (str): Name of the pump.
+
+            pump_config (Dict): Dictionary containing the pump configuration data.
+
+        Returns:
+            C3000Controller: The controller of the pump.
+
+        """
+        if self.reactor is not None:
+            pump_config = dict(pump_config, poller=self.reactor)
+        return C3000Controller.from_config(pump_io, pump_name, dict(pump_config, clock=self._clock))
+
     @classmethod
-    def from_configfile(cls, setup_configfile):
+    def from_configfile(cls, setup_configfile, **kwargs):
         """
         Obtains the configuration data from the supplied configuration file.
 
@@ -1253,12 +3233,14 @@ class MultiPumpController(object):
 
             setup_configfile (File): The configuration file.
 
+            **kwargs: Other arguments of the controller, e.g. clock.
+
         Returns:
             MultiPumpController: A new MultiPumpController object with the configuration set from the config file.
 
         """
         with open(setup_configfile) as f:
-            return cls(json.load(f))
+            return cls(json.load(f), **kwargs)
 
     def default_pump_config(self, pump_specific_config):
         """
@@ -1344,39 +3326,286 @@ class MultiPumpController(object):
 
     def get_all_pumps(self):
         """
-        Obtains a list of all pumps.
+        Obtains a list of all pumps.
+
+        Returns:
+            pumps (List): A list of the all the pump objects in the Controller.
+
+        """
+
+        return self.pumps
+
+    def get_pumps_in_group(self, group_name):
+        """
+        Obtains a list of all pumps with group_name.
+
+        Args:
+            group_name (List): The group name
+
+        Returns:
+            pumps (List): A list of the pump objects in the group. None for non-existing groups.
+
+        """
+        pumps = []
+        try:
+            pump_list = self.groups[group_name]
+        except KeyError:
+            return None
+
+        for pump_name in pump_list:
+            pumps.append(self.pumps[pump_name])
+        return pumps
+
+    def apply_command_to_pumps(self, pump_names, command, *args, **kwargs):
+        """
+        Applies a given command to the pumps.
+
+        Args:
+            pump_names (List): List containing the pump names.
+
+            command (str): The command to apply.
+
+            *args: Variable length argument list.
+
+            **kwargs: Arbitrary keyword arguments.
+
+        The pumps of different hubs are handled concurrently, one worker thread per hub, while the pumps of a same hub
+        are handled one after the other, in the order of pump_names. Setting concurrent_hubs to False handles all
+        the pumps in the calling thread.
+
+        Returns:
+            returns (Dict): Dictionary of the functions.
+
+        Raises:
+            Exception: The first exception raised by a pump, once all the hubs are done.
+
+        """
+        def apply_on_hub(hub_pump_names):
+            hub_returns = {}
+            for pump_name in hub_pump_names:
+                func = getattr(self.pumps[pump_name], command)
+                hub_returns[pump_name] = func(*args, **kwargs)
+            return hub_returns
+
+        hub_returns = {}
+        for returns in self.run_on_hubs(pump_names, apply_on_hub):
+            hub_returns.update(returns)
+
+        return {pump_name: hub_returns[pump_name] for pump_name in pump_names}
+
+    def get_pumps_per_hub(self, pump_names):
+        """
+        Sorts pumps by hub.
+
+        Args:
+            pump_names (List): The name of the pumps.
+
+        Returns:
+            pumps_per_hub (Dict): The names of the pumps (in the order of pump_names) by hub I/O.
+
+        """
+        pumps_per_hub = {}
+        for pump_name in pump_names:
+            pumps_per_hub.setdefault(self.pumps[pump_name]._io, []).append(pump_name)
+        return pumps_per_hub
+
+    def run_on_hubs(self, pump_names, func):
+        """
+        Runs a function once per hub, on the pumps of pump_names connected to it. The hubs are handled concurrently,
+        one worker thread per hub, unless there is a single hub or concurrent_hubs is False. The worker threads share
+        the deadline of the calling thread, see retry.deadline(). Called from the worker thread of a hub, the function
+        runs on that hub in the calling thread, which would otherwise wait for itself.
+
+        Args:
+            pump_names (List): The name of the pumps.
+
+            func (Callable): The function, called with the list of the names of the pumps of a hub.
+
+        Returns:
+            returns (List): The returns of the function, one per hub.
+
+        Raises:
+            Exception: The first exception raised by the function, once all the hubs are done.
+
+        """
+        pumps_per_hub = self.get_pumps_per_hub(pump_names)
+        if len(pumps_per_hub) <= 1 or not self.concurrent_hubs:
+            return [func(hub_pump_names) for hub_pump_names in pumps_per_hub.values()]
+
+        deadline = retry.current_deadline()
+
+        def run_with_deadline(hub_pump_names):
+            with retry.inherit_deadline(deadline):
+                return func(hub_pump_names)
+
+        current_hub = getattr(self._hub_worker, 'hub', None)
+        futures = {hub: self._get_hub_executor(hub).submit(run_with_deadline, hub_pump_names)
+                   for hub, hub_pump_names in pumps_per_hub.items() if hub is not current_hub}
+        if current_hub in pumps_per_hub:
+            future = futures[current_hub] = concurrent.futures.Future()
+            try:
+                future.set_result(func(pumps_per_hub[current_hub]))
+            except Exception as err:
+                future.set_exception(err)
+        concurrent.futures.wait(futures.values())
+        return [futures[hub].result() for hub in pumps_per_hub]
+
+    def _get_hub_executor(self, hub):
+        """
+        Gets the worker thread sending the commands to the pumps of a hub.
+
+        Args:
+            hub (PumpIO): The I/O of the hub.
+
+        Returns:
+            concurrent.futures.ThreadPoolExecutor: The single worker executor of the hub.
+
+        """
+        with self._hub_executors_lock:
+            if hub not in self._hub_executors:
+                self._hub_executors[hub] = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='{}-{}'.format(self.__class__.__name__, hub.port),
+                    initializer=self._set_hub_worker, initargs=(hub,))
+            return self._hub_executors[hub]
+
+    def _set_hub_worker(self, hub):
+        # Marks the worker thread of a hub, see run_on_hubs()
+        self._hub_worker.hub = hub
+
+    def apply_command_to_all_pumps(self, command, *args, **kwargs):
+        """
+        Applies a given command to all of the pumps.
+
+        Args:
+            command (str): The command to apply.
+
+            *args: Variable length argument list.
+
+            **kwargs: Arbitrary keyword arguments.
+
+        Returns:
+            returns (Dict): Dictionary of the functions.
+
+        """
+        return self.apply_command_to_pumps(list(self.pumps.keys()), command, *args, **kwargs)
+
+    def apply_command_to_group(self, group_name, command, *args, **kwargs):
+        """
+        Applies a given command to the group.
+
+        If hardware_groups is set in the configuration, the commands of GROUP_COMMANDS are sent with as few packets as
+        possible, see apply_command_to_pumps_at_once().
+
+        Args:
+            group_name (str): Name of the group.
+
+            command (str): The command to apply.
+
+            *args: Variable length argument list.
+
+            **kwargs: Arbitrary keyword arguments.
+
+        Returns:
+            returns (Dict) Dictionary of the functions.
+
+        """
+        if self.hardware_groups and command in GROUP_COMMANDS:
+            return self.apply_command_to_pumps_at_once(self.groups[group_name], command, *args, **kwargs)
+        return self.apply_command_to_pumps(self.groups[group_name], command, *args, **kwargs)
+
+    def get_addressing(self, pump_names):
+        """
+        Finds the fewest addresses reaching exactly the given pumps: the broadcast address if they are all the pumps of
+        a hub, the addresses of the quad and dual groups they fill, and the address of each remaining pump.
+
+        .. note:: The pumps of the configuration are assumed to be all the pumps connected to their hub, unless the
+            port of the hub is shared with another controller of the process (see is_hub_shared()): the pumps of
+            such a hub are always reached by their own address.
+
+        Args:
+            pump_names (List): The name of the pumps.
+
+        Returns:
+            addressing (List): List of (controller, pump_names) tuples, the controller being a C3000GroupController,
+                or the C3000Controller of a pump reached by its own address.
+
+        """
+        pumps_per_hub = self.get_pumps_per_hub(pump_names)
+
+        addressing = []
+        for hub, hub_pump_names in pumps_per_hub.items():
+            if self.is_hub_shared(hub):
+                # The broadcast and group addresses would also reach the pumps of the other controllers
+                addressing.extend((self.pumps[pump_name], [pump_name]) for pump_name in hub_pump_names)
+                continue
+
+            all_hub_pump_names = [pump_name for pump_name, pump in self.pumps.items() if pump._io is hub]
+            if len(hub_pump_names) > 1 and set(hub_pump_names) == set(all_hub_pump_names):
+                addressing.append((self._get_group_controller(hub, C3000Broadcast, hub_pump_names), hub_pump_names))
+                continue
+
+            remaining = list(hub_pump_names)
+            for group_address in (quad_group_address, dual_group_address):
+                groups = {}
+                for pump_name in all_hub_pump_names:
+                    groups.setdefault(group_address(self.pumps[pump_name].address), []).append(pump_name)
+                for address, members in groups.items():
+                    if len(members) > 1 and all(member in remaining for member in members):
+                        addressing.append((self._get_group_controller(hub, address, members), members))
+                        remaining = [pump_name for pump_name in remaining if pump_name not in members]
+            addressing.extend((self.pumps[pump_name], [pump_name]) for pump_name in remaining)
+
+        return addressing
+
+    @staticmethod
+    def is_hub_shared(hub):
+        """
+        Determines if the port of a hub is also used by another controller of the process, see
+        PumpIORegistry.is_shared().
+
+        Args:
+            hub (PumpIO, PumpIODispatcher or ReactorIO): The I/O of the hub.
 
         Returns:
-            pumps (List): A list of the all the pump objects in the Controller.
+            True (bool): The port is shared.
+
+            False (bool): The port is not shared.
 
         """
+        # A PumpIODispatcher or a ReactorIO wraps the PumpIO of the hub
+        pump_io = getattr(hub, '_io', hub)
+        return pump_io_registry.is_shared(pump_io)
 
-        return self.pumps
+    def _get_group_controller(self, hub, address, pump_names):
+        key = (hub, address)
+        if key not in self._group_controllers:
+            pumps = [self.pumps[pump_name] for pump_name in pump_names]
+            self._group_controllers[key] = self._create_group_controller(hub, address, pumps)
+        return self._group_controllers[key]
 
-    def get_pumps_in_group(self, group_name):
+    def _create_group_controller(self, hub, address, pumps):
         """
-        Obtains a list of all pumps with group_name.
+        Creates the controller of the pumps of a hub reached by a broadcast or group address.
 
         Args:
-            group_name (List): The group name
+            hub (PumpIO): The I/O of the hub.
+
+            address (chr): The broadcast or group address.
+
+            pumps (list): The controllers of the pumps reached by the address.
 
         Returns:
-            pumps (List): A list of the pump objects in the group. None for non-existing groups.
+            C3000GroupController: The controller of the group.
 
         """
-        pumps = []
-        try:
-            pump_list = self.groups[group_name]
-        except KeyError:
-            return None
-
-        for pump_name in pump_list:
-            pumps.append(self.pumps[pump_name])
-        return pumps
+        return C3000GroupController(hub, address, pumps)
 
-    def apply_command_to_pumps(self, pump_names, command, *args, **kwargs):
+    def apply_command_to_pumps_at_once(self, pump_names, command, *args, **kwargs):
         """
-        Applies a given command to the pumps.
+        Applies a given command to the pumps with as few packets as possible, see get_addressing(). The pumps reached
+        by a group address are sent a single packet, without reply (see C3000GroupController).
+
+        Commands or arguments C3000GroupController does not handle are applied pump by pump.
 
         Args:
             pump_names (List): List containing the pump names.
@@ -1388,51 +3617,99 @@ class MultiPumpController(object):
             **kwargs: Arbitrary keyword arguments.
 
         Returns:
-            returns (Dict): Dictionary of the functions.
+            returns (Dict): Dictionary of the functions, the pumps sent the same packet sharing the same return.
 
         """
         returns = {}
-        for pump_name in pump_names:
-            func = getattr(self.pumps[pump_name], command)
-            returns[pump_name] = func(*args, **kwargs)
+        for controller, controller_pump_names in self.get_addressing(pump_names):
+            func = getattr(controller, command, None)
+            if isinstance(controller, C3000GroupController):
+                try:
+                    inspect.signature(func).bind(*args, **kwargs)
+                except TypeError:
+                    func = None
+                if func is None:
+                    returns.update(self.apply_command_to_pumps(controller_pump_names, command, *args, **kwargs))
+                    continue
+            result = func(*args, **kwargs)
+            returns.update((pump_name, result) for pump_name in controller_pump_names)
 
-        return returns
+        return {pump_name: returns[pump_name] for pump_name in pump_names}
 
-    def apply_command_to_all_pumps(self, command, *args, **kwargs):
+    def arm(self, sequences):
         """
-        Applies a given command to all of the pumps.
+        Loads a command sequence into each pump without starting it, see fire().
 
         Args:
-            command (str): The command to apply.
-
-            *args: Variable length argument list.
-
-            **kwargs: Arbitrary keyword arguments.
+            sequences (Dict): The C3000CommandSequence of each pump, by pump name.
 
         Returns:
-            returns (Dict): Dictionary of the functions.
-
-        """
-        return self.apply_command_to_pumps(list(self.pumps.keys()), command, *args, **kwargs)
+            returns (Dict): For each pump, True if the sequence was accepted, False if an operand was rejected.
 
-    def apply_command_to_group(self, group_name, command, *args, **kwargs):
         """
-        Applies a given command to the group.
+        def arm_on_hub(hub_pump_names):
+            return {pump_name: self.pumps[pump_name].arm_sequence(sequences[pump_name])
+                    for pump_name in hub_pump_names}
 
-        Args:
-            group_name (str): Name of the group.
+        returns = {}
+        for hub_returns in self.run_on_hubs(list(sequences.keys()), arm_on_hub):
+            returns.update(hub_returns)
+        return returns
 
-            command (str): The command to apply.
+    def fire(self, pump_names=None):
+        """
+        Starts the sequences loaded with arm(), all the hubs being triggered concurrently.
 
-            *args: Variable length argument list.
+        The pumps are triggered one by one, with an execute packet each. If hardware_groups is set in the
+        configuration, each hub is instead triggered by a single execute packet: sent to the group address reaching
+        exactly the pumps when there is one, or else to the broadcast address. The broadcast also reaches the
+        pumps of the configuration which are not armed, they have nothing to execute. It is not used when other
+        pumps of the hub are armed but not fired, nor when the port of the hub is shared with another controller
+        (see is_hub_shared()), whose pumps may have commands loaded.
 
-            **kwargs: Arbitrary keyword arguments.
+        Args:
+            pump_names (List): The pumps to start, default set to None for all the armed pumps.
 
         Returns:
-            returns (Dict) Dictionary of the functions.
+            start_times (Dict): For each pump, the time on the clock of the controller at which its trigger was sent.
+                The start skew of the pumps is the spread of these times.
+
+        """
+        if pump_names is None:
+            pump_names = [pump_name for pump_name, pump in self.pumps.items() if pump.is_armed()]
+
+        def fire_on_hub(hub_pump_names):
+            hub = self.pumps[hub_pump_names[0]]._io
+            trigger = None
+            if self.hardware_groups and not self.is_hub_shared(hub):
+                other_armed_pumps = [pump_name for pump_name, pump in self.pumps.items()
+                                     if pump._io is hub and pump.is_armed() and pump_name not in hub_pump_names]
+                addressing = self.get_addressing(hub_pump_names)
+                if len(addressing) == 1 and isinstance(addressing[0][0], C3000GroupController):
+                    trigger = addressing[0][0]
+                elif not other_armed_pumps:
+                    all_hub_pump_names = [pump_name for pump_name, pump in self.pumps.items() if pump._io is hub]
+                    trigger = self._get_group_controller(hub, C3000Broadcast, all_hub_pump_names)
+
+            start_times = {}
+            if trigger is not None:
+                trigger.fire()
+                now = self._clock.time()
+                start_times = {pump_name: now for pump_name in hub_pump_names}
+            else:
+                for pump_name in hub_pump_names:
+                    self.pumps[pump_name].fire()
+                    start_times[pump_name] = self._clock.time()
+            return start_times
 
-        """
-        return self.apply_command_to_pumps(self.groups[group_name], command, *args, **kwargs)
+        start_times = {}
+        for hub_start_times in self.run_on_hubs(pump_names, fire_on_hub):
+            start_times.update(hub_start_times)
+
+        if start_times:
+            self.logger.debug("Fired %d pumps, start skew %.1f ms", len(start_times),
+                              1000 * (max(start_times.values()) - min(start_times.values())))
+        return start_times
 
     def are_pumps_initialized(self):
         """
@@ -1457,41 +3734,92 @@ class MultiPumpController(object):
             secure (bool): Ensures everything is correct, default set to True.
 
         """
-        for pump in list(self.pumps.values()):
-            if not pump.is_initialized():
-                pump.initialize_valve_only(wait=False)
+        if self.hardware_groups:
+            apply_command = self.apply_command_to_pumps_at_once
+        else:
+            apply_command = self.apply_command_to_pumps
+
+        not_initialized = [pump_name for pump_name, pump in self.pumps.items() if not pump.is_initialized()]
+
+        apply_command(not_initialized, 'initialize_valve_only', wait=False)
         self.wait_until_all_pumps_idle()
 
-        for pump in list(self.pumps.values()):
-            if not pump.is_initialized():
-                pump.set_valve_position(pump.initialize_valve_position, secure=secure)
+        for pump_name in not_initialized:
+            pump = self.pumps[pump_name]
+            pump.set_valve_position(pump.initialize_valve_position, secure=secure)
         self.wait_until_all_pumps_idle()
 
-        for pump in list(self.pumps.values()):
-            if not pump.is_initialized():
-                pump.initialize_no_valve(wait=False)
+        apply_command(not_initialized, 'initialize_no_valve', wait=False)
         self.wait_until_all_pumps_idle()
 
         self.apply_command_to_all_pumps('init_all_pump_parameters', secure=secure)
         self.wait_until_all_pumps_idle()
 
+    def wait_until_pumps_idle(self, pump_names):
+        """
+        Waits for the pumps to be idle.
+
+        A single loop polls the pumps still busy, in order of the predicted end of their move, and drops them as they
+        become idle. Pumps are only polled around the predicted end of their move when it is known.
+
+        Args:
+            pump_names (List): The name of the pumps.
+
+        Returns:
+            completion_times (Dict): The time, on the clock of the controller, at which each pump was found idle.
+
+        """
+        completion_times = {}
+        now = self._clock.time()
+        next_polls = {pump_name: next_poll_time(self.pumps[pump_name], now) for pump_name in pump_names}
+
+        while next_polls:
+            for pump_name in sorted(next_polls, key=next_polls.get):
+                if next_polls[pump_name] > self._clock.time():
+                    break
+                pump = self.pumps[pump_name]
+                if pump.is_idle():
+                    completion_times[pump_name] = self._clock.time()
+                    del next_polls[pump_name]
+                else:
+                    next_polls[pump_name] = next_poll_time(pump, self._clock.time(), busy=True)
+
+            if next_polls:
+                retry.sleep(max(0, min(next_polls.values()) - self._clock.time()), self._clock)
+
+        return completion_times
+
     def wait_until_all_pumps_idle(self):
         """
-        Sends the command 'wait_until_idle' to the pumps.
+        Waits for all the pumps to be idle, see wait_until_pumps_idle().
+
+        Returns:
+            completion_times (Dict): The time, on the clock of the controller, at which each pump was found idle.
+
         """
-        self.apply_command_to_all_pumps('wait_until_idle')
+        return self.wait_until_pumps_idle(list(self.pumps.keys()))
 
     def wait_until_group_idle(self, group_name):
         """
-        Sends the command ' wait_until_idle' to all pumps of a group.
+        Waits for all pumps of a group to be idle, see wait_until_pumps_idle().
+
+        Returns:
+            completion_times (Dict): The time, on the clock of the controller, at which each pump was found idle.
+
         """
-        self.apply_command_to_group(group_name=group_name, command='wait_until_idle')
+        return self.wait_until_pumps_idle(self.groups[group_name])
 
     def terminate_all_pumps(self):
         """
         Sends the command 'terminate' to all the pumps.
+
+        If hardware_groups is set in the configuration, each hub is stopped with as few packets as possible, see
+        apply_command_to_pumps_at_once().
         """
-        self.apply_command_to_all_pumps('terminate')
+        if self.hardware_groups:
+            self.apply_command_to_pumps_at_once(list(self.pumps.keys()), 'terminate')
+        else:
+            self.apply_command_to_all_pumps('terminate')
 
     def are_pumps_idle(self):
         """
@@ -1503,7 +3831,9 @@ class MultiPumpController(object):
             False (bool): The pumps are not idle.
 
         """
-        for pump in list(self.pumps.values()):
+        # Pumps predicted to finish last are the most likely to be busy, they are checked first
+        pumps = sorted(self.pumps.values(), key=lambda pump: pump.estimated_completion_time() or 0, reverse=True)
+        for pump in pumps:
             if not pump.is_idle():
                 return False
         return True
@@ -1520,7 +3850,8 @@ class MultiPumpController(object):
         """
         return not self.are_pumps_idle()
 
-    def pump(self, pump_names, volume_in_ml, from_valve=None, speed_in=None, wait=False, secure=True):
+    def pump(self, pump_names, volume_in_ml, from_valve=None, speed_in=None, wait=False, secure=True, chained=False,
+             operation=False, deadline=None):
         """
         Pumps the desired volume.
 
@@ -1537,7 +3868,31 @@ class MultiPumpController(object):
 
             secure (bool): Ensures everything is correct, default set to False.
 
+            chained (bool): Sends velocity, valve and move to each pump as one command sequence, default set to False.
+
+            operation (bool): Returns a PumpOperation completing when all the pumps are idle, default set to False.
+
+            deadline (float): Time allowed in seconds for the call, waiting included, default set to None. Raises
+                PumpDeadlineError once over, see retry.deadline().
+
+        Returns:
+            PumpOperation: With operation set to True, its result is the list of the pumps results, in the order of
+                pump_names.
+
         """
+        if deadline is not None:
+            with retry.deadline(deadline, self._clock):
+                return self.pump(pump_names, volume_in_ml, from_valve, speed_in, wait, secure, chained, operation)
+
+        if chained:
+            returns = self.apply_command_to_pumps(pump_names, 'pump', volume_in_ml, from_valve=from_valve,
+                                                  speed_in=speed_in, wait=False, chained=True, operation=operation)
+            if wait:
+                self.wait_until_pumps_idle(pump_names)
+            if operation:
+                return all_of(*returns.values())
+            return
+
         if speed_in is not None:
             self.apply_command_to_pumps(pump_names, 'set_top_velocity', speed_in, secure=secure)
         else:
@@ -1546,12 +3901,17 @@ class MultiPumpController(object):
         if from_valve is not None:
             self.apply_command_to_pumps(pump_names, 'set_valve_position', from_valve, secure=secure)
 
-        self.apply_command_to_pumps(pump_names, 'pump', volume_in_ml, speed_in=speed_in, wait=False)
+        returns = self.apply_command_to_pumps(pump_names, 'pump', volume_in_ml, speed_in=speed_in, wait=False,
+                                              operation=operation)
 
         if wait:
-            self.apply_command_to_pumps(pump_names, 'wait_until_idle')
+            self.wait_until_pumps_idle(pump_names)
+
+        if operation:
+            return all_of(*returns.values())
 
-    def deliver(self, pump_names, volume_in_ml, to_valve=None, speed_out=None, wait=False, secure=True):
+    def deliver(self, pump_names, volume_in_ml, to_valve=None, speed_out=None, wait=False, secure=True,
+                chained=False, operation=False, deadline=None):
         """
         Delivers the desired volume.
 
@@ -1568,7 +3928,31 @@ class MultiPumpController(object):
 
             secure (bool): Ensures everything is correct, default set to True.
 
+            chained (bool): Sends velocity, valve and move to each pump as one command sequence, default set to False.
+
+            operation (bool): Returns a PumpOperation completing when all the pumps are idle, default set to False.
+
+            deadline (float): Time allowed in seconds for the call, waiting included, default set to None. Raises
+                PumpDeadlineError once over, see retry.deadline().
+
+        Returns:
+            PumpOperation: With operation set to True, its result is the list of the pumps results, in the order of
+                pump_names.
+
         """
+        if deadline is not None:
+            with retry.deadline(deadline, self._clock):
+                return self.deliver(pump_names, volume_in_ml, to_valve, speed_out, wait, secure, chained, operation)
+
+        if chained:
+            returns = self.apply_command_to_pumps(pump_names, 'deliver', volume_in_ml, to_valve=to_valve,
+                                                  speed_out=speed_out, wait=False, chained=True, operation=operation)
+            if wait:
+                self.wait_until_pumps_idle(pump_names)
+            if operation:
+                return all_of(*returns.values())
+            return
+
         if speed_out is not None:
             self.apply_command_to_pumps(pump_names, 'set_top_velocity', speed_out, secure=secure)
         else:
@@ -1577,15 +3961,23 @@ class MultiPumpController(object):
         if to_valve is not None:
             self.apply_command_to_pumps(pump_names, 'set_valve_position', to_valve, secure=secure)
 
-        self.apply_command_to_pumps(pump_names, 'deliver', volume_in_ml, speed_out=speed_out, wait=False)
+        returns = self.apply_command_to_pumps(pump_names, 'deliver', volume_in_ml, speed_out=speed_out, wait=False,
+                                              operation=operation)
 
         if wait:
-            self.apply_command_to_pumps(pump_names, 'wait_until_idle')
+            self.wait_until_pumps_idle(pump_names)
 
-    def transfer(self, pump_names, volume_in_ml, from_valve, to_valve, speed_in=None, speed_out=None, secure=True):
+        if operation:
+            return all_of(*returns.values())
+
+    def transfer(self, pump_names, volume_in_ml, from_valve, to_valve, speed_in=None, speed_out=None, secure=True,
+                 chained=False, deadline=None, looped=False, progress=None):
         """
         Transfers the desired volume between pumps.
 
+        The pumps run their strokes in lock step, the strokes being planned once (see C3000Controller.plan_transfer())
+        for the pump with the least room left.
+
         Args:
             pump_names (List): The name of the pumps.
 
@@ -1601,24 +3993,71 @@ class MultiPumpController(object):
 
             secure (bool): Ensures that everything is correct, default set to False.
 
+            chained (bool): Sends each pump and deliver as one command sequence per pump, default set to False.
+
+            deadline (float): Time allowed in seconds for the whole transfer, default set to None. Raises
+                PumpDeadlineError once over, see retry.deadline().
+
+            looped (bool): Sends the whole transfer to each pump as one command sequence, the strokes being repeated
+                by the pumps themselves (see C3000Controller.transfer_program()), default set to False. The pumps
+                then run their strokes independently instead of in lock step.
+
+            progress (function): Called with a TransferProgress after each stroke, default set to None. Not called
+                when looped.
+
         """
-        volume_transferred = float('inf')  # Temporary value for the first cycle only, see below
-        for pump in self.get_pumps(pump_names):
-            candidate_volume = min(volume_in_ml, pump.remaining_volume)  # Smallest target and remaining is candidate
-            volume_transferred = min(candidate_volume, volume_transferred)  # Transferred is global minimum
+        if deadline is not None:
+            with retry.deadline(deadline, self._clock):
+                return self.transfer(pump_names, volume_in_ml, from_valve, to_valve, speed_in, speed_out, secure,
+                                     chained, looped=looped, progress=progress)
+
+        if looped:
+            def start_on_hub(hub_pump_names):
+                for pump_name in hub_pump_names:
+                    pump = self.pumps[pump_name]
+                    pump.transfer_program(volume_in_ml, from_valve, to_valve, speed_in, speed_out).execute()
+
+            self.run_on_hubs(pump_names, start_on_hub)
+            self.wait_until_pumps_idle(pump_names)
+            return
 
-        self.pump(pump_names, volume_transferred, from_valve, speed_in=speed_in, wait=True, secure=secure)
-        self.deliver(pump_names, volume_transferred, to_valve, speed_out=speed_out, wait=True, secure=secure)
+        pumps = self.get_pumps(pump_names)
+        if not pumps:
+            return
+        # The pump with the least room left sets the volume of the strokes
+        room = {pump: pump.step_to_volume(pump.number_of_steps - pump.get_shadow_value(
+            'plunger_position', pump.get_plunger_position)) for pump in pumps}
+        pump = min(pumps, key=room.get)
+        plan = pump.plan_transfer(volume_in_ml, from_valve, to_valve, speed_in, speed_out, stroke_volume=room[pump])
 
-        remaining_volume_to_transfer = volume_in_ml - volume_transferred
-        if remaining_volume_to_transfer > 0:
-            self.transfer(pump_names, remaining_volume_to_transfer, from_valve, to_valve, speed_in, speed_out)
+        def start_stroke_on_hub(hub_pump_names):
+            for pump_name in hub_pump_names:
+                pump = self.pumps[pump_name]
+                pump._append_stroke(pump.sequence(), *stroke).execute()
+
+        volume_transferred = 0.0
+        for (index, stroke) in enumerate(plan):
+            if chained:
+                self.run_on_hubs(pump_names, start_stroke_on_hub)
+                self.wait_until_pumps_idle(pump_names)
+            else:
+                self.pump(pump_names, stroke.volume_in_ml, from_valve, speed_in=speed_in, wait=True, secure=secure)
+                self.deliver(pump_names, stroke.volume_in_ml, to_valve, speed_out=speed_out, wait=True,
+                             secure=secure)
+            volume_transferred += stroke.volume_in_ml
+            if progress is not None:
+                progress(TransferProgress(index + 1, len(plan), volume_transferred, volume_in_ml))
 
     def parallel_transfer(self, pumps_and_volumes_dict: dict, from_valve: str, to_valve: str,
-                          speed_in=None, speed_out=None, secure=True, wait=False):
+                          speed_in=None, speed_out=None, secure=True, wait=False, sync=False, chained=False):
         """
         Transfers the desired volume between pumps.
 
+        Each pump runs its own strokes, as planned by C3000Controller.plan_transfer(), and moves on to its next
+        pick-up or dispense as soon as it is idle: a pump with a small volume to transfer is not held back by the
+        others, and the transfer lasts as long as the slowest pump alone. All the pumps are driven from the calling
+        thread, each one being polled around the predicted end of its move.
+
         Args:
             pumps_and_volumes_dict (dict): The names and volumes to be pumped for each pump.
 
@@ -1630,42 +4069,329 @@ class MultiPumpController(object):
 
             speed_out (int): The speed at which to transfer, default set to None
 
-            secure (bool): Ensures that everything is correct, default set to False.
+            secure (bool): Waits for the valve of each pump to be in position before each pick-up and dispense,
+                default set to True. Only with sync, the pipelines send the valve and the move in one packet instead.
 
-        """
+            wait (bool): Waits for the last dispense of each pump to be over, default set to False.
 
-        remaining_volume = {}
-        volume_to_transfer = {}
+            sync (bool): Synchronises the pumps at each pick-up and each dispense: all the pumps finish picking up
+                before any starts dispensing, and the other way round, default set to False.
 
-        # Wait until all the pumps have pumped to start deliver
-        self.apply_command_to_pumps(list(pumps_and_volumes_dict.keys()), "wait_until_idle")
+            chained (bool): Sends each stroke (pump and deliver) as one command sequence per pump, default set to
+                False. The pumps are then only synchronised at the end of each stroke with sync.
 
-        # Pump the target volume (or the maximum possible) for each pump
-        for pump_name, pump_target_volume in pumps_and_volumes_dict.items():
-            # Get pump
-            try:
-                pump = self.pumps[pump_name]
-            except KeyError:
+        Raises:
+            ValueError: A pick-up or a dispense was refused by its pump, the transfer is aborted.
+
+        """
+        pump_names = list(pumps_and_volumes_dict.keys())
+        for pump_name in pump_names:
+            if pump_name not in self.pumps:
                 self.logger.warning(f"Pump specified {pump_name} not found in the controller! (Available: {self.pumps}")
                 return False
 
-            # Find the volume to transfer (maximum pumpable or target, whatever is lower)
-            volume_to_transfer[pump_name] = min(pump_target_volume, pump.remaining_volume)
-            pump.pump(volume_in_ml=volume_to_transfer[pump_name], from_valve=from_valve, speed_in=speed_in, wait=False,
-                      secure=secure)
+        # The strokes are planned once the pumps are idle, from where their plunger stands
+        self.wait_until_pumps_idle(pump_names)
+        moves = {}
+        for pump_name, pump_target_volume in pumps_and_volumes_dict.items():
+            pump = self.pumps[pump_name]
+            plan = pump.plan_transfer(pump_target_volume, from_valve, to_valve, speed_in, speed_out)
+            moves[pump_name] = collections.deque(self._get_stroke_moves(pump, plan, secure and sync, chained))
+
+        if sync:
+            while any(moves.values()):
+                started = [pump_name for pump_name in pump_names if moves[pump_name]]
+                for pump_name in started:
+                    _check_move(pump_name, moves[pump_name].popleft()())
+                if any(moves.values()) or wait:
+                    self.wait_until_pumps_idle(started)
+        else:
+            self.run_pipelines(moves, wait=wait)
+
+    def _get_stroke_moves(self, pump, plan, secure, chained):
+        """
+        Gets the moves running a transfer plan on a pump, each one starting a pick-up, a dispense, or a whole stroke
+        when chained. Unless secure, the pick-ups and dispenses are sent as one packet with their valve move, so
+        starting them never waits for the pump.
+        """
+        moves = []
+        for stroke in plan:
+            if chained:
+                moves.append(functools.partial(pump._append_stroke(pump.sequence(), *stroke).execute))
+            else:
+                moves.append(functools.partial(pump.pump, stroke.volume_in_ml, stroke.from_valve,
+                                               speed_in=stroke.speed_in, secure=secure, chained=not secure))
+                moves.append(functools.partial(pump.deliver, stroke.volume_in_ml, stroke.to_valve,
+                                               speed_out=stroke.speed_out, secure=secure, chained=not secure))
+        return moves
+
+    def run_pipelines(self, moves, wait=True):
+        """
+        Runs a list of moves on each pump, each pump starting its next move as soon as it is idle, independently of
+        the other pumps. A single loop polls the pumps, around the predicted end of their move.
+
+        Args:
+            moves (Dict): The moves of each pump by pump name, each move being a function starting it without
+                waiting (e.g. a functools.partial of C3000Controller.pump()), in a list or a deque.
+
+            wait (bool): Waits for the last move of each pump to be over, default set to True.
+
+        Returns:
+            completion_times (Dict): The time, on the clock of the controller, at which each pump was found idle
+                after its last move. Pumps not waited for are left out.
+
+        Raises:
+            ValueError: A move returned False, i.e. was refused by its pump. No other move is started, the moves
+                running are not stopped.
+
+        """
+        moves = {pump_name: collections.deque(pump_moves) for pump_name, pump_moves in moves.items()}
+        completion_times = {}
+        now = self._clock.time()
+        next_polls = {pump_name: next_poll_time(self.pumps[pump_name], now) for pump_name in moves}
+
+        while next_polls:
+            for pump_name in sorted(next_polls, key=next_polls.get):
+                if next_polls[pump_name] > self._clock.time():
+                    break
+                pump = self.pumps[pump_name]
+                if not pump.is_idle():
+                    next_polls[pump_name] = next_poll_time(pump, self._clock.time(), busy=True)
+                elif moves[pump_name]:
+                    _check_move(pump_name, moves[pump_name].popleft()())
+                    if moves[pump_name] or wait:
+                        next_polls[pump_name] = next_poll_time(pump, self._clock.time())
+                    else:
+                        del next_polls[pump_name]
+                else:
+                    completion_times[pump_name] = self._clock.time()
+                    del next_polls[pump_name]
+
+            if next_polls:
+                retry.sleep(max(0, min(next_polls.values()) - self._clock.time()), self._clock)
+
+        return completion_times
+
+
+def _check_move(pump_name, started):
+    if started is False:
+        raise ValueError('Move refused by pump {}'.format(pump_name))
+
+
+class VirtualPump(object):
+    """
+    This class drives several pumps sharing the same source and destination as a single pump, whose syringe is the sum
+    of their syringes.
+
+    Volumes are split across the pumps in proportion to their syringe volume (see split_volume()): with the same top
+    velocity, the pumps all move the same number of steps and finish together. The pumps move in parallel, the hubs
+    being driven concurrently (see MultiPumpController.run_on_hubs()), so the throughput scales with the number of
+    pumps.
+
+    Args:
+        controller (MultiPumpController): The controller of the pumps.
+
+        pump_names (list or str): The name of the pumps, or the name of a group of the configuration.
+
+    Raises:
+        ValueError: No pump given, a pump not found in the controller, or a pump given twice.
+
+        TypeError: The controller is an AsyncMultiPumpController.
+
+    """
+    def __init__(self, controller, pump_names):
+        self.logger = create_logger(self.__class__.__name__)
+
+        if inspect.iscoroutinefunction(controller.wait_until_pumps_idle):
+            raise TypeError('{} drives the pumps from a thread, it cannot use {}'.format(
+                self.__class__.__name__, controller.__class__.__name__))
+
+        if isinstance(pump_names, str):
+            pump_names = controller.groups[pump_names]
+        if not pump_names:
+            raise ValueError('A virtual pump needs at least one pump')
+        unknown_pump_names = [pump_name for pump_name in pump_names if pump_name not in controller.pumps]
+        if unknown_pump_names:
+            raise ValueError('Pumps {} not found in the controller (available: {})'.format(
+                unknown_pump_names, list(controller.pumps)))
+        if len(set(pump_names)) != len(pump_names):
+            raise ValueError('Pumps given more than once in {}'.format(pump_names))
+
+        self.controller = controller
+        self.pump_names = list(pump_names)
+        self.pumps = controller.get_pumps(self.pump_names)
+        self.name = 'virtual {}'.format('+'.join(self.pump_names))
+        self.total_volume = sum(pump.total_volume for pump in self.pumps)
+
+    def split_volume(self, volume_in_ml):
+        """
+        Splits a volume across the pumps, in proportion to their syringe volume. Each pump then rounds its share to
+        its steps.
+
+        Args:
+            volume_in_ml (float): The volume to split.
+
+        Returns:
+            shares (Dict): The volume of each pump by pump name.
+
+        """
+        return {pump_name: volume_in_ml * pump.total_volume / self.total_volume
+                for pump_name, pump in zip(self.pump_names, self.pumps)}
+
+    def get_volume(self):
+        """
+        Gets the volume held by all the pumps.
+
+        Returns:
+            (float): The sum of the volumes of the pumps, in mL.
+
+        """
+        return sum(pump.get_volume() for pump in self.pumps)
+
+    @property
+    def current_volume(self):
+        """
+        See get_volume()
+        """
+        return self.get_volume()
+
+    @property
+    def remaining_volume(self):
+        """
+        Gets the remaining volume.
+
+        Returns:
+            (float): self.total_volume - self.current_volume
+        """
+        return self.total_volume - self.current_volume
+
+    def is_volume_pumpable(self, volume_in_ml):
+        """
+        Determines if each pump can pump its share of the volume, see split_volume().
+        """
+        shares = self.split_volume(volume_in_ml)
+        return all(pump.is_volume_pumpable(shares[pump_name]) for pump_name, pump in zip(self.pump_names, self.pumps))
+
+    def is_volume_deliverable(self, volume_in_ml):
+        """
+        Determines if each pump can deliver its share of the volume, see split_volume().
+        """
+        shares = self.split_volume(volume_in_ml)
+        return all(pump.is_volume_deliverable(shares[pump_name])
+                   for pump_name, pump in zip(self.pump_names, self.pumps))
+
+    def is_idle(self):
+        """
+        Determines if all the pumps are idle.
+        """
+        return all(pump.is_idle() for pump in self.pumps)
+
+    def wait_until_idle(self):
+        """
+        Waits for all the pumps to be idle, see MultiPumpController.wait_until_pumps_idle()
+        """
+        self.controller.wait_until_pumps_idle(self.pump_names)
+
+    def _move(self, command, is_volume_possible, volume_in_ml, valve, speed, wait, secure, chained, operation):
+        shares = self.split_volume(volume_in_ml)
+        # Either all the pumps move or none does, chained moves being checked as well
+        if not all(is_volume_possible(pump, shares[pump_name]) for pump_name, pump in zip(self.pump_names, self.pumps)):
+            return PumpOperation.completed(False, self.pumps) if operation else False
+
+        def start_on_hub(hub_pump_names):
+            return {pump_name: getattr(self.controller.pumps[pump_name], command)(
+                shares[pump_name], valve, speed, False, secure, chained) for pump_name in hub_pump_names}
+
+        returns = {}
+        for hub_returns in self.controller.run_on_hubs(self.pump_names, start_on_hub):
+            returns.update(hub_returns)
+
+        if not all(returns.values()):
+            # A pump rejected its chained move despite the check, the pumps which started are stopped
+            for pump_name, accepted in returns.items():
+                if accepted:
+                    self.controller.pumps[pump_name].terminate()
+            return PumpOperation.completed(False, self.pumps) if operation else False
+
+        if operation:
+            return all_of(*[pump.idle_operation() for pump in self.pumps])
+        if wait:
+            self.wait_until_idle()
+        return True
+
+    def pump(self, volume_in_ml, from_valve=None, speed_in=None, wait=False, secure=True, chained=False,
+             operation=False, deadline=None):
+        """
+        Pumps the volume, split across the pumps, see C3000Controller.pump()
+
+        Returns:
+            True (bool): The supplied volume is pumpable.
+
+            False (bool): Supplied volume is not pumpable by some of the pumps, none of them moved. With chained
+                set to True, a pump may still reject its move, the pumps which started are then terminated.
+
+            PumpOperation: With operation set to True, its result is the list of the pumps results, in the order of
+                pump_names.
+
+        """
+        if deadline is not None:
+            with retry.deadline(deadline, self.controller._clock):
+                return self.pump(volume_in_ml, from_valve, speed_in, wait, secure, chained, operation)
+
+        return self._move('pump', C3000Controller.is_volume_pumpable, volume_in_ml, from_valve, speed_in, wait,
+                          secure, chained, operation)
+
+    def deliver(self, volume_in_ml, to_valve=None, speed_out=None, wait=False, secure=True, chained=False,
+                operation=False, deadline=None):
+        """
+        Delivers the volume, split across the pumps, see C3000Controller.deliver()
+
+        Returns:
+            True (bool): The supplied volume is deliverable.
+
+            False (bool): Supplied volume is not deliverable by some of the pumps, none of them moved. With chained
+                set to True, a pump may still reject its move, the pumps which started are then terminated.
+
+            PumpOperation: With operation set to True, its result is the list of the pumps results, in the order of
+                pump_names.
+
+        """
+        if deadline is not None:
+            with retry.deadline(deadline, self.controller._clock):
+                return self.deliver(volume_in_ml, to_valve, speed_out, wait, secure, chained, operation)
+
+        return self._move('deliver', C3000Controller.is_volume_deliverable, volume_in_ml, to_valve, speed_out, wait,
+                          secure, chained, operation)
 
-            # Calculate remaining volume
-            remaining_volume[pump_name] = pump_target_volume - volume_to_transfer[pump_name]
+    def transfer(self, volume_in_ml, from_valve, to_valve, speed_in=None, speed_out=None, secure=True, chained=False,
+                 deadline=None):
+        """
+        Transfers the volume, split across the pumps, in as many strokes as needed. Each pump runs its own strokes
+        and waits for none of the others, see MultiPumpController.parallel_transfer()
+
+        Args:
+            volume_in_ml (float): The volume to be transferred.
+
+            from_valve (chr): The valve to transfer from.
+
+            to_valve (chr): the valve to transfer to.
 
-        # Wait until all the pumps have pumped to start deliver
-        self.apply_command_to_pumps(list(pumps_and_volumes_dict.keys()), "wait_until_idle")
+            speed_in (int): The speed at which to receive transfer, default set to None.
+
+            speed_out (int): The speed at which to transfer, default set to None
+
+            secure (bool): Ensures that everything is correct, default set to True.
+
+            chained (bool): Sends each stroke (pump and deliver) as one command sequence per pump, default set to
+                False.
 
-        for pump_name, volume_to_deliver in volume_to_transfer.items():
-            pump = self.pumps[pump_name]  # This cannot fail otherwise it would have failed in pumping ;)
-            pump.deliver(volume_in_ml=volume_to_deliver, wait=False, to_valve=to_valve, speed_out=speed_out)
+            deadline (float): Time allowed in seconds for the whole transfer, default set to None. Raises
+                PumpDeadlineError once over, see retry.deadline().
+
+        """
+        if deadline is not None:
+            with retry.deadline(deadline, self.controller._clock):
+                return self.transfer(volume_in_ml, from_valve, to_valve, speed_in, speed_out, secure, chained)
 
-        left_to_pump = {pump: volume for pump, volume in remaining_volume.items() if volume > 0}
-        if len(left_to_pump) > 0:
-            self.parallel_transfer(left_to_pump, from_valve, to_valve, speed_in, speed_out, secure)
-        elif wait is True:  # If no more pumping is needed wait if needed
-            self.apply_command_to_pumps(list(pumps_and_volumes_dict.keys()), "wait_until_idle")
+        self.controller.parallel_transfer(self.split_volume(volume_in_ml), from_valve, to_valve, speed_in, speed_out,
+                                          secure=secure, wait=True, chained=chained)
@@ -6,6 +6,8 @@ from ._logger import create_logger
 
 DTStart = '/'
 DTStop = '\r'
+DTMasterAddress = '0'
+DTEnd = '\x03'
 
 
 class DTInstructionPacket(object):
@@ -24,16 +26,34 @@ class DTInstructionPacket(object):
         self.dtcommands = dtcommands
 
     def to_array(self):
-        commands = ''.encode()
-        for dtcommand in self.dtcommands:
-            commands += dtcommand.to_string()
-        return bytearray(itertools.chain(DTStart.encode(),
-                                         self.address,
-                                         commands,
-                                         DTStop.encode(), ))
+        return bytearray(self.to_string())
 
     def to_string(self):
-        return bytes(self.to_array())
+        return b''.join(itertools.chain((DTStart.encode(), self.address),
+                                        (dtcommand.to_string() for dtcommand in self.dtcommands),
+                                        (DTStop.encode(), )))
+
+    def to_frame(self):
+        return DTFrame(self.to_string())
+
+
+class DTFrame(bytes):
+    """ This class is used to represent an already encoded, immutable DT instruction packet.
+
+        Being a bytes subclass, a DTFrame can be handed to the serial port as is while still offering the
+        to_array()/to_string() interface of DTInstructionPacket. Frames are built once and reused, see
+        C3000Protocol for the per-address frame cache.
+
+        (for more details see http://www.tricontinent.com/products/cseries-syringe-pumps)
+        """
+
+    __slots__ = ()
+
+    def to_array(self):
+        return bytearray(self)
+
+    def to_string(self):
+        return self
 
 
 class DTCommand(object):
@@ -63,7 +83,9 @@ class DTCommand(object):
         return bytearray(chain)
 
     def to_string(self):
-        return bytes(self.to_array())
+        if self.operand is None:
+            return self.command
+        return self.command + self.operand
 
     def __str__(self):
         return "command: " + str(self.command.decode()) + " operand: " + str(self.operand)
@@ -90,12 +112,58 @@ class DTStatus(object):
     def decode(self):
         if self.response is not None:
             info = self.response.rstrip().rstrip('\x03').lstrip(DTStart)
+            if len(info) < 2 or info[0] != DTMasterAddress:
+                self.logger.debug('Not a response frame {}'.format(self.response))
+                return None
             address = info[0]
-            # try:
             status = info[1]
             data = info[2:]
-            # except IndexError:
-            #     return None
             return address, status, data
         else:
             return None
+
+
+class DTFrameParser(object):
+
+    """ This class is used to extract the response frames from the raw byte stream of the device.
+
+        Bytes are fed as they are received, a frame spans from the start of a response ('/0') to the ETX byte
+        ('\\x03'). Anything outside a frame (e.g. the trailing '\\r\\n') is dropped, partial frames are kept until
+        completed and concatenated frames are returned one by one. A frame interrupted by the start of a new one is
+        discarded.
+
+        (for more details see http://www.tricontinent.com/products/cseries-syringe-pumps)
+        """
+
+    frame_start = (DTStart + DTMasterAddress).encode()
+    frame_end = DTEnd.encode()
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def feed(self, data):
+        self._buffer += data
+
+    def clear(self):
+        del self._buffer[:]
+
+    def next_frame(self):
+        buffer = self._buffer
+        start = buffer.find(self.frame_start)
+        if start < 0:
+            # Keep a trailing start byte, the master address may still be on its way
+            del buffer[:-1 if buffer.endswith(DTStart.encode()) else len(buffer)]
+            return None
+        end = buffer.find(self.frame_end, start)
+        if end < 0:
+            del buffer[:start]
+            return None
+        restart = buffer.rfind(self.frame_start, start + 1, end)
+        if restart >= 0:
+            start = restart
+        frame = bytes(buffer[start:end + 1])
+        del buffer[:end + 1]
+        return frame
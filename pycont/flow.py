@@ -0,0 +1,306 @@
+"""
+.. module:: flow
+   :platform: Unix
+   :synopsis: A module delivering a continuous flow with two or more pumps taking turns.
+
+.. moduleauthor:: Jonathan Grizou <Jonathan.Grizou@gla.ac.uk>
+
+A single syringe delivers in bursts: it stops dispensing while it refills. ContinuousFlow pairs two (or more) pumps,
+one dispensing at the target flow rate while the others refill faster, and hands the flow over from one pump to the
+next at the predicted end of its stroke::
+
+    flow = ContinuousFlow(controller, ['water1', 'water2'], flow_rate=2, from_valve='I', to_valve='O')
+    flow.run(duration=3600)
+    print(flow)
+
+Each pump runs a cycle loaded in advance with C3000Controller.arm_sequence(): its dispense, immediately followed by
+its refill. The handover is a single execute packet, sent when the motion model (see
+pump_protocol.estimate_move_duration()) predicts the end of the stroke of the previous pump, so the host only sends
+two packets per stroke and the flow gap is about the time the execute packet takes to reach the pump.
+
+"""
+# -*- coding: utf-8 -*-
+
+import inspect
+import threading
+import collections
+import concurrent.futures
+
+from ._logger import create_logger
+
+from . import pump_protocol
+
+#: Shortest time (in seconds) left between the end of the refill of a pump and its turn to dispense
+FLOW_HANDOVER_MARGIN = 0.5
+#: Number of handover gaps kept, see ContinuousFlow.handover_gaps
+FLOW_GAP_WINDOW = 1000
+
+#: Plan of a pump taking part in a continuous flow
+FlowPlan = collections.namedtuple('FlowPlan', ['pump', 'top_velocity', 'refill_velocity', 'flow_rate', 'stroke_volume',
+                                               'cycle', 'dispense_duration', 'refill_duration'])
+
+
+class ContinuousFlow(object):
+    """
+    This class delivers a continuous flow with pumps taking turns: while one dispenses at the flow rate, the others
+    refill at the refill speed and wait, armed, for their turn.
+
+    The pumps must refill faster than the others dispense: each pump has the strokes of all the other pumps to refill,
+    see FLOW_HANDOVER_MARGIN. Flow rates are rounded to the nearest top velocity of each pump.
+
+    Args:
+        controller (MultiPumpController): The controller of the pumps.
+
+        pump_names (list or str): The pumps taking turns, in order, or the name of a group of the configuration.
+
+        flow_rate (float): The target flow rate, in mL/min.
+
+        from_valve (chr): The valve the pumps refill from.
+
+        to_valve (chr): The valve the pumps dispense to.
+
+        refill_speed (int): The top velocity of the refills, default set to None for the default top velocity of each
+            pump.
+
+        stroke_volume (float): The volume of a stroke, default set to None for the volume of each syringe.
+
+    Raises:
+        ValueError: Fewer than two pumps, a flow rate out of the range of a pump, or refills too slow for the flow
+            rate.
+
+        TypeError: The controller is an AsyncMultiPumpController, the flow is driven from a thread.
+
+    """
+    def __init__(self, controller, pump_names, flow_rate, from_valve, to_valve, refill_speed=None,
+                 stroke_volume=None):
+        self.logger = create_logger(self.__class__.__name__)
+
+        if inspect.iscoroutinefunction(controller.wait_until_pumps_idle):
+            raise TypeError('{} drives the pumps from a thread, it cannot use {}'.format(
+                self.__class__.__name__, controller.__class__.__name__))
+
+        if isinstance(pump_names, str):
+            pump_names = controller.groups[pump_names]
+        if len(pump_names) < 2:
+            raise ValueError('A continuous flow needs at least two pumps, got {}'.format(pump_names))
+
+        self.controller = controller
+        self.pump_names = list(pump_names)
+        self.target_flow_rate = float(flow_rate)
+        self.from_valve = from_valve
+        self.to_valve = to_valve
+        self._clock = controller._clock
+
+        self.plans = [self._plan_pump(controller.pumps[pump_name], refill_speed, stroke_volume)
+                      for pump_name in self.pump_names]
+        self._check_refills()
+
+        self._stop_event = threading.Event()
+        self._thread_future = None
+        self._reset_statistics()
+
+    def __str__(self):
+        return 'flow {:.4f} mL/min (target {:.4f}), {} strokes, {:.3f} mL, handover gap mean {} max {}'.format(
+            self.achieved_flow_rate() or 0, self.target_flow_rate, self.strokes, self.volume_delivered,
+            self._format_gap(self.mean_gap()), self._format_gap(self.max_gap))
+
+    @staticmethod
+    def _format_gap(gap):
+        return 'unknown' if gap is None else '{:.1f} ms'.format(1000 * gap)
+
+    def _plan_pump(self, pump, refill_speed, stroke_volume):
+        # The top velocity is in half-steps per second, in the unit of the steps of the microstep mode
+        top_velocity = int(round(2 * self.target_flow_rate / 60.0 * pump.steps_per_ml))
+        pump.check_top_velocity_within_range(top_velocity)
+        refill_velocity = refill_speed if refill_speed is not None else pump.default_top_velocity
+        pump.check_top_velocity_within_range(refill_velocity)
+
+        stroke_steps = pump.volume_to_step(stroke_volume if stroke_volume is not None else pump.total_volume)
+        stroke_steps = min(stroke_steps, pump.number_of_steps)
+        volume = pump.step_to_volume(stroke_steps)
+
+        cycle = pump.sequence().velocity(top_velocity).deliver(volume)
+        cycle.velocity(refill_velocity).valve(self.from_valve).pump(volume).valve(self.to_valve)
+        refill_duration = 2 * pump_protocol.VALVE_MOVE_DURATION + pump.estimate_move_duration(stroke_steps,
+                                                                                              refill_velocity)
+        return FlowPlan(pump, top_velocity, refill_velocity, top_velocity / 2.0 / pump.steps_per_ml * 60, volume,
+                        cycle, pump.estimate_move_duration(stroke_steps, top_velocity), refill_duration)
+
+    def _check_refills(self):
+        total_dispense_duration = sum(plan.dispense_duration for plan in self.plans)
+        for plan in self.plans:
+            time_to_refill = total_dispense_duration - plan.dispense_duration
+            if plan.refill_duration + FLOW_HANDOVER_MARGIN > time_to_refill:
+                raise ValueError('Pump {} refills in {:.1f}s but only has {:.1f}s before its turn, raise the refill '
+                                 'speed or add pumps'.format(plan.pump.name, plan.refill_duration, time_to_refill))
+
+    def _reset_statistics(self):
+        self.strokes = 0
+        self.volume_delivered = 0.0
+        self.start_time = None
+        self.end_time = None
+        self.handover_gaps = collections.deque(maxlen=FLOW_GAP_WINDOW)
+        self.max_gap = None
+        self._gap_sum = 0.0
+        self._gap_count = 0
+
+    def achieved_flow_rate(self):
+        """
+        Gets the flow rate achieved over the strokes completed so far, handover gaps included.
+
+        Returns:
+            flow_rate (float): The flow rate in mL/min, None before the first handover.
+
+        """
+        if self.end_time is None or self.end_time <= self.start_time:
+            return None
+        return self.volume_delivered / (self.end_time - self.start_time) * 60
+
+    def mean_gap(self):
+        """
+        Gets the mean time between the predicted end of a stroke and the start of the next one, negative when the
+        strokes overlap.
+
+        Returns:
+            gap (float): The mean gap in seconds, None before the first handover.
+
+        """
+        if not self._gap_count:
+            return None
+        return self._gap_sum / self._gap_count
+
+    def prime(self):
+        """
+        Fills the pumps with a stroke from from_valve, turns their valve to to_valve and loads their cycle.
+        """
+        for plan in self.plans:
+            sequence = plan.pump.sequence().velocity(plan.refill_velocity)
+            sequence.valve(self.from_valve).go_to_volume(plan.stroke_volume).valve(self.to_valve)
+            if not sequence.execute():
+                raise ValueError('Pump {} rejected priming with {}'.format(plan.pump.name, sequence))
+        self.controller.wait_until_pumps_idle(self.pump_names)
+        for plan in self.plans:
+            self._arm(plan)
+
+    def _arm(self, plan):
+        if not plan.pump.arm_sequence(plan.cycle):
+            raise ValueError('Pump {} rejected the cycle {}'.format(plan.pump.name, plan.cycle))
+
+    def _lead_time(self, plan):
+        # The execute packet reaches the pump about half a round trip after being sent
+        latency = plan.pump.retry_policy.smoothed_latency
+        return latency / 2 if latency is not None else 0.0
+
+    def _fire(self, plan):
+        send_time = self._clock.time()
+        plan.pump.fire()
+        return (send_time + self._clock.time()) / 2
+
+    def _record_handover(self, plan, start_time, predicted_end):
+        gap = start_time - predicted_end
+        self.logger.debug("Pump %s handed over, gap %.1f ms", plan.pump.name, 1000 * gap)
+        self.handover_gaps.append(gap)
+        self.max_gap = gap if self.max_gap is None else max(self.max_gap, gap)
+        self._gap_sum += gap
+        self._gap_count += 1
+        self.strokes += 1
+        self.volume_delivered += plan.stroke_volume
+        self.end_time = start_time
+
+    def run(self, volume_in_ml=None, duration=None, prime=True):
+        """
+        Delivers the flow until the volume is delivered, the duration is over or stop() is called, whichever comes
+        first. The flow stops at the end of a stroke, the volume and duration are therefore rounded up to whole
+        strokes. The pumps are left refilled with their cycle loaded, so that run(prime=False) resumes the flow.
+
+        The handovers are scheduled from the start of the stroke of the pump dispensing, so a late handover does not
+        delay the next ones.
+
+        Args:
+            volume_in_ml (float): The volume to deliver, default set to None for no limit.
+
+            duration (float): The duration of the flow in seconds, default set to None for no limit.
+
+            prime (bool): Primes the pumps first (see prime()), default set to True. Otherwise the pumps must be
+                primed already.
+
+        Returns:
+            ContinuousFlow: The flow itself, with its statistics.
+
+        """
+        self._reset_statistics()
+        if prime:
+            self.prime()
+
+        index = 0
+        plan = self.plans[index]
+        if not plan.pump.is_armed():
+            self._arm(plan)
+        stroke_start = self.start_time = self._fire(plan)
+        while True:
+            predicted_end = stroke_start + plan.dispense_duration
+            if self._stop_event.is_set() or \
+                    (volume_in_ml is not None and self.volume_delivered + plan.stroke_volume >= volume_in_ml) or \
+                    (duration is not None and predicted_end - self.start_time >= duration):
+                break
+
+            next_index = (index + 1) % len(self.plans)
+            next_plan = self.plans[next_index]
+            if not next_plan.pump.is_armed():
+                # The pump is still refilling after its previous stroke
+                next_plan.pump.wait_until_idle()
+                self._arm(next_plan)
+
+            delay = predicted_end - self._lead_time(next_plan) - self._clock.time()
+            if delay > 0:
+                self._clock.sleep(delay)
+            if self._stop_event.is_set():
+                break
+
+            next_start = self._fire(next_plan)
+            self._record_handover(plan, next_start, predicted_end)
+            (index, plan, stroke_start) = (next_index, next_plan, next_start)
+
+        self.strokes += 1
+        self.volume_delivered += plan.stroke_volume
+        self.end_time = predicted_end
+        self.controller.wait_until_pumps_idle(self.pump_names)
+        for flow_plan in self.plans:
+            if not flow_plan.pump.is_armed():
+                self._arm(flow_plan)
+        return self
+
+    def start(self, volume_in_ml=None, duration=None, prime=True):
+        """
+        Delivers the flow in a background thread, see run().
+
+        Returns:
+            concurrent.futures.Future: Completes with the flow itself once it stops, or with the exception raised.
+
+        """
+        self._stop_event.clear()
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(self.run(volume_in_ml, duration, prime))
+            except Exception as err:
+                future.set_exception(err)
+
+        thread = threading.Thread(target=run, name=self.__class__.__name__)
+        thread.daemon = True
+        thread.start()
+        self._thread_future = future
+        return future
+
+    def stop(self, wait=True):
+        """
+        Stops the flow at the end of the current stroke.
+
+        Args:
+            wait (bool): Waits for the flow started with start() to stop, default set to True.
+
+        """
+        self._stop_event.set()
+        if wait and self._thread_future is not None:
+            self._thread_future.result()
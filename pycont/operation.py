@@ -0,0 +1,363 @@
+"""
+.. module:: operation
+   :platform: Unix
+   :synopsis: A module providing handles on the pump moves running in the background.
+
+.. moduleauthor:: Jonathan Grizou <Jonathan.Grizou@gla.ac.uk>
+
+"""
+# -*- coding: utf-8 -*-
+
+import weakref
+import threading
+import concurrent.futures
+
+from ._logger import create_logger
+from .clock import DEFAULT_CLOCK, VirtualClock
+
+#: Time to wait between two polls of a busy pump
+POLLER_SLEEP_TIME = 0.1
+#: Time to wait between two polls of a pump close to the predicted end of its move
+POLLER_FAST_SLEEP_TIME = 0.01
+#: Polls start this long (in seconds) before the predicted end of a move
+POLLER_MARGIN = 0.05
+
+
+class PumpOperation(concurrent.futures.Future):
+    """
+    This class represents a move of one or more pumps running in the background. It completes when the pumps are
+    idle again, as detected by the shared PumpOperationPoller.
+
+    Being a concurrent.futures.Future, it supports result(timeout), exception(timeout) and add_done_callback(). The
+    result is True once the move is over, False if the move was refused (e.g. volume not pumpable). Hardware errors
+    reported by the pumps while polling are raised by result().
+
+    On a VirtualClock, the pumps are polled by result() and exception() themselves, in the calling thread (see
+    PumpOperationPoller).
+
+    Args:
+        pumps (list): The pumps (C3000Controller) running the operation.
+
+        poller (PumpOperationPoller): The poller completing the operation, default set to None.
+
+    """
+    def __init__(self, pumps=(), poller=None):
+        super(PumpOperation, self).__init__()
+        self.pumps = list(pumps)
+        self._poller = poller
+        self._children = []
+
+    @classmethod
+    def completed(cls, result, pumps=()):
+        """
+        Creates an operation which is already over.
+
+        Args:
+            result: The result of the operation.
+
+            pumps (list): The pumps of the operation.
+
+        Returns:
+            PumpOperation: The completed operation.
+
+        """
+        operation = cls(pumps)
+        operation.set_result(result)
+        return operation
+
+    def cancel(self):
+        """
+        Terminates the move of the pumps and cancels the operation.
+
+        Returns:
+            True (bool): The operation was cancelled.
+
+            False (bool): The operation was already over.
+
+        """
+        if self.done():
+            return False
+        if self._children:
+            for child in self._children:
+                child.cancel()
+        else:
+            for pump in self.pumps:
+                pump.terminate()
+        return self._cancel_future()
+
+    def result(self, timeout=None):
+        self._drive()
+        return super(PumpOperation, self).result(timeout)
+
+    def exception(self, timeout=None):
+        self._drive()
+        return super(PumpOperation, self).exception(timeout)
+
+    def _drive(self):
+        # Polls the pumps from the calling thread when no background thread does
+        if self.done():
+            return
+        if self._poller is not None and self._poller.driven:
+            self._poller.run_until(self)
+        else:
+            for child in self._children:
+                if self.done():
+                    break
+                child._drive()
+
+    def _cancel_future(self):
+        # Cancels the operation alone, the pumps keep running
+        return super(PumpOperation, self).cancel()
+
+    def _resolve(self, result=None, exception=None):
+        try:
+            if exception is not None:
+                self.set_exception(exception)
+            else:
+                self.set_result(result)
+        except concurrent.futures.InvalidStateError:
+            pass  # Cancelled meanwhile
+
+
+def _combine(operations):
+    pumps = []
+    for operation in operations:
+        pumps.extend(pump for pump in operation.pumps if pump not in pumps)
+    pollers = set(operation._poller for operation in operations)
+    combined = PumpOperation(pumps, pollers.pop() if len(pollers) == 1 else None)
+    combined._children = list(operations)
+    return combined
+
+
+def all_of(*operations):
+    """
+    Combines operations into one completing when they are all over.
+
+    Args:
+        *operations: The PumpOperation to combine.
+
+    Returns:
+        PumpOperation: The combined operation, its result is the list of the results. It fails as soon as one of the
+            operations fails, and is cancelled as soon as one of them is cancelled, the other pumps then keep running.
+
+    """
+    combined = _combine(operations)
+    if not operations:
+        combined.set_result([])
+        return combined
+
+    lock = threading.Lock()
+    remaining = [len(operations)]
+
+    def on_done(operation):
+        if operation.cancelled():
+            combined._cancel_future()
+            return
+        if operation.exception() is not None:
+            combined._resolve(exception=operation.exception())
+            return
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            combined._resolve([op.result() for op in operations])
+
+    for operation in operations:
+        operation.add_done_callback(on_done)
+    return combined
+
+
+def any_of(*operations):
+    """
+    Combines operations into one completing when the first of them is over.
+
+    Args:
+        *operations: The PumpOperation to combine.
+
+    Returns:
+        PumpOperation: The combined operation, its result is the first operation over.
+
+    """
+    combined = _combine(operations)
+
+    def on_done(operation):
+        if operation.cancelled():
+            return
+        if operation.exception() is not None:
+            combined._resolve(exception=operation.exception())
+        else:
+            combined._resolve(operation)
+
+    for operation in operations:
+        operation.add_done_callback(on_done)
+    return combined
+
+
+def next_poll_time(pump, now, busy=False):
+    """
+    Gets when a pump should next be polled, based on the predicted end of its move.
+
+    Args:
+        pump (C3000Controller): The pump.
+
+        now (float): The current time, on the clock of the pump.
+
+        busy (bool): The pump was just found busy, default set to False.
+
+    Returns:
+        next_poll (float): The time of the next poll, on the clock of the pump.
+
+    """
+    completion_time = pump.estimated_completion_time()
+    if completion_time is not None and now < completion_time - POLLER_MARGIN:
+        return completion_time - POLLER_MARGIN
+    elif not busy:
+        return now
+    elif completion_time is not None and now < completion_time + POLLER_MARGIN:
+        return now + POLLER_FAST_SLEEP_TIME
+    else:
+        return now + POLLER_SLEEP_TIME
+
+
+class PumpOperationPoller(object):
+    """
+    This class polls, in a single background thread, the pumps having an operation pending and completes the
+    operations when their pump is idle.
+
+    Pumps are polled around the predicted end of their move (see C3000Controller.estimated_completion_time()), or
+    every POLLER_SLEEP_TIME when it is unknown. The thread stops when no operation is pending.
+
+    On a VirtualClock, no thread is started: the poller is driven by the thread waiting on an operation (see
+    run_until()), so the simulated time only moves forward from a single thread of control.
+
+    Args:
+        clock (SystemClock or VirtualClock): The clock of the pumps, default set to DEFAULT_CLOCK (the real time).
+
+    """
+    def __init__(self, clock=None):
+        self.logger = create_logger(self.__class__.__name__)
+
+        self.clock = clock if clock is not None else DEFAULT_CLOCK
+
+        self.driven = isinstance(self.clock, VirtualClock)
+
+        self._condition = threading.Condition()
+        self._watched = {}
+        self._next_poll = {}
+        self._thread = None
+
+    def watch(self, pump):
+        """
+        Creates an operation completing when the pump is idle.
+
+        Args:
+            pump (C3000Controller): The pump to watch.
+
+        Returns:
+            PumpOperation: The operation.
+
+        """
+        operation = PumpOperation([pump], self)
+        with self._condition:
+            self._watched.setdefault(pump, []).append(operation)
+            self._next_poll[pump] = next_poll_time(pump, self.clock.time())
+            if self._thread is None and not self.driven:
+                self._thread = threading.Thread(target=self._run, name=self.__class__.__name__)
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+        return operation
+
+    def run_until(self, operation):
+        """
+        Polls the pumps in the calling thread until the operation is over, for a poller on a VirtualClock.
+
+        Args:
+            operation (PumpOperation): The operation to wait for.
+
+        """
+        while not operation.done():
+            with self._condition:
+                self._forget_done()
+                if not self._watched:
+                    return
+                due = self._due_pumps()
+                if not due:
+                    self.clock.sleep(min(self._next_poll.values()) - self.clock.time())
+                    continue
+            self._poll(due)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._forget_done()
+                if not self._watched:
+                    self._thread = None
+                    return
+                due = self._due_pumps()
+                if not due:
+                    self.clock.wait(self._condition, min(self._next_poll.values()) - self.clock.time())
+                    continue
+            self._poll(due)
+
+    def _forget_done(self):
+        # Must be called with the condition acquired
+        for pump, operations in list(self._watched.items()):
+            operations[:] = [operation for operation in operations if not operation.done()]
+            if not operations:
+                del self._watched[pump]
+                del self._next_poll[pump]
+
+    def _due_pumps(self):
+        # Must be called with the condition acquired
+        now = self.clock.time()
+        return [pump for pump, next_poll in self._next_poll.items() if next_poll <= now]
+
+    def _poll(self, due):
+        for pump in due:
+            try:
+                idle = pump.is_idle()
+            except Exception as err:
+                self.logger.debug("Polling pump %s failed: %s", pump.name, err)
+                self._complete(pump, exception=err)
+                continue
+            if idle:
+                self._complete(pump, result=True)
+            else:
+                with self._condition:
+                    if pump in self._next_poll:
+                        self._next_poll[pump] = next_poll_time(pump, self.clock.time(), busy=True)
+
+    def _complete(self, pump, result=None, exception=None):
+        with self._condition:
+            operations = self._watched.pop(pump, [])
+            self._next_poll.pop(pump, None)
+        for operation in operations:
+            operation._resolve(result, exception)
+
+
+#: The poller shared by all the pumps of the process
+default_poller = PumpOperationPoller()
+
+_pollers = weakref.WeakKeyDictionary()
+_pollers_lock = threading.Lock()
+
+
+def get_poller(clock=None):
+    """
+    Gets the poller shared by the pumps on a clock, so the operations of pumps on the same VirtualClock can be waited
+    for together.
+
+    Args:
+        clock (SystemClock or VirtualClock): The clock, default set to DEFAULT_CLOCK.
+
+    Returns:
+        PumpOperationPoller: The poller of the clock, default_poller for DEFAULT_CLOCK.
+
+    """
+    if clock is None or clock is DEFAULT_CLOCK:
+        return default_poller
+    with _pollers_lock:
+        if clock not in _pollers:
+            _pollers[clock] = PumpOperationPoller(clock)
+        return _pollers[clock]
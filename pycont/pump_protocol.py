@@ -7,6 +7,8 @@
 
 """
 # -*- coding: utf-8 -*-
+import math
+
 from ._logger import create_logger
 
 from . import dtprotocol
@@ -36,6 +38,16 @@ CMD_EEPROM_CONFIG = 'U'      # Requires power restart to take effect
 CMD_EEPROM_LOWLEVEL_CONFIG = 'u'      # Requires power restart to take effect
 #: Command to terminate current operation
 CMD_TERMINATE = 'T'
+#: Command marking the start of a loop
+CMD_LOOP_START = 'g'
+#: Command repeating the commands since the matching loop start, G0 repeats them until terminated
+CMD_LOOP_END = 'G'
+#: Command to wait for a delay, in milliseconds
+CMD_DELAY = 'M'
+#: Command to store the commands following it in EEPROM, as a program run with CMD_RUN_PROGRAM
+CMD_STORE_PROGRAM = 's'
+#: Command to run a program stored in EEPROM
+CMD_RUN_PROGRAM = 'e'
 
 #: Command for the valve init_all_pump_parameters
 #: .. note:: Depending on EEPROM settings (U4 or U11) 4-way distribution valves either use IOBE or I<n>O<n>
@@ -112,6 +124,121 @@ ERROR_STATUSES_BUSY = (STATUS_BUSY_INIT_FAILURE, STATUS_BUSY_INVALID_COMMAND, ST
                        STATUS_BUSY_EEPROM_FAILURE, STATUS_BUSY_NOT_INITIALIZED, STATUS_BUSY_PLUNGER_OVERLOAD,
                        STATUS_BUSY_VALVE_OVERLOAD, STATUS_BUSY_PLUNGER_STUCK)
 
+# MOTION
+#: Factor applied to positions, velocities and accelerations in microstep mode 2 (N2)
+MICRO_STEP_MODE_2_FACTOR = 8
+#: Default start velocity, in half-steps/s (microstep mode 0)
+DEFAULT_START_VELOCITY = 900
+#: Default cutoff velocity, in half-steps/s (microstep mode 0)
+DEFAULT_CUTOFF_VELOCITY = 900
+#: Default slope code, the acceleration is the slope code times SLOPE_ACCELERATION
+DEFAULT_SLOPE = 14
+#: Acceleration for one unit of slope code, in half-steps/s^2 (microstep mode 0)
+SLOPE_ACCELERATION = 2500
+#: Approximate time taken by the valve to rotate to a new position, in seconds
+VALVE_MOVE_DURATION = 0.3
+
+# PROGRAMS
+#: Largest number of repeats of a loop (CMD_LOOP_END operand)
+MAX_LOOP_REPEAT = 30000
+#: Largest number of nested loops
+MAX_LOOP_DEPTH = 10
+#: Longest delay of a single CMD_DELAY, in milliseconds
+MAX_DELAY = 30000
+#: Number of program slots in EEPROM, numbered from 0
+PROGRAM_SLOTS = 15
+
+
+def estimate_move_duration(steps, top_velocity, start_velocity=DEFAULT_START_VELOCITY,
+                           cutoff_velocity=DEFAULT_CUTOFF_VELOCITY, slope=DEFAULT_SLOPE, micro_step_mode=0):
+    """
+    Estimates the time taken by a plunger move, following the velocity profile of the C-series: the plunger starts at
+    the start velocity, accelerates up to the top velocity, and decelerates down to the cutoff velocity where it stops.
+
+    Args:
+        steps (int): Length of the move, in steps of the current microstep mode.
+
+        top_velocity (int): Top velocity, as set with CMD_TOPVELOCITY.
+
+        start_velocity (int): Start velocity in microstep mode 0 units, default set to DEFAULT_START_VELOCITY (900).
+
+        cutoff_velocity (int): Cutoff velocity in microstep mode 0 units, default set to DEFAULT_CUTOFF_VELOCITY (900).
+
+        slope (int): Slope code, default set to DEFAULT_SLOPE (14).
+
+        micro_step_mode (int): The microstep mode (0 or 2), default set to 0.
+
+    Returns:
+        duration (float): The estimated duration of the move, in seconds.
+
+    """
+    factor = MICRO_STEP_MODE_2_FACTOR if micro_step_mode == 2 else 1
+    # One step is two half-steps, in microstep mode 2 velocities are given in the same scaled unit as the steps
+    distance = 2.0 * abs(steps)
+    if distance == 0:
+        return 0.0
+    top_velocity = float(top_velocity)
+    start_velocity = min(start_velocity * factor, top_velocity)
+    cutoff_velocity = min(cutoff_velocity * factor, top_velocity)
+    acceleration = float(slope * SLOPE_ACCELERATION * factor)
+
+    ramp_up = (top_velocity ** 2 - start_velocity ** 2) / (2 * acceleration)
+    ramp_down = (top_velocity ** 2 - cutoff_velocity ** 2) / (2 * acceleration)
+    if ramp_up + ramp_down <= distance:
+        return ((top_velocity - start_velocity) / acceleration + (top_velocity - cutoff_velocity) / acceleration +
+                (distance - ramp_up - ramp_down) / top_velocity)
+
+    # The top velocity is never reached, the profile is triangular
+    peak_velocity = math.sqrt((2 * acceleration * distance + start_velocity ** 2 + cutoff_velocity ** 2) / 2)
+    if peak_velocity <= max(start_velocity, cutoff_velocity):
+        return distance / max(start_velocity, cutoff_velocity)
+    return (peak_velocity - start_velocity) / acceleration + (peak_velocity - cutoff_velocity) / acceleration
+
+
+def is_report_frame(frame):
+    """
+    Determines if an encoded packet only queries the pump (Q and ? commands) and does not change its state.
+
+    Args:
+        frame (bytes): The encoded packet, e.g. b'/1?6R\\r'.
+
+    Returns:
+        True (bool): The packet is a report query.
+
+        False (bool): The packet is a command.
+
+    """
+    return frame[2:3] in (CMD_REPORT_STATUS.encode(), CMD_REPORT_PLUNGER_POSITION.encode())
+
+
+def is_reply_to(frame, response):
+    """
+    Determines if a response frame can be the reply to an encoded packet.
+
+    The replies do not tell which pump sent them, they are told apart by their content: they come from the master
+    address ('0') with a valid status byte, and only the ? queries get data back (unless refused with an error).
+
+    Args:
+        frame (bytes): The encoded packet, e.g. b'/1?6R\\r'.
+
+        response (bytes): The response frame, e.g. b'/0`i\\x03'.
+
+    Returns:
+        True (bool): The response can answer the packet.
+
+        False (bool): The response belongs to another packet, or is corrupted.
+
+    """
+    if len(response) < 4 or response[1:2] != dtprotocol.DTMasterAddress.encode():
+        return False
+    status = response[2]
+    if not 0x40 <= status <= 0x7f:
+        return False
+    has_data = len(response) > 4
+    if frame[2:3] == CMD_REPORT_PLUNGER_POSITION.encode():
+        return has_data or status & 0x0f != 0
+    return not has_data
+
 
 class C3000Protocol(object):
     """
@@ -126,6 +253,10 @@ class C3000Protocol(object):
 
         self.address = address
 
+        # Frames never change for a given address and command, they are forged once and reused (see forge_frame)
+        self._frame_cache = {}
+        self._template_cache = {}
+
     def forge_packet(self, dtcommands: dtprotocol.DTCommand, execute=True) -> dtprotocol.DTInstructionPacket:
         """
         Creates a packet which will be sent to the device.
@@ -146,6 +277,51 @@ class C3000Protocol(object):
             dtcommands.append(dtprotocol.DTCommand(CMD_EXECUTE))
         return dtprotocol.DTInstructionPacket(self.address, dtcommands)
 
+    def forge_frame(self, command, execute=True):
+        """
+        Returns the frame of a command without operand, forging it only the first time it is requested.
+
+        Args:
+            command (str): The command, e.g. CMD_REPORT_STATUS.
+
+            execute (bool): Sets the execute value, True by default.
+
+        Returns:
+            DTFrame: The cached frame, ready to be written on the serial port.
+
+        """
+        key = (command, execute)
+        try:
+            return self._frame_cache[key]
+        except KeyError:
+            frame = self.forge_packet(dtprotocol.DTCommand(command), execute=execute).to_frame()
+            self._frame_cache[key] = frame
+            return frame
+
+    def forge_operand_frame(self, command, operand_value, execute=True):
+        """
+        Fills the cached frame template of a command taking an integer operand.
+
+        Args:
+            command (str): The command, e.g. CMD_PUMP.
+
+            operand_value (int): The value of the supplied operand.
+
+            execute (bool): Sets the execute value, True by default.
+
+        Returns:
+            DTFrame: The frame, ready to be written on the serial port.
+
+        """
+        key = (command, execute)
+        try:
+            template = self._template_cache[key]
+        except KeyError:
+            # The template is a regular frame with a '%d' placeholder in place of the operand, e.g. b'/1P%dR\r'
+            template = self.forge_packet(dtprotocol.DTCommand(command, '%d'), execute=execute).to_string()
+            self._template_cache[key] = template
+        return dtprotocol.DTFrame(template % int(operand_value))
+
     # handling answers
     def decode_packet(self, dtresponse):
         """
@@ -250,11 +426,10 @@ class C3000Protocol(object):
             operand_value (int): The value of the supplied operand.
 
         Returns:
-            DTInstructionPacket: The packet created for moving the device to a location.
+            DTFrame: The packet created for moving the device to a location.
 
         """
-        dtcommand = dtprotocol.DTCommand(CMD_MOVE_TO, str(operand_value))
-        return self.forge_packet(dtcommand)
+        return self.forge_operand_frame(CMD_MOVE_TO, operand_value)
 
     def forge_pump_packet(self, operand_value):
         """
@@ -264,11 +439,10 @@ class C3000Protocol(object):
             operand_value (int): The value of the supplied operand
 
         Returns:
-            DTInstructionPacket: The packet created for the pump action of the device.
+            DTFrame: The packet created for the pump action of the device.
 
         """
-        dtcommand = dtprotocol.DTCommand(CMD_PUMP, str(operand_value))
-        return self.forge_packet(dtcommand)
+        return self.forge_operand_frame(CMD_PUMP, operand_value)
 
     def forge_deliver_packet(self, operand_value):
         """
@@ -278,11 +452,10 @@ class C3000Protocol(object):
             operand_value (int): The value of the supplied operand.
 
         Returns:
-            DTInstructionPacket: The packet created for delivering the payload.
+            DTFrame: The packet created for delivering the payload.
 
         """
-        dtcommand = dtprotocol.DTCommand(CMD_DELIVER, str(operand_value))
-        return self.forge_packet(dtcommand)
+        return self.forge_operand_frame(CMD_DELIVER, operand_value)
 
     def forge_top_velocity_packet(self, operand_value):
         """
@@ -292,11 +465,10 @@ class C3000Protocol(object):
             operand_value (int): The value of the supplied operand.
 
         Returns:
-            DTInstructionPacket: The packet created for the top velocity of the device.
+            DTFrame: The packet created for the top velocity of the device.
 
         """
-        dtcommand = dtprotocol.DTCommand(CMD_TOPVELOCITY, str(int(operand_value)))
-        return self.forge_packet(dtcommand)
+        return self.forge_operand_frame(CMD_TOPVELOCITY, operand_value)
 
     def forge_eeprom_config_packet(self, operand_value):
         """
@@ -333,120 +505,120 @@ class C3000Protocol(object):
         Creates a packet for the input into a valve on the device.
 
         Returns:
-            DTInstructionPacket: The packet created for the input into a valve on the device.
+            DTFrame: The packet created for the input into a valve on the device.
 
         """
-        return self.forge_packet(dtprotocol.DTCommand(CMD_VALVE_INPUT))
+        return self.forge_frame(CMD_VALVE_INPUT)
 
     def forge_valve_output_packet(self):
         """
         Creates a packet for the output from a valve on the device.
 
         Returns:
-            DTInstructionPacket: The packet created for the output from a valve on the device.
+            DTFrame: The packet created for the output from a valve on the device.
 
         """
-        return self.forge_packet(dtprotocol.DTCommand(CMD_VALVE_OUTPUT))
+        return self.forge_frame(CMD_VALVE_OUTPUT)
 
     def forge_valve_bypass_packet(self):
         """
         Creates a packet for bypassing a valve on the device.
 
         Returns:
-            DTInstructionPacket: The packet created for bypassing a valve on the device.
+            DTFrame: The packet created for bypassing a valve on the device.
 
         """
-        return self.forge_packet(dtprotocol.DTCommand(CMD_VALVE_BYPASS))
+        return self.forge_frame(CMD_VALVE_BYPASS)
 
     def forge_valve_extra_packet(self):
         """
         Creates a packet for an extra valve.
 
         Returns:
-            DTInstructionPacket: The packet created for an extra valve.
+            DTFrame: The packet created for an extra valve.
 
         """
-        return self.forge_packet(dtprotocol.DTCommand(CMD_VALVE_EXTRA))
+        return self.forge_frame(CMD_VALVE_EXTRA)
 
     def forge_valve_6way_packet(self, valve_position):
         """
         Creates a packet for the 6way valve on the device.
 
         Returns:
-            DTInstructionPacket: The packet created for the input into a valve on the device.
+            DTFrame: The packet created for the input into a valve on the device.
 
         """
-        return self.forge_packet(dtprotocol.DTCommand('{}{}'.format(CMD_VALVE_INPUT, valve_position)))
+        return self.forge_frame('{}{}'.format(CMD_VALVE_INPUT, valve_position))
 
     def forge_report_status_packet(self):
         """
         Creates a packet for reporting the device status.
 
         Returns:
-            DTInstructionPacket: The packet created for reporting the device status.
+            DTFrame: The packet created for reporting the device status.
 
         """
-        return self.forge_packet(dtprotocol.DTCommand(CMD_REPORT_STATUS))
+        return self.forge_frame(CMD_REPORT_STATUS)
 
     def forge_report_plunger_position_packet(self):
         """
         Creates a packet for reporting the device's plunger position.
 
         Returns:
-            DTInstructionPacket: The packet created for reporting the device's plunger position.
+            DTFrame: The packet created for reporting the device's plunger position.
 
         """
-        return self.forge_packet(dtprotocol.DTCommand(CMD_REPORT_PLUNGER_POSITION))
+        return self.forge_frame(CMD_REPORT_PLUNGER_POSITION)
 
     def forge_report_start_velocity_packet(self):
         """
         Creates a packet for reporting the device's start velocity.
 
         Returns:
-            DTInstructionPacket: The packet created for reporting the device's starting velocity.
+            DTFrame: The packet created for reporting the device's starting velocity.
 
         """
-        return self.forge_packet(dtprotocol.DTCommand(CMD_REPORT_START_VELOCITY))
+        return self.forge_frame(CMD_REPORT_START_VELOCITY)
 
     def forge_report_peak_velocity_packet(self):
         """
         Creates a packet for reporting the device's peak velocity.
 
         Returns:
-            DTInstructionPacket: The packet created for reporting the device's peak velocity.
+            DTFrame: The packet created for reporting the device's peak velocity.
 
         """
-        return self.forge_packet(dtprotocol.DTCommand(CMD_REPORT_PEAK_VELOCITY))
+        return self.forge_frame(CMD_REPORT_PEAK_VELOCITY)
 
     def forge_report_cutoff_velocity_packet(self):
         """
         Creates a packet for reporting the device's cutoff velocity.
 
         Returns:
-            DTInstructionPacket: The packet created for reporting the device's cutoff velocity.
+            DTFrame: The packet created for reporting the device's cutoff velocity.
 
         """
-        return self.forge_packet(dtprotocol.DTCommand(CMD_REPORT_CUTOFF_VELOCITY))
+        return self.forge_frame(CMD_REPORT_CUTOFF_VELOCITY)
 
     def forge_report_valve_position_packet(self):
         """
         Creates a packet for reporting the device's valve position.
 
         Returns:
-            DTInstructionPacket: The packet created for reporting the device's valve position.
+            DTFrame: The packet created for reporting the device's valve position.
 
         """
-        return self.forge_packet(dtprotocol.DTCommand(CMD_REPORT_VALVE_POSITION))
+        return self.forge_frame(CMD_REPORT_VALVE_POSITION)
 
     def forge_report_initialized_packet(self):
         """
         Creates a packet for reporting the initialisation of the device.
 
         Returns:
-            DTInstructionPacket: The packet created for reporting the initialisation of the device.
+            DTFrame: The packet created for reporting the initialisation of the device.
 
         """
-        return self.forge_packet(dtprotocol.DTCommand(CMD_REPORT_INTIALIZED))
+        return self.forge_frame(CMD_REPORT_INTIALIZED)
 
     def forge_report_eeprom_packet(self):
         """
@@ -456,7 +628,7 @@ class C3000Protocol(object):
             The packet for reporting the EEPROM.
 
         """
-        return self.forge_packet(dtprotocol.DTCommand(CMD_REPORT_EEPROM))
+        return self.forge_frame(CMD_REPORT_EEPROM)
 
     def forge_terminate_packet(self):
         """
@@ -466,4 +638,43 @@ class C3000Protocol(object):
             The packet for terminating any running command.
 
         """
-        return self.forge_packet(dtprotocol.DTCommand(CMD_TERMINATE))
+        return self.forge_frame(CMD_TERMINATE)
+
+    def forge_store_program_packet(self, slot, dtcommands):
+        """
+        Creates the packet storing commands in EEPROM as a program, without running them.
+
+        Args:
+            slot (int): The program slot, in [0, PROGRAM_SLOTS - 1].
+
+            dtcommands (list): List of DTCommand of the program.
+
+        Returns:
+            DTInstructionPacket: The packet storing the program.
+
+        """
+        dtcommand = dtprotocol.DTCommand(CMD_STORE_PROGRAM, str(int(slot)))
+        return self.forge_packet([dtcommand] + list(dtcommands))
+
+    def forge_run_program_packet(self, slot):
+        """
+        Creates the packet running a program stored in EEPROM.
+
+        Args:
+            slot (int): The program slot.
+
+        Returns:
+            DTFrame: The packet running the program.
+
+        """
+        return self.forge_operand_frame(CMD_RUN_PROGRAM, slot)
+
+    def forge_execute_packet(self):
+        """
+        Creates the data packet executing the commands previously loaded without execute flag.
+
+        Returns:
+            DTFrame: The packet for executing the loaded commands.
+
+        """
+        return self.forge_frame(CMD_EXECUTE, execute=False)
@@ -0,0 +1,496 @@
+"""
+.. module:: reactor
+   :platform: Unix
+   :synopsis: A module driving the I/O of all the hubs from a single thread.
+
+.. moduleauthor:: Jonathan Grizou <Jonathan.Grizou@gla.ac.uk>
+
+The PumpReactor registers the file descriptor of every hub with a selector (epoll on Linux) and multiplexes their
+transactions in one thread, one transaction in flight per hub, with timers for the timeouts and for polling the busy
+pumps. It is used as the backend of a MultiPumpController::
+
+    reactor = PumpReactor()
+    controller = MultiPumpController.from_configfile('pump_setup_config.json', reactor=reactor)
+
+No thread waits on a serial port: the callers wait for their transaction to complete, and the hubs are served in
+the order they were added, so the schedule across hubs does not depend on the thread scheduler.
+
+"""
+# -*- coding: utf-8 -*-
+
+import time
+import heapq
+import socket
+import itertools
+import selectors
+import threading
+import collections
+import concurrent.futures
+
+from ._logger import create_logger
+
+from . import pump_protocol
+from .controller import PumpIOTimeOutError, ControllerRepeatedError, PumpHWError, MAX_REPEAT_WRITE_AND_READ
+from .operation import PumpOperation, next_poll_time
+
+#: Time (in seconds) before trying again to start a transaction on a hub locked by another user of its PumpIO
+REACTOR_LOCK_RETRY_TIME = 0.001
+
+
+class _Transaction(object):
+
+    def __init__(self, packet, timeout, reply):
+        self.packet = packet
+        self.frame = packet.to_string()
+        self.timeout = timeout
+        self.reply = reply
+        self.future = concurrent.futures.Future()
+
+
+class _Hub(object):
+
+    def __init__(self, pump_io):
+        self.io = pump_io
+        self.queue = collections.deque()
+        self.current = None
+        self.deadline = None
+        self.candidate = None
+        self.settle_until = None
+        self.retry_at = None
+        self.fd = None
+
+
+class ReactorIO(object):
+    """
+    This class is the I/O of a hub driven by a PumpReactor, it can be given to a C3000Controller in place of a
+    PumpIO. Its methods block the calling thread until the reactor completes the transaction.
+
+    Args:
+        reactor (PumpReactor): The reactor.
+
+        pump_io (PumpIO): The I/O of the hub.
+
+    """
+    def __init__(self, reactor, pump_io):
+        self._reactor = reactor
+        self._io = pump_io
+        self._hub = _Hub(pump_io)
+
+    @property
+    def port(self):
+        """
+        The port of the underlying PumpIO.
+        """
+        return self._io.port
+
+    @property
+    def timeout(self):
+        """
+        The timeout of the underlying PumpIO.
+        """
+        return self._io.timeout
+
+    def submit(self, packet, timeout=None, reply=True):
+        """
+        Queues a packet to be written by the reactor, see PumpReactor.submit()
+        """
+        return self._reactor.submit(self, packet, timeout, reply)
+
+    def write_and_readline(self, packet, timeout=None):
+        """
+        Writes a packet and waits for a response, see PumpIO.write_and_readline()
+
+        Args:
+            packet (DTInstructionPacket): The packet to be written.
+
+            timeout (float): The time to wait for the response, default set to None for the timeout of the PumpIO.
+
+        Returns:
+            response (str): The received response.
+
+        Raises:
+            PumpIOTimeOutError: If the response time is greater than the timeout threshold.
+
+        """
+        return self._reactor.wait(self.submit(packet, timeout))
+
+    def write_without_reply(self, packet):
+        """
+        Writes a packet which gets no response, see PumpIO.write_without_reply()
+
+        Args:
+            packet (DTInstructionPacket): The packet to be written.
+
+        """
+        self._reactor.wait(self.submit(packet, reply=False))
+
+    def release(self):
+        """
+        Removes the hub from the reactor and releases the underlying PumpIO, see PumpIO.release()
+        """
+        self._reactor.wait(self._reactor.remove_hub(self))
+        self._io.release()
+
+
+class PumpReactor(object):
+    """
+    This class drives the I/O of several hubs, and polls their busy pumps, from a single thread.
+
+    Each hub has a queue of transactions, sent one at a time. A transaction is written when the previous one is
+    answered or timed out, and after a timeout the late reply is waited for during the late_reply_window of the
+    PumpIO, as PumpIO.write_and_readline() does. The reactor also replaces the PumpOperationPoller of its pumps: the
+    status queries of the pumps having an operation pending are timers of the reactor.
+
+    Only PumpIO whose transport has a file descriptor (serial ports, TCP) can be driven.
+
+    """
+    def __init__(self):
+        self.logger = create_logger(self.__class__.__name__)
+
+        self._selector = selectors.DefaultSelector()
+        (self._wakeup_reader, self._wakeup_writer) = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+
+        self._lock = threading.Lock()
+        self._callbacks = collections.deque()
+        self._timers = []
+        self._counter = itertools.count()
+        self._hubs = []
+        self._watched = {}
+        self._running = True
+
+        self._thread = threading.Thread(target=self._run, name=self.__class__.__name__)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_hub(self, pump_io):
+        """
+        Adds a hub to the reactor.
+
+        Args:
+            pump_io (PumpIO): The I/O of the hub, it should not be used directly anymore.
+
+        Returns:
+            ReactorIO: The I/O to give to the pumps of the hub.
+
+        """
+        reactor_io = ReactorIO(self, pump_io)
+        self.wait(self._call_in_loop(self._hubs.append, reactor_io._hub))
+        return reactor_io
+
+    def remove_hub(self, reactor_io):
+        """
+        Removes a hub from the reactor, once the transactions queued are sent.
+
+        Args:
+            reactor_io (ReactorIO): The I/O returned by add_hub().
+
+        Returns:
+            future (concurrent.futures.Future): Resolves once the hub is removed.
+
+        """
+        removed = concurrent.futures.Future()
+
+        def remove(hub):
+            if hub.queue or hub.current is not None:
+                self.call_later(REACTOR_LOCK_RETRY_TIME, remove, hub)
+                return
+            self._unregister(hub)
+            self._hubs.remove(hub)
+            removed.set_result(None)
+
+        if self._running:
+            self.call_soon(remove, reactor_io._hub)
+        else:
+            removed.set_result(None)
+        return removed
+
+    def close(self):
+        """
+        Stops the reactor thread, the transactions still queued are cancelled.
+        """
+        if self._running:
+            self._running = False
+            self._wakeup()
+            self._thread.join()
+            for hub in self._hubs:
+                for transaction in hub.queue:
+                    transaction.future.cancel()
+            self._selector.close()
+            self._wakeup_reader.close()
+            self._wakeup_writer.close()
+
+    def wait(self, future):
+        """
+        Waits for a future completed by the reactor.
+
+        Raises:
+            RuntimeError: Called from the reactor thread, which would never complete it.
+
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError('The reactor thread cannot wait for a transaction')
+        return future.result()
+
+    def call_soon(self, callback, *args):
+        """
+        Runs a function in the reactor thread, as soon as possible.
+        """
+        with self._lock:
+            self._callbacks.append((callback, args))
+        self._wakeup()
+
+    def call_later(self, delay, callback, *args):
+        """
+        Runs a function in the reactor thread, after delay seconds.
+        """
+        self.call_at(time.monotonic() + delay, callback, *args)
+
+    def call_at(self, when, callback, *args):
+        """
+        Runs a function in the reactor thread, at a time of time.monotonic().
+        """
+        if threading.current_thread() is self._thread:
+            heapq.heappush(self._timers, (when, next(self._counter), callback, args))
+        else:
+            self.call_soon(self.call_at, when, callback, *args)
+
+    def _call_in_loop(self, func, *args):
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(func(*args))
+            except Exception as err:
+                future.set_exception(err)
+        self.call_soon(run)
+        return future
+
+    def submit(self, reactor_io, packet, timeout=None, reply=True):
+        """
+        Queues a packet to be written on a hub.
+
+        Args:
+            reactor_io (ReactorIO): The I/O of the hub.
+
+            packet (DTInstructionPacket): The packet to be written.
+
+            timeout (float): The time to wait for the response, default set to None for the timeout of the PumpIO.
+
+            reply (bool): The packet gets a response, default set to True. False for broadcast and group addresses.
+
+        Returns:
+            future (concurrent.futures.Future): Resolves to the received response (None without reply), or raises
+                PumpIOTimeOutError.
+
+        """
+        hub = reactor_io._hub
+        transaction = _Transaction(packet, hub.io.timeout if timeout is None else timeout, reply)
+        if threading.current_thread() is self._thread:
+            hub.queue.append(transaction)
+        else:
+            self.call_soon(hub.queue.append, transaction)
+        return transaction.future
+
+    def watch(self, pump):
+        """
+        Creates an operation completing when the pump is idle, see PumpOperationPoller.watch(). The pump is polled
+        around the predicted end of its move.
+
+        Args:
+            pump (C3000Controller): The pump, its I/O must be a ReactorIO of this reactor.
+
+        Returns:
+            PumpOperation: The operation.
+
+        """
+        operation = PumpOperation([pump])
+        self.call_soon(self._watch, pump, operation)
+        return operation
+
+    def _watch(self, pump, operation):
+        operations = self._watched.get(pump)
+        if operations is not None:
+            operations.append(operation)
+            return
+        self._watched[pump] = [operation]
+        self.call_at(next_poll_time(pump, time.monotonic()), self._poll, pump, 0)
+
+    def _poll(self, pump, failures):
+        operations = [operation for operation in self._watched.get(pump, []) if not operation.done()]
+        if not operations:
+            self._watched.pop(pump, None)
+            return
+        self._watched[pump] = operations
+        packet = pump._protocol.forge_report_status_packet()
+        future = self.submit(pump._io, packet, timeout=pump.retry_policy.timeout())
+        future.add_done_callback(lambda future: self._on_status(pump, future, failures))
+
+    def _on_status(self, pump, future, failures):
+        error = None
+        try:
+            (_, status, _) = pump._protocol.decode_packet(future.result())
+        except (PumpIOTimeOutError, TypeError):
+            failures += 1
+            if failures < MAX_REPEAT_WRITE_AND_READ:
+                self.call_later(pump.retry_policy.backoff(failures), self._poll, pump, failures)
+                return
+            error = ControllerRepeatedError('Repeated Error from pump {}'.format(pump.name))
+        else:
+            if status == pump_protocol.STATUS_BUSY_ERROR_FREE:
+                self.call_at(next_poll_time(pump, time.monotonic(), busy=True), self._poll, pump, 0)
+                return
+            if status != pump_protocol.STATUS_IDLE_ERROR_FREE:
+                pump.shadow.invalidate()
+                error = PumpHWError(error_code=status, pump=pump.name)
+        for operation in self._watched.pop(pump, []):
+            operation._resolve(True, error)
+
+    def _wakeup(self):
+        try:
+            self._wakeup_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # Already woken up
+
+    def _register(self, hub):
+        try:
+            fd = hub.io._transport.fileno()
+        except (AttributeError, OSError, ValueError):
+            fd = None
+        if fd != hub.fd:
+            self._unregister(hub)
+            if fd is not None:
+                self._selector.register(fd, selectors.EVENT_READ, hub)
+                hub.fd = fd
+
+    def _unregister(self, hub):
+        if hub.fd is not None:
+            try:
+                self._selector.unregister(hub.fd)
+            except (KeyError, ValueError):
+                pass
+            hub.fd = None
+
+    def _run(self):
+        while self._running:
+            for (key, _) in self._selector.select(self._next_timeout()):
+                if key.data is None:
+                    try:
+                        while self._wakeup_reader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self._on_readable(key.data)
+
+            with self._lock:
+                callbacks, self._callbacks = self._callbacks, collections.deque()
+            for (callback, args) in callbacks:
+                self._run_callback(callback, args)
+
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                (_, _, callback, args) = heapq.heappop(self._timers)
+                self._run_callback(callback, args)
+
+            for hub in self._hubs:
+                self._advance(hub)
+
+    def _run_callback(self, callback, args):
+        try:
+            callback(*args)
+        except Exception:
+            self.logger.exception("Reactor callback %s failed", callback)
+
+    def _next_timeout(self):
+        if self._callbacks:
+            return 0
+        deadlines = [self._timers[0][0]] if self._timers else []
+        for hub in self._hubs:
+            if hub.current is not None:
+                deadlines.append(hub.deadline)
+            elif hub.queue:
+                deadlines.append(hub.retry_at or hub.settle_until or 0)
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
+
+    def _on_readable(self, hub):
+        io = hub.io
+        io._parser.feed(io._read_pending())
+        self._register(hub)  # The connection of a TCP transport may have been lost
+        frame = io._parser.next_frame()
+        while frame is not None:
+            current = hub.current
+            if current is not None:
+                (reply, hub.candidate) = io._sort_response(current.frame, frame, hub.candidate)
+                if reply is not None:
+                    io.logger.debug("Received %s", reply)
+                    self._finish(hub, result=reply)
+            else:
+                io._discard_frame(frame)
+            frame = io._parser.next_frame()
+
+    def _finish(self, hub, result=None, exception=None):
+        transaction, hub.current = hub.current, None
+        hub.candidate = None
+        hub.io.lock.release()
+        if exception is not None:
+            transaction.future.set_exception(exception)
+        else:
+            transaction.future.set_result(result)
+
+    def _advance(self, hub):
+        io = hub.io
+        now = time.monotonic()
+        if hub.current is not None:
+            if now < hub.deadline:
+                return
+            elif hub.candidate is not None:
+                io.logger.debug("Received %s", hub.candidate)
+                self._finish(hub, result=io._take_candidate(hub.current.frame, hub.candidate))
+            else:
+                io.logger.debug("Readline timeout!")
+                # The reply may still come, it must not be taken for the reply of the next transaction
+                io._owe_reply(hub.current.frame)
+                hub.settle_until = now + io.late_reply_window
+                self._finish(hub, exception=PumpIOTimeOutError())
+
+        while hub.queue:
+            if hub.settle_until is not None:
+                if io._owed_replies and now < hub.settle_until:
+                    return
+                hub.settle_until = None
+            if hub.retry_at is not None and now < hub.retry_at:
+                return
+            if not io.lock.acquire(blocking=False):
+                hub.retry_at = now + REACTOR_LOCK_RETRY_TIME
+                return
+            hub.retry_at = None
+
+            transaction = hub.queue.popleft()
+            if not transaction.future.set_running_or_notify_cancel():
+                io.lock.release()
+                continue
+            hub.current = transaction
+            try:
+                io._discard_received_frames()
+                io.write(transaction.packet)
+            except Exception as err:
+                self._finish(hub, exception=err)
+                continue
+            finally:
+                self._register(hub)
+
+            if transaction.reply:
+                hub.deadline = now + transaction.timeout
+                return
+            self._finish(hub)
@@ -0,0 +1,288 @@
+"""
+.. module:: retry
+   :platform: Unix
+   :synopsis: A module deciding how long to wait for the pumps and when to give up on them.
+
+.. moduleauthor:: Jonathan Grizou <Jonathan.Grizou@gla.ac.uk>
+
+"""
+# -*- coding: utf-8 -*-
+
+import threading
+import contextlib
+import collections
+
+from .clock import DEFAULT_CLOCK
+
+#: Shortest timeout waited for a response
+RETRY_MIN_TIMEOUT = 0.1
+#: Longest timeout waited for a response, used until latencies are observed
+RETRY_MAX_TIMEOUT = 1
+#: Number of latencies kept to compute the percentiles
+RETRY_LATENCY_WINDOW = 100
+#: Delay before the first retry, doubled at each following retry
+RETRY_BACKOFF_BASE = 0.01
+#: Longest delay between two retries
+RETRY_BACKOFF_MAX = 0.5
+#: Suggested number of consecutive failures after which a pump is considered unhealthy, see RetryPolicy
+RETRY_FAILURE_THRESHOLD = 3
+#: Time after which an unhealthy pump is tried again
+RETRY_RECOVERY_TIME = 10
+
+
+class PumpDeadlineError(Exception):
+    """
+    Exception for when an operation is not over by its deadline, see deadline().
+    """
+    pass
+
+
+class RetryPolicy(object):
+    """
+    This class tracks the response latency of a pump and decides how long to wait for its responses, how long to
+    wait before retrying, and when to stop talking to it.
+
+    The timeout of the report queries adapts to the observed latency, as TCP does: the smoothed latency (EWMA) plus
+    four times its mean deviation, and at least twice the 99th percentile of the recent latencies, within
+    [min_timeout, max_timeout]. The commands changing the state of the pump are waited for max_timeout.
+
+    The circuit breaker is off unless failure_threshold is given. After failure_threshold consecutive failures it
+    opens: the pump is considered unhealthy and requests fail at once instead of blocking the bus for the other
+    pumps. After recovery_time, a single request is let through to test the pump again.
+
+    Args:
+        min_timeout (float): Shortest timeout, default set to RETRY_MIN_TIMEOUT (0.1).
+
+        max_timeout (float): Longest timeout, used until latencies are observed, default set to RETRY_MAX_TIMEOUT (1).
+
+        backoff_base (float): Delay before the first retry, default set to RETRY_BACKOFF_BASE (0.01).
+
+        backoff_max (float): Longest delay between two retries, default set to RETRY_BACKOFF_MAX (0.5).
+
+        failure_threshold (int): Consecutive failures opening the circuit breaker, e.g. RETRY_FAILURE_THRESHOLD (3),
+            default set to None for no circuit breaker.
+
+        recovery_time (float): Time before trying an unhealthy pump again, default set to RETRY_RECOVERY_TIME (10).
+
+        clock (SystemClock or VirtualClock): The clock measuring the recovery time, default set to DEFAULT_CLOCK.
+
+    """
+    def __init__(self, min_timeout=RETRY_MIN_TIMEOUT, max_timeout=RETRY_MAX_TIMEOUT, backoff_base=RETRY_BACKOFF_BASE,
+                 backoff_max=RETRY_BACKOFF_MAX, failure_threshold=None, recovery_time=RETRY_RECOVERY_TIME,
+                 clock=None):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.clock = clock if clock is not None else DEFAULT_CLOCK
+
+        self._lock = threading.Lock()
+        self.smoothed_latency = None
+        self.latency_deviation = None
+        self._latencies = collections.deque(maxlen=RETRY_LATENCY_WINDOW)
+
+        self.consecutive_failures = 0
+        self._open_until = None
+
+    def __str__(self):
+        return 'latency {} (p50 {}, p99 {}), timeout {:.3f}, {}'.format(
+            self.smoothed_latency, self.percentile(50), self.percentile(99), self.timeout(),
+            'healthy' if self.is_healthy() else 'unhealthy')
+
+    def record_success(self, latency):
+        """
+        Records a response, received after latency seconds.
+        """
+        with self._lock:
+            if self.smoothed_latency is None:
+                self.smoothed_latency = latency
+                self.latency_deviation = latency / 2.0
+            else:
+                self.latency_deviation = 0.75 * self.latency_deviation + 0.25 * abs(self.smoothed_latency - latency)
+                self.smoothed_latency = 0.875 * self.smoothed_latency + 0.125 * latency
+            self._latencies.append(latency)
+            self.consecutive_failures = 0
+            self._open_until = None
+
+    def record_failure(self):
+        """
+        Records a request which got no valid response, opening the circuit breaker after failure_threshold of them.
+        """
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.failure_threshold is not None and self.consecutive_failures >= self.failure_threshold:
+                self._open_until = self.clock.time() + self.recovery_time
+
+    def percentile(self, percent):
+        """
+        Gets a percentile of the recent latencies.
+
+        Args:
+            percent (float): The percentile, e.g. 99.
+
+        Returns:
+            latency (float): The latency, None if none was observed.
+
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(round(percent / 100.0 * (len(latencies) - 1))))
+        return latencies[index]
+
+    def timeout(self, report=True):
+        """
+        Gets the time to wait for a response.
+
+        Args:
+            report (bool): The request only queries the pump, default set to True. The other requests (moves, EEPROM
+                writes, ...) are given max_timeout: one timed out too early would be sent again and run twice.
+
+        Returns:
+            timeout (float): The timeout in seconds.
+
+        """
+        if self.smoothed_latency is None or not report:
+            return self.max_timeout
+        timeout = max(self.smoothed_latency + 4 * self.latency_deviation, 2 * self.percentile(99))
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+    def backoff(self, attempt):
+        """
+        Gets the time to wait before a retry.
+
+        Args:
+            attempt (int): The number of attempts already failed, starting at 1.
+
+        Returns:
+            delay (float): The delay in seconds.
+
+        """
+        return min(self.backoff_base * 2 ** (attempt - 1), self.backoff_max)
+
+    def is_healthy(self):
+        """
+        Determines if the circuit breaker is closed.
+
+        Returns:
+            True (bool): The pump responds.
+
+            False (bool): The pump failed repeatedly and its recovery time is not over.
+
+        """
+        return self._open_until is None or self.clock.time() >= self._open_until
+
+    def allow_request(self):
+        """
+        Determines if a request can be sent to the pump. Once the recovery time is over, a single request is allowed
+        until its outcome is recorded.
+
+        Returns:
+            True (bool): The request can be sent.
+
+            False (bool): The pump is unhealthy.
+
+        """
+        with self._lock:
+            if self._open_until is None:
+                return True
+            if self.clock.time() >= self._open_until:
+                # Half open: lets this request through, the next ones wait for its outcome
+                self._open_until = self.clock.time() + self.recovery_time
+                return True
+            return False
+
+
+_deadline_state = threading.local()
+
+
+@contextlib.contextmanager
+def deadline(seconds, clock=None):
+    """
+    Bounds the time taken by the pump operations of the current thread. Once the deadline is over, the requests to
+    the pumps raise PumpDeadlineError instead of being sent, and the timeouts and sleeps are cut short to end on
+    time. Nested deadlines cannot extend the deadline around them.
+
+    Args:
+        seconds (float): The time allowed, from now.
+
+        clock (SystemClock or VirtualClock): The clock measuring the time, default set to DEFAULT_CLOCK.
+
+    Yields:
+        end (float): The time of the deadline, on the clock.
+
+    """
+    clock = clock if clock is not None else DEFAULT_CLOCK
+    end = clock.time() + seconds
+    previous = current_deadline()
+    if previous is not None and previous[1] is clock:
+        end = min(end, previous[0])
+    with inherit_deadline((end, clock)):
+        yield end
+
+
+@contextlib.contextmanager
+def inherit_deadline(state):
+    """
+    Applies a deadline obtained with current_deadline(), e.g. in a worker thread running a part of an operation.
+
+    Args:
+        state (tuple): The deadline (end, clock), or None for no deadline.
+
+    """
+    previous = current_deadline()
+    _deadline_state.value = state
+    try:
+        yield
+    finally:
+        _deadline_state.value = previous
+
+
+def current_deadline():
+    """
+    Gets the deadline of the current thread.
+
+    Returns:
+        state (tuple): The deadline (end, clock), None if there is none.
+
+    """
+    return getattr(_deadline_state, 'value', None)
+
+
+def remaining_time():
+    """
+    Gets the time left before the deadline of the current thread.
+
+    Returns:
+        remaining (float): The time left in seconds (negative once over), None if there is no deadline.
+
+    """
+    state = current_deadline()
+    if state is None:
+        return None
+    (end, clock) = state
+    return end - clock.time()
+
+
+def sleep(seconds, clock=None):
+    """
+    Sleeps on a clock, at most until the deadline of the current thread.
+
+    Args:
+        seconds (float): The time to sleep, in seconds.
+
+        clock (SystemClock or VirtualClock): The clock, default set to DEFAULT_CLOCK.
+
+    Raises:
+        PumpDeadlineError: The deadline is over.
+
+    """
+    remaining = remaining_time()
+    if remaining is not None:
+        if remaining <= 0:
+            raise PumpDeadlineError('Deadline exceeded')
+        seconds = min(seconds, remaining)
+    (clock if clock is not None else DEFAULT_CLOCK).sleep(seconds)
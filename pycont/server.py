@@ -0,0 +1,554 @@
+"""
+.. module:: server
+   :platform: Unix
+   :synopsis: A module serving the pumps of a setup to several processes over a Unix domain socket.
+
+.. moduleauthor:: Jonathan Grizou <Jonathan.Grizou@gla.ac.uk>
+
+A serial port has a single owner. The server owns the hubs of a MultiPumpController and serves its API, and the API
+of its pumps, to the clients::
+
+    python -m pycont.server pump_setup_config.json
+
+The clients use the same method names as the controllers::
+
+    with PumpClient() as controller:
+        controller.pumps['water'].pump(0.5, from_valve='I', wait=True)
+        print(controller.pumps['water'].current_volume)
+        controller.wait_until_all_pumps_idle()
+
+Messages are JSON objects prefixed by their length (4 bytes, big endian). Identical status queries from different
+clients (see QUERY_METHODS) are coalesced: a query already running is not sent again and its result is reused for
+QUERY_MAX_AGE, so the load of the pumps does not grow with the number of monitoring clients. Any other command on a
+pump drops its cached results.
+
+The socket is only accessible to the user running the server, and the clients can only call the methods of
+PUMP_METHODS and CONTROLLER_METHODS: the EEPROM and the raw packets of the pumps are out of their reach.
+
+"""
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import struct
+import socket
+import inspect
+import argparse
+import tempfile
+import threading
+import socketserver
+import concurrent.futures
+
+from ._logger import create_logger
+from .clock import DEFAULT_CLOCK
+from .controller import (MultiPumpController, C3000Controller, PumpIOTimeOutError, ControllerRepeatedError,
+                         PumpUnhealthyError, PumpHWError)
+from .retry import PumpDeadlineError
+
+
+def default_socket_path():
+    """
+    Gets the default path of the socket of the server, in the runtime directory of the user ($XDG_RUNTIME_DIR) or
+    else in the temporary directory, named after the user.
+
+    Returns:
+        path (str): The path of the socket.
+
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'pycont.sock')
+    return os.path.join(tempfile.gettempdir(), 'pycont-{}.sock'.format(os.getuid()))
+
+
+#: Default path of the socket of the server
+DEFAULT_SOCKET_PATH = default_socket_path()
+#: Time (in seconds) during which the result of a status query is reused for the other clients
+QUERY_MAX_AGE = 0.1
+#: Methods and properties only reading the state of the pumps, their results are shared between the clients
+QUERY_METHODS = ('is_idle', 'is_busy', 'is_initialized', 'get_volume', 'get_plunger_position', 'get_valve_position',
+                 'get_raw_valve_position', 'get_top_velocity', 'get_eeprom_config', 'get_current_valve_config',
+                 'current_volume', 'remaining_volume', 'current_steps', 'remaining_steps', 'are_pumps_idle',
+                 'are_pumps_busy', 'are_pumps_initialized')
+#: Methods and properties of the pumps the clients can call
+PUMP_METHODS = QUERY_METHODS + (
+    'pump', 'deliver', 'transfer', 'go_to_volume', 'go_to_max_volume', 'set_valve_position', 'set_top_velocity',
+    'set_default_top_velocity', 'get_default_top_velocity', 'ensure_default_top_velocity', 'initialize',
+    'initialize_valve_only', 'initialize_no_valve', 'initialize_valve_right', 'initialize_valve_left',
+    'smart_initialize', 'wait_until_idle', 'terminate', 'fire', 'is_armed', 'run_program', 'is_volume_valid',
+    'is_volume_pumpable', 'is_volume_deliverable', 'volume_to_step', 'step_to_volume', 'estimate_move_duration',
+    'estimated_completion_time', 'estimated_progress', 'invalidate_shadow_state')
+#: Methods and properties of the controller the clients can call
+CONTROLLER_METHODS = QUERY_METHODS + (
+    'pump', 'deliver', 'transfer', 'parallel_transfer', 'fire', 'smart_initialize', 'terminate_all_pumps',
+    'wait_until_pumps_idle', 'wait_until_all_pumps_idle', 'wait_until_group_idle', 'apply_command_to_pumps',
+    'apply_command_to_all_pumps', 'apply_command_to_group', 'apply_command_to_pumps_at_once')
+#: Methods of the controller applying a command to the pumps, the command must be one of PUMP_METHODS
+COMMAND_METHODS = ('apply_command_to_pumps', 'apply_command_to_all_pumps', 'apply_command_to_group',
+                   'apply_command_to_pumps_at_once')
+
+_LENGTH = struct.Struct('>I')
+
+#: Exceptions raised again by the client with their type
+REMOTE_EXCEPTIONS = {exception.__name__: exception for exception in (
+    ValueError, TypeError, KeyError, AttributeError, PumpIOTimeOutError, ControllerRepeatedError, PumpUnhealthyError,
+    PumpDeadlineError)}
+
+
+def send_message(sock, message):
+    """
+    Sends a message on a socket.
+
+    Args:
+        sock (socket.socket): The socket.
+
+        message (Dict): The message, it must be serializable to JSON.
+
+    """
+    data = json.dumps(message, separators=(',', ':')).encode()
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def _receive_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def receive_message(sock):
+    """
+    Receives a message from a socket.
+
+    Args:
+        sock (socket.socket): The socket.
+
+    Returns:
+        message (Dict): The message, None if the socket was closed.
+
+    """
+    header = _receive_exactly(sock, _LENGTH.size)
+    if header is None:
+        return None
+    data = _receive_exactly(sock, _LENGTH.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode())
+
+
+class QueryCoalescer(object):
+    """
+    This class runs the status queries of all the clients: a query already running is waited for instead of being
+    run again, and its result is reused during max_age.
+
+    Args:
+        max_age (float): Time during which a result is reused, default set to QUERY_MAX_AGE (0.1).
+
+        clock (SystemClock or VirtualClock): The clock measuring the age of the results, default set to DEFAULT_CLOCK.
+
+    """
+    def __init__(self, max_age=QUERY_MAX_AGE, clock=None):
+        self.max_age = max_age
+        self.clock = clock if clock is not None else DEFAULT_CLOCK
+
+        self._lock = threading.Lock()
+        self._running = {}
+        self._results = {}
+        self._generation = 0
+        self.queries = 0
+        self.coalesced = 0
+
+    def call(self, key, func):
+        """
+        Gets the result of a query.
+
+        Args:
+            key (tuple): The query, its first item is the name of the pump queried (None for the controller).
+
+            func (Callable): The function running the query.
+
+        Returns:
+            The result of the query.
+
+        """
+        with self._lock:
+            if key in self._results:
+                (time, result) = self._results[key]
+                if self.clock.time() - time <= self.max_age:
+                    self.coalesced += 1
+                    return result
+                del self._results[key]
+            future = self._running.get(key)
+            running = future is not None
+            if running:
+                self.coalesced += 1
+            else:
+                future = self._running[key] = concurrent.futures.Future()
+                generation = self._generation
+                self.queries += 1
+
+        if running:
+            return future.result()
+
+        try:
+            result = func()
+        except Exception as err:
+            with self._lock:
+                del self._running[key]
+            future.set_exception(err)
+            raise
+        with self._lock:
+            del self._running[key]
+            if generation == self._generation:  # Not invalidated while running
+                self._results[key] = (self.clock.time(), result)
+        future.set_result(result)
+        return result
+
+    def invalidate(self, pump_name=None):
+        """
+        Drops the results of the queries of a pump, as a command may have changed its state.
+
+        Args:
+            pump_name (str): The name of the pump, default set to None for all the pumps.
+
+        """
+        with self._lock:
+            self._generation += 1
+            for key in list(self._results):
+                if pump_name is None or key[0] in (pump_name, None):
+                    del self._results[key]
+
+
+class PumpRequestHandler(socketserver.BaseRequestHandler):
+    """
+    This class serves a client connection, one request at a time.
+    """
+    def handle(self):
+        while True:
+            try:
+                request = receive_message(self.request)
+            except (OSError, ValueError):
+                return
+            if request is None:
+                return
+            send_message(self.request, self.server.handle_request(request))
+
+
+class PumpServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    This class serves a MultiPumpController and its pumps on a Unix domain socket, each client in its own thread.
+
+    A request is a message {"id": ..., "pump": <pump name or null>, "name": <method or attribute>, "args": [...],
+    "kwargs": {...}}, answered by {"id": ..., "result": ...} or {"id": ..., "error": {"type": ..., "message": ...}}.
+    The request {"id": ..., "describe": true} returns the pumps, groups and properties of the controller.
+
+    Args:
+        controller (MultiPumpController): The controller owning the hubs.
+
+        path (str): The path of the socket, default set to DEFAULT_SOCKET_PATH (see default_socket_path()). The
+            socket is created with permissions 0o600.
+
+        query_max_age (float): Time during which the result of a status query is shared, default set to
+            QUERY_MAX_AGE (0.1).
+
+    """
+    daemon_threads = True
+
+    def __init__(self, controller, path=DEFAULT_SOCKET_PATH, query_max_age=QUERY_MAX_AGE):
+        self.logger = create_logger(self.__class__.__name__)
+
+        self.controller = controller
+        self.path = path
+        self.coalescer = QueryCoalescer(query_max_age, clock=controller._clock)
+
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                raise OSError('A server is already listening on {}'.format(path))
+            except ConnectionRefusedError:
+                os.unlink(path)  # Left by a server which did not stop cleanly
+            finally:
+                probe.close()
+        super(PumpServer, self).__init__(path, PumpRequestHandler)
+
+    def server_bind(self):
+        """
+        Creates the socket, readable and writable by its owner only.
+        """
+        umask = os.umask(0o177)
+        try:
+            super(PumpServer, self).server_bind()
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, 0o600)
+
+    def describe(self):
+        """
+        Describes the setup to the clients.
+
+        Returns:
+            description (Dict): The pumps, the groups and the names of the properties of the pumps and of the
+                controller.
+
+        """
+        return {
+            'pumps': list(self.controller.pumps.keys()),
+            'groups': self.controller.groups,
+            'pump_properties': _properties(C3000Controller),
+            'controller_properties': _properties(type(self.controller)),
+        }
+
+    def handle_request(self, request):
+        """
+        Runs a request of a client.
+
+        Args:
+            request (Dict): The request.
+
+        Returns:
+            reply (Dict): The reply.
+
+        """
+        reply = {'id': request.get('id')}
+        try:
+            if request.get('describe'):
+                reply['result'] = self.describe()
+            else:
+                reply['result'] = self.call(request.get('pump'), request['name'], request.get('args', []),
+                                            request.get('kwargs', {}))
+            json.dumps(reply['result'])
+        except Exception as err:
+            self.logger.debug("Request %s failed: %r", request, err)
+            reply.pop('result', None)
+            reply['error'] = {'type': type(err).__name__, 'message': str(err)}
+            if isinstance(err, PumpHWError):
+                reply['error'].update(error_code=err.error_code, pump=err.pump_name)
+        return reply
+
+    def call(self, pump_name, name, args, kwargs):
+        """
+        Calls a method, or gets an attribute, of a pump or of the controller.
+
+        Args:
+            pump_name (str): The name of the pump, None for the controller.
+
+            name (str): The name of the method or attribute.
+
+            args (List): The arguments of the method.
+
+            kwargs (Dict): The keyword arguments of the method.
+
+        Returns:
+            The result.
+
+        Raises:
+            AttributeError: The name, or the command applied to the pumps, is not in PUMP_METHODS or
+                CONTROLLER_METHODS.
+
+        """
+        if name not in (CONTROLLER_METHODS if pump_name is None else PUMP_METHODS):
+            raise AttributeError('{} is not available'.format(name))
+        target = self.controller if pump_name is None else self.controller.pumps[pump_name]
+        if pump_name is None and name in COMMAND_METHODS:
+            command = inspect.signature(getattr(target, name)).bind(*args, **kwargs).arguments['command']
+            if command not in PUMP_METHODS:
+                raise AttributeError('{} is not available'.format(command))
+
+        def run():
+            value = getattr(target, name)
+            return value(*args, **kwargs) if callable(value) else value
+
+        if name in QUERY_METHODS:
+            key = (pump_name, name, json.dumps(args), json.dumps(kwargs, sort_keys=True))
+            return self.coalescer.call(key, run)
+        try:
+            return run()
+        finally:
+            self.coalescer.invalidate(pump_name)
+
+    def server_close(self):
+        """
+        Stops listening and removes the socket.
+        """
+        super(PumpServer, self).server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def _properties(cls):
+    return sorted(name for name in dir(cls) if not name.startswith('_') and isinstance(getattr(cls, name), property))
+
+
+class PumpServerError(Exception):
+    """
+    Exception for when the server reports an error of a type not raised as such by the client.
+    """
+    pass
+
+
+class RemotePumpHWError(PumpHWError):
+    """
+    Exception for when a pump of the server encounters an hardware error. The error was already reported by the
+    server, it is not printed again.
+    """
+
+    def __init__(self, error_code='x', pump='unknown'):
+        Exception.__init__(self, error_code, pump)
+        self.pump_name = pump
+        self.error_code = error_code.lower()
+
+
+class _RemoteMethod(object):
+
+    def __init__(self, client, pump_name, name):
+        self._client = client
+        self._pump_name = pump_name
+        self.__name__ = name
+
+    def __call__(self, *args, **kwargs):
+        return self._client.call(self._pump_name, self.__name__, *args, **kwargs)
+
+
+class RemotePump(object):
+    """
+    This class represents a pump of the server, its methods and properties are those of C3000Controller.
+
+    Args:
+        client (PumpClient): The client connected to the server.
+
+        name (str): The name of the pump.
+
+        properties (List): The names of the properties of C3000Controller.
+
+    """
+    def __init__(self, client, name, properties):
+        self._client = client
+        self.name = name
+        self._properties = properties
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self._properties:
+            return self._client.call(self.name, name)
+        return _RemoteMethod(self._client, self.name, name)
+
+    def __repr__(self):
+        return '<RemotePump {}>'.format(self.name)
+
+
+class PumpClient(object):
+    """
+    This class connects to a PumpServer, its methods and properties are those of the MultiPumpController of the
+    server, and its pumps (in pumps, and as attributes) those of C3000Controller.
+
+    Results are converted to JSON types (tuples become lists) and operation=True is not supported. Errors of the
+    server are raised again, with their type for the common ones (see REMOTE_EXCEPTIONS, and RemotePumpHWError for
+    PumpHWError), as PumpServerError otherwise.
+
+    Args:
+        path (str): The path of the socket, default set to DEFAULT_SOCKET_PATH (see default_socket_path()).
+
+        timeout (float): Timeout of the socket, default set to None to wait for the longest operations.
+
+    """
+    def __init__(self, path=DEFAULT_SOCKET_PATH, timeout=None):
+        self.logger = create_logger(self.__class__.__name__)
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(path)
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+        description = self._request({'describe': True})
+        self.groups = description['groups']
+        self._properties = description['controller_properties']
+        self.pumps = {}
+        for pump_name in description['pumps']:
+            self.pumps[pump_name] = RemotePump(self, pump_name, description['pump_properties'])
+            setattr(self, pump_name, self.pumps[pump_name])
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self._properties:
+            return self.call(None, name)
+        return _RemoteMethod(self, None, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Closes the connection to the server.
+        """
+        self._socket.close()
+
+    def call(self, pump_name, name, *args, **kwargs):
+        """
+        Calls a method, or gets an attribute, of a pump or of the controller of the server.
+
+        Args:
+            pump_name (str): The name of the pump, None for the controller.
+
+            name (str): The name of the method or attribute.
+
+            *args: Variable length argument list.
+
+            **kwargs: Arbitrary keyword arguments.
+
+        Returns:
+            The result.
+
+        """
+        return self._request({'pump': pump_name, 'name': name, 'args': list(args), 'kwargs': kwargs})
+
+    def _request(self, request):
+        with self._lock:
+            self._next_id += 1
+            request['id'] = self._next_id
+            send_message(self._socket, request)
+            reply = receive_message(self._socket)
+        if reply is None:
+            raise PumpServerError('Connection closed by the server')
+        if 'error' in reply:
+            error = reply['error']
+            if error['type'] == PumpHWError.__name__:
+                raise RemotePumpHWError(error_code=error['error_code'], pump=error['pump'])
+            if error['type'] in REMOTE_EXCEPTIONS:
+                raise REMOTE_EXCEPTIONS[error['type']](error['message'])
+            raise PumpServerError('{}: {}'.format(error['type'], error['message']))
+        return reply['result']
+
+
+def main():
+    """
+    Serves the pumps of a setup configuration file until interrupted.
+    """
+    parser = argparse.ArgumentParser(description='Serves the pumps of a setup to other processes.')
+    parser.add_argument('config', help='The setup configuration file, see MultiPumpController')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help='The path of the socket')
+    parser.add_argument('--query-max-age', type=float, default=QUERY_MAX_AGE,
+                        help='Time during which the result of a status query is shared')
+    arguments = parser.parse_args()
+
+    with MultiPumpController.from_configfile(arguments.config) as controller:
+        server = PumpServer(controller, arguments.socket, arguments.query_max_age)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
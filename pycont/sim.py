@@ -0,0 +1,845 @@
+"""
+.. module:: sim
+   :platform: Unix
+   :synopsis: A module simulating C-series pumps behind pseudo-terminals or TCP ports, for testing without hardware.
+
+.. moduleauthor:: Jonathan Grizou <Jonathan.Grizou@gla.ac.uk>
+
+"""
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import copy
+import json
+import tty
+import random
+import select
+import socket
+import threading
+import collections
+
+from ._logger import create_logger
+
+from . import pump_protocol
+from . import dtprotocol
+from .clock import DEFAULT_CLOCK, VirtualClock
+from .controller import C3000SwitchToAddress, C3000Broadcast, DEFAULT_IO_TIMEOUT, MultiPumpController, PumpIO, \
+    PumpIOTimeOutError, dual_group_address, quad_group_address
+
+#: Number of steps of a full stroke in microstep mode 0
+SIM_N_STEPS = 3000
+#: Top velocity of the pumps at power up, in microstep mode 0
+SIM_DEFAULT_TOP_VELOCITY = 1400
+#: Range of the top velocity, in microstep mode 0
+SIM_TOP_VELOCITY_RANGE = (5, 6000)
+#: Duration of the valve initialization (w command)
+SIM_VALVE_INITIALIZE_DURATION = 0.5
+#: Duration of the plunger initialization (W command), the plunger is moved back to 0 at SIM_DEFAULT_TOP_VELOCITY
+SIM_PLUNGER_INITIALIZE_DURATION = 0.5
+#: Largest number of commands a packet may expand to once its loops are unrolled
+SIM_MAX_COMMANDS = 100000
+#: EEPROM configuration reported with ?27, configured for a 4 way distribution valve
+SIM_DEFAULT_EEPROM_CONFIG = '10,75,14,62,1,1,20,10,48,210,2033110,0,0,0,0,0,25,20,15,0000000'
+
+#: Error codes, the status byte of a reply is 0x40 | (0x20 if idle) | error code
+ERROR_NONE = 0
+ERROR_INIT_FAILURE = 1
+ERROR_INVALID_COMMAND = 2
+ERROR_INVALID_OPERAND = 3
+ERROR_EEPROM_FAILURE = 6
+ERROR_NOT_INITIALIZED = 7
+ERROR_PLUNGER_OVERLOAD = 9
+ERROR_VALVE_OVERLOAD = 10
+ERROR_PLUNGER_STUCK = 11
+ERROR_COMMAND_OVERFLOW = 15
+
+#: Errors which persist until the pump is initialized again
+PERSISTENT_ERRORS = (ERROR_INIT_FAILURE, ERROR_PLUNGER_OVERLOAD, ERROR_VALVE_OVERLOAD, ERROR_PLUNGER_STUCK)
+
+#: A command of a DT packet: a letter (or '?') followed by its operand
+COMMAND_PATTERN = re.compile(r'([A-Za-z?])([0-9,]*)')
+
+#: Valve commands and the position they report with ?6
+VALVE_COMMANDS = {
+    pump_protocol.CMD_VALVE_INPUT: 'i',
+    pump_protocol.CMD_VALVE_OUTPUT: 'o',
+    pump_protocol.CMD_VALVE_BYPASS: 'b',
+    pump_protocol.CMD_VALVE_EXTRA: 'e',
+}
+
+INITIALIZE_COMMANDS = (pump_protocol.CMD_INITIALIZE_VALVE_RIGHT, pump_protocol.CMD_INITIALIZE_VALVE_LEFT,
+                       pump_protocol.CMD_INITIALIZE_NO_VALVE, pump_protocol.CMD_INITIALIZE_VALVE_ONLY)
+
+#: An action executed by a simulated pump, over [start, end]
+SimulatedAction = collections.namedtuple('SimulatedAction', ['start', 'end', 'kind', 'origin', 'target'])
+
+
+class SimulationError(Exception):
+    """
+    Exception raised when a simulated pump refuses a packet, carries the error code to report.
+    """
+    def __init__(self, error_code):
+        super(SimulationError, self).__init__(error_code)
+        self.error_code = error_code
+
+
+class SimulatedPump(object):
+    """
+    This class simulates the state of a C-series pump.
+
+    The packets are executed as a timeline of actions (plunger moves, valve rotations, initializations, delays), the
+    duration of the plunger moves following the velocity profile of the pump (see
+    pump_protocol.estimate_move_duration()).
+    Loops and stored programs are unrolled into the timeline when the packet is received. The state reported to the
+    queries is the state at the time of the query, a plunger move being interpolated.
+
+    Args:
+        address (chr): Address of the pump, e.g. '1'.
+
+        eeprom_config (str): The EEPROM configuration reported with ?27, default set to SIM_DEFAULT_EEPROM_CONFIG.
+
+        clock (SystemClock or VirtualClock): The clock timing the actions, default set to DEFAULT_CLOCK.
+
+    """
+    def __init__(self, address, eeprom_config=SIM_DEFAULT_EEPROM_CONFIG, clock=None):
+        self.logger = create_logger(self.__class__.__name__)
+
+        self.clock = clock if clock is not None else DEFAULT_CLOCK
+        self.address = address
+        self.eeprom_config = eeprom_config
+
+        self.micro_step_mode = 0
+        self.top_velocity = SIM_DEFAULT_TOP_VELOCITY
+        self.start_velocity = pump_protocol.DEFAULT_START_VELOCITY
+        self.cutoff_velocity = pump_protocol.DEFAULT_CUTOFF_VELOCITY
+        self.slope = pump_protocol.DEFAULT_SLOPE
+
+        self.initialized = False
+        self.plunger_position = 0
+        self.valve_position = 'i'
+        self.error = ERROR_NONE
+
+        self._actions = collections.deque()
+        self._stored_commands = []
+        # Programs stored in EEPROM (s command), by slot
+        self.programs = {}
+
+    def __str__(self):
+        return 'SimulatedPump {}: plunger {}, valve {}, {}'.format(
+            self.address, self.plunger_position, self.valve_position, 'busy' if self._actions else 'idle')
+
+    @property
+    def factor(self):
+        return pump_protocol.MICRO_STEP_MODE_2_FACTOR if self.micro_step_mode == 2 else 1
+
+    @property
+    def max_steps(self):
+        return SIM_N_STEPS * self.factor
+
+    def now(self):
+        return self.clock.time()
+
+    def update(self):
+        """
+        Applies the actions over at the current time.
+        """
+        now = self.now()
+        while self._actions and self._actions[0].end <= now:
+            self._apply(self._actions.popleft())
+
+    def _apply(self, action):
+        if action.kind == 'plunger':
+            self.plunger_position = action.target
+        elif action.kind == 'valve':
+            self.valve_position = action.target
+        elif action.kind == 'initialize':
+            self.initialized = True
+            self.error = ERROR_NONE
+            if action.target is not None:
+                self.plunger_position = action.target
+
+    def is_busy(self):
+        self.update()
+        return bool(self._actions)
+
+    def current_plunger_position(self):
+        """
+        Gets the position of the plunger, interpolated if a move is running.
+        """
+        self.update()
+        if self._actions and self._actions[0].kind == 'plunger':
+            action = self._actions[0]
+            now = self.now()
+            if now > action.start:
+                progress = (now - action.start) / (action.end - action.start)
+                return int(action.origin + progress * (action.target - action.origin))
+        return self.plunger_position
+
+    def status(self, error=ERROR_NONE):
+        """
+        Gets the status byte of a reply.
+
+        Args:
+            error (int): The error to report, default to the persistent error of the pump.
+
+        Returns:
+            status (chr): The status byte.
+
+        """
+        error = error or self.error
+        return chr(0x40 | (0 if self.is_busy() else 0x20) | error)
+
+    def inject_error(self, error_code):
+        """
+        Puts the pump in error, e.g. ERROR_PLUNGER_OVERLOAD. Persistent errors are cleared by an initialization.
+        """
+        self.terminate()
+        self.error = error_code
+
+    def terminate(self):
+        """
+        Stops the plunger where it is and drops the remaining actions.
+        """
+        self.plunger_position = self.current_plunger_position()
+        if self._actions and self._actions[0].kind != 'plunger' and self._actions[0].start <= self.now():
+            self._apply(self._actions[0])
+        self._actions.clear()
+
+    def handle(self, body):
+        """
+        Handles the body of a packet addressed to the pump.
+
+        Args:
+            body (str): The packet without start, address and stop, e.g. 'V6000IP2400R'.
+
+        Returns:
+            (status, data) (tuple): The status byte and data of the reply.
+
+        """
+        if body.startswith(pump_protocol.CMD_REPORT_PLUNGER_POSITION) or body.startswith(
+                pump_protocol.CMD_REPORT_STATUS):
+            return self.report(body.rstrip(pump_protocol.CMD_EXECUTE))
+
+        if body.startswith(pump_protocol.CMD_TERMINATE):
+            self.terminate()
+            return self.status(), ''
+
+        if body.startswith(pump_protocol.CMD_STORE_PROGRAM):
+            return self.store_program(body.rstrip(pump_protocol.CMD_EXECUTE))
+
+        if body.startswith(pump_protocol.CMD_EEPROM_CONFIG) or body.startswith(
+                pump_protocol.CMD_EEPROM_LOWLEVEL_CONFIG):
+            return self.status(), ''
+
+        execute = body.endswith(pump_protocol.CMD_EXECUTE)
+        if execute:
+            body = body[:-1]
+
+        try:
+            commands = self.parse(body)
+        except SimulationError as error:
+            return self.status(error.error_code), ''
+
+        if not execute:
+            self._stored_commands.extend(commands)
+            return self.status(), ''
+
+        commands = self._stored_commands + commands
+        self._stored_commands = []
+        try:
+            self.execute(commands)
+        except SimulationError as error:
+            return self.status(error.error_code), ''
+        return self.status(), ''
+
+    def store_program(self, body):
+        """
+        Stores the commands following a s command as a program, without running them.
+
+        Args:
+            body (str): The packet without start, address, execute and stop, e.g. 's3gIP3000OD3000G10'.
+
+        Returns:
+            (status, data) (tuple): The status byte and data of the reply.
+
+        """
+        try:
+            commands = self.parse(body)
+        except SimulationError as error:
+            return self.status(error.error_code), ''
+        (_, slot) = commands[0]
+        if slot is None or not 0 <= int(slot) < pump_protocol.PROGRAM_SLOTS:
+            return self.status(ERROR_INVALID_OPERAND), ''
+        self.programs[int(slot)] = commands[1:]
+        return self.status(), ''
+
+    def expand(self, commands):
+        """
+        Replaces the programs run (e command) by their commands and unrolls the loops (g and G commands).
+
+        Returns:
+            commands (list): List of (command, operand) tuples, without loops.
+
+        Raises:
+            SimulationError: A program or a loop is invalid. Loops running until terminated (G0) are not simulated
+                and refused with ERROR_INVALID_OPERAND.
+
+        """
+        stack = [[]]
+        for command, operand in commands:
+            if command == pump_protocol.CMD_RUN_PROGRAM:
+                slot = int(operand) if operand is not None and operand.isdigit() else None
+                if slot not in self.programs:
+                    raise SimulationError(ERROR_INVALID_OPERAND)
+                stack[-1].extend(self.expand(self.programs[slot]))
+            elif command == pump_protocol.CMD_LOOP_START:
+                if len(stack) > pump_protocol.MAX_LOOP_DEPTH:
+                    raise SimulationError(ERROR_INVALID_COMMAND)
+                stack.append([])
+            elif command == pump_protocol.CMD_LOOP_END:
+                if len(stack) == 1:
+                    raise SimulationError(ERROR_INVALID_COMMAND)
+                if operand is None or not operand.isdigit() or \
+                        not 0 < int(operand) <= pump_protocol.MAX_LOOP_REPEAT:
+                    raise SimulationError(ERROR_INVALID_OPERAND)
+                loop = stack.pop()
+                if len(stack[-1]) + len(loop) * int(operand) > SIM_MAX_COMMANDS:
+                    raise SimulationError(ERROR_COMMAND_OVERFLOW)
+                stack[-1].extend(loop * int(operand))
+            else:
+                stack[-1].append((command, operand))
+        # A loop which is not closed runs once
+        return [command for loop in stack for command in loop]
+
+    def report(self, query):
+        """
+        Answers the report queries (Q, ?, ?1, ?2, ?3, ?6, ?19, ?27 and ?28).
+        """
+        if query == pump_protocol.CMD_REPORT_STATUS:
+            data = ''
+        elif query == pump_protocol.CMD_REPORT_PLUNGER_POSITION:
+            data = str(self.current_plunger_position())
+        elif query == pump_protocol.CMD_REPORT_START_VELOCITY:
+            data = str(self.start_velocity * self.factor)
+        elif query == pump_protocol.CMD_REPORT_PEAK_VELOCITY:
+            data = str(self.top_velocity)
+        elif query == pump_protocol.CMD_REPORT_CUTOFF_VELOCITY:
+            data = str(self.cutoff_velocity * self.factor)
+        elif query == pump_protocol.CMD_REPORT_VALVE_POSITION:
+            self.update()
+            data = self.valve_position
+        elif query == pump_protocol.CMD_REPORT_INTIALIZED:
+            self.update()
+            data = '1' if self.initialized else '0'
+        elif query == pump_protocol.CMD_REPORT_EEPROM:
+            data = self.eeprom_config
+        elif query == pump_protocol.CMD_REPORT_JUMPER_3WAY:
+            data = '0'
+        else:
+            return self.status(ERROR_INVALID_COMMAND), ''
+        return self.status(), data
+
+    def parse(self, body):
+        """
+        Splits the body of a packet into its commands.
+
+        Returns:
+            commands (list): List of (command, operand) tuples, operand being None when not given.
+
+        Raises:
+            SimulationError: ERROR_INVALID_COMMAND if the body cannot be parsed.
+
+        """
+        commands = []
+        position = 0
+        while position < len(body):
+            match = COMMAND_PATTERN.match(body, position)
+            if match is None:
+                raise SimulationError(ERROR_INVALID_COMMAND)
+            commands.append((match.group(1), match.group(2) or None))
+            position = match.end()
+        return commands
+
+    def execute(self, commands):
+        """
+        Appends the actions of the commands to the timeline of the pump.
+
+        The commands are checked against the state the pump will be in when running them. Nothing is executed if one
+        of them is refused.
+
+        Raises:
+            SimulationError: The commands are refused, with the error code to report.
+
+        """
+        if self.is_busy():
+            raise SimulationError(ERROR_COMMAND_OVERFLOW)
+        commands = self.expand(commands)
+        if self.error in PERSISTENT_ERRORS and not any(command in INITIALIZE_COMMANDS for command, _ in commands):
+            raise SimulationError(self.error)
+
+        start = self.now()
+        plunger_position = self.plunger_position
+        top_velocity = self.top_velocity
+        micro_step_mode = self.micro_step_mode
+        initialized = self.initialized
+        actions = []
+        parameters = {}
+
+        def integer(operand, default=None):
+            if operand is None:
+                if default is None:
+                    raise SimulationError(ERROR_INVALID_OPERAND)
+                return default
+            try:
+                return int(operand)
+            except ValueError:
+                raise SimulationError(ERROR_INVALID_OPERAND)
+
+        for command, operand in commands:
+            factor = pump_protocol.MICRO_STEP_MODE_2_FACTOR if micro_step_mode == 2 else 1
+            if command in INITIALIZE_COMMANDS:
+                duration = SIM_VALVE_INITIALIZE_DURATION
+                target = None
+                if command != pump_protocol.CMD_INITIALIZE_VALVE_ONLY:
+                    duration += SIM_PLUNGER_INITIALIZE_DURATION
+                    target = plunger_position = 0
+                actions.append(SimulatedAction(start, start + duration, 'initialize', None, target))
+                start += duration
+                initialized = True
+            elif command == pump_protocol.CMD_MICROSTEPMODE:
+                mode = integer(operand, 0)
+                if mode not in (0, 1, 2):
+                    raise SimulationError(ERROR_INVALID_OPERAND)
+                parameters['micro_step_mode'] = micro_step_mode = mode
+            elif command == pump_protocol.CMD_TOPVELOCITY:
+                velocity = integer(operand)
+                if not SIM_TOP_VELOCITY_RANGE[0] * factor <= velocity <= SIM_TOP_VELOCITY_RANGE[1] * factor:
+                    raise SimulationError(ERROR_INVALID_OPERAND)
+                parameters['top_velocity'] = top_velocity = velocity
+            elif command in VALVE_COMMANDS:
+                target = VALVE_COMMANDS[command] if operand is None else str(integer(operand))
+                duration = pump_protocol.VALVE_MOVE_DURATION
+                actions.append(SimulatedAction(start, start + duration, 'valve', None, target))
+                start += duration
+            elif command == pump_protocol.CMD_DELAY:
+                delay = integer(operand)
+                if not 0 <= delay <= pump_protocol.MAX_DELAY:
+                    raise SimulationError(ERROR_INVALID_OPERAND)
+                actions.append(SimulatedAction(start, start + delay / 1000.0, 'delay', None, None))
+                start += delay / 1000.0
+            elif command in (pump_protocol.CMD_MOVE_TO, pump_protocol.CMD_PUMP, pump_protocol.CMD_DELIVER):
+                if not initialized:
+                    raise SimulationError(ERROR_NOT_INITIALIZED)
+                steps = integer(operand)
+                if command == pump_protocol.CMD_MOVE_TO:
+                    target = steps
+                elif command == pump_protocol.CMD_PUMP:
+                    target = plunger_position + steps
+                else:
+                    target = plunger_position - steps
+                if not 0 <= target <= SIM_N_STEPS * factor:
+                    raise SimulationError(ERROR_INVALID_OPERAND)
+                duration = pump_protocol.estimate_move_duration(
+                    target - plunger_position, top_velocity, self.start_velocity, self.cutoff_velocity, self.slope,
+                    micro_step_mode)
+                actions.append(SimulatedAction(start, start + duration, 'plunger', plunger_position, target))
+                start += duration
+                plunger_position = target
+            else:
+                raise SimulationError(ERROR_INVALID_COMMAND)
+
+        if 'micro_step_mode' in parameters and parameters['micro_step_mode'] != self.micro_step_mode:
+            # Positions are reported in the steps of the new mode
+            if parameters['micro_step_mode'] == 2:
+                self.plunger_position *= pump_protocol.MICRO_STEP_MODE_2_FACTOR
+            elif self.micro_step_mode == 2:
+                self.plunger_position //= pump_protocol.MICRO_STEP_MODE_2_FACTOR
+        for name, value in parameters.items():
+            setattr(self, name, value)
+        self._actions.extend(actions)
+
+
+class SimulatedHub(object):
+    """
+    This class simulates the pumps sharing a serial bus, answering the packets addressed to them.
+
+    Packets sent to the broadcast address or to a group address (dual or quad, see the C-series manual) are executed
+    by all the pumps of the group and get no reply.
+
+    Args:
+        addresses (list): Addresses of the pumps on the hub, e.g. ['1', '2'].
+
+        latency (float): Time in seconds taken by a pump to reply, default set to 0.
+
+        jitter (float): Random additional latency, up to jitter seconds, default set to 0.
+
+        baudrate (int): When given, the time taken to transmit the packets at this baudrate is added to the latency.
+
+        clock (SystemClock or VirtualClock): The clock of the pumps, default set to DEFAULT_CLOCK.
+
+    """
+    def __init__(self, addresses=(), latency=0, jitter=0, baudrate=None, clock=None):
+        self.logger = create_logger(self.__class__.__name__)
+
+        self.clock = clock if clock is not None else DEFAULT_CLOCK
+
+        self.pumps = collections.OrderedDict()
+        for address in addresses:
+            self.add_pump(address)
+
+        self.latency = latency
+        self.jitter = jitter
+        self.baudrate = baudrate
+
+        self.transactions = 0
+
+    def add_pump(self, address, **kwargs):
+        """
+        Adds a simulated pump to the hub.
+
+        Returns:
+            SimulatedPump: The pump.
+
+        """
+        self.pumps[address] = SimulatedPump(address, clock=self.clock, **kwargs)
+        return self.pumps[address]
+
+    def pumps_at(self, address):
+        """
+        Gets the pumps a packet sent to an address is for.
+        """
+        if address == C3000Broadcast:
+            return list(self.pumps.values())
+        if address in self.pumps:
+            return [self.pumps[address]]
+        return [pump for pump in self.pumps.values()
+                if address in (dual_group_address(pump.address), quad_group_address(pump.address))]
+
+    def reply_delay(self, frame, reply):
+        """
+        Gets the time taken between the end of a packet and the end of its reply.
+        """
+        delay = self.latency + random.uniform(0, self.jitter)
+        if self.baudrate:
+            delay += 10.0 * (len(frame) + len(reply)) / self.baudrate  # 8N1: 10 bits per byte
+        return delay
+
+    def handle_frame(self, frame):
+        """
+        Handles a packet sent on the bus.
+
+        Args:
+            frame (bytes): The packet, e.g. b'/1ZR\\r'.
+
+        Returns:
+            reply (bytes): The reply frame, None if no pump replies.
+
+        """
+        frame = frame.strip()
+        if not frame.startswith(dtprotocol.DTStart.encode()) or len(frame) < 3:
+            return None
+        try:
+            address = frame[1:2].decode()
+            body = frame[2:].decode()
+        except UnicodeDecodeError:
+            return None
+
+        self.transactions += 1
+        pumps = self.pumps_at(address)
+        replies = [pump.handle(body) for pump in pumps]
+        if len(pumps) != 1 or address not in self.pumps:
+            return None  # Broadcast and group packets are not answered
+
+        status, data = replies[0]
+        return '{}{}{}{}{}\r\n'.format(dtprotocol.DTStart, dtprotocol.DTMasterAddress, status, data,
+                                        dtprotocol.DTEnd).encode()
+
+
+class PtyHub(object):
+    """
+    This class serves a SimulatedHub on a pseudo-terminal, which can be opened like a serial port by PumpIO.
+
+    Args:
+        hub (SimulatedHub): The simulated pumps.
+
+    """
+    def __init__(self, hub):
+        self.logger = create_logger(self.__class__.__name__)
+
+        self.hub = hub
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='{}-{}'.format(self.__class__.__name__, self.port))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._running:
+            self._running = False
+            self._thread.join()
+            os.close(self._master)
+            os.close(self._slave)
+
+    def _run(self):
+        buffer = b''
+        while self._running:
+            readable, _, _ = select.select([self._master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                buffer += os.read(self._master, 1024)
+            except OSError:
+                return
+            while dtprotocol.DTStop.encode() in buffer:
+                frame, buffer = buffer.split(dtprotocol.DTStop.encode(), 1)
+                reply = self.hub.handle_frame(frame)
+                if reply is not None:
+                    self.hub.clock.sleep(self.hub.reply_delay(frame, reply))
+                    os.write(self._master, reply)
+
+
+class TCPHub(object):
+    """
+    This class serves a SimulatedHub on a local TCP port, as an Ethernet-to-serial device server in raw TCP mode would.
+    The port of the hub is given to PumpIO as 'tcp://127.0.0.1:<port>'.
+
+    Args:
+        hub (SimulatedHub): The simulated pumps.
+
+        host (str): The interface to listen on, default set to '127.0.0.1'.
+
+        tcp_port (int): The TCP port, default set to 0 for any free port.
+
+    """
+    def __init__(self, hub, host='127.0.0.1', tcp_port=0):
+        self.logger = create_logger(self.__class__.__name__)
+
+        self.hub = hub
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((host, tcp_port))
+        self._listener.listen()
+        (host, tcp_port) = self._listener.getsockname()[:2]
+        self.port = 'tcp://{}:{}'.format(host, tcp_port)
+        self._connections = {}
+        self._pending_disconnect = False
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='{}-{}'.format(self.__class__.__name__, self.port))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def disconnect_clients(self):
+        """
+        Closes the connections of the clients, as a device server restarting would.
+        """
+        self._pending_disconnect = True
+
+    def close(self):
+        if self._running:
+            self._running = False
+            self._thread.join()
+            for connection in self._connections:
+                connection.close()
+            self._listener.close()
+
+    def _run(self):
+        while self._running:
+            if self._pending_disconnect:
+                self._pending_disconnect = False
+                for connection in self._connections:
+                    connection.close()
+                self._connections = {}
+            readable, _, _ = select.select([self._listener] + list(self._connections), [], [], 0.1)
+            for sock in readable:
+                if sock is self._listener:
+                    (connection, _) = self._listener.accept()
+                    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    self._connections[connection] = b''
+                    continue
+                try:
+                    data = sock.recv(1024)
+                except OSError:
+                    data = b''
+                if not data:
+                    del self._connections[sock]
+                    sock.close()
+                    continue
+                buffer = self._connections[sock] + data
+                while dtprotocol.DTStop.encode() in buffer:
+                    frame, buffer = buffer.split(dtprotocol.DTStop.encode(), 1)
+                    reply = self.hub.handle_frame(frame)
+                    if reply is not None:
+                        self.hub.clock.sleep(self.hub.reply_delay(frame, reply))
+                        sock.sendall(reply)
+                self._connections[sock] = buffer
+
+
+class SimulatedSetup(object):
+    """
+    This class simulates all the pumps of a setup configuration, one pseudo-terminal (or local TCP port) per hub.
+
+    The configuration of the simulated setup, the given one with the ports replaced by the pseudo-terminals, can be
+    given as is to MultiPumpController, or saved with save_config() for MultiPumpController.from_configfile().
+
+    Args:
+        setup_config (Dict): The configuration of the setup, in the format of MultiPumpController.
+
+        transport (str): 'pty' to serve the hubs on pseudo-terminals (PtyHub), 'tcp' on local TCP ports (TCPHub),
+            default set to 'pty'.
+
+        **hub_kwargs: Arguments of the SimulatedHub, e.g. latency.
+
+    """
+    def __init__(self, setup_config, transport='pty', **hub_kwargs):
+        self.logger = create_logger(self.__class__.__name__)
+
+        self.config = copy.deepcopy(setup_config)
+        self.hubs = []
+        self.pumps = {}
+
+        if 'hubs' in self.config:
+            hub_configs = self.config['hubs']
+        else:
+            hub_configs = [self.config]
+
+        for hub_config in hub_configs:
+            hub = SimulatedHub(**hub_kwargs)
+            for pump_name, pump_config in hub_config['pumps'].items():
+                self.pumps[pump_name] = hub.add_pump(C3000SwitchToAddress[pump_config['switch']])
+            served_hub = TCPHub(hub) if transport == 'tcp' else PtyHub(hub)
+            self.hubs.append(served_hub)
+            hub_config['io'] = dict(hub_config.get('io', {}), port=served_hub.port)
+
+    @classmethod
+    def from_configfile(cls, setup_configfile, **kwargs):
+        with open(setup_configfile) as f:
+            return cls(json.load(f), **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def save_config(self, setup_configfile):
+        """
+        Saves the configuration of the simulated setup.
+        """
+        with open(setup_configfile, 'w') as f:
+            json.dump(self.config, f, indent=4)
+
+    @property
+    def transactions(self):
+        """
+        Number of packets received by all the hubs.
+        """
+        return sum(served_hub.hub.transactions for served_hub in self.hubs)
+
+    def close(self):
+        for served_hub in self.hubs:
+            served_hub.close()
+
+
+class VirtualPumpIO(PumpIO):
+    """
+    This class connects the controllers to a SimulatedHub in the same process, without serial port.
+
+    The latency of the hub and the timeouts are slept on the clock of the hub, so with a VirtualClock the transactions
+    take no real time.
+
+    Args:
+        hub (SimulatedHub): The simulated pumps.
+
+        timeout (int): The timeout of communication, default set to DEFAULT_IO_TIMEOUT(1).
+
+    """
+    def __init__(self, hub, timeout=DEFAULT_IO_TIMEOUT):
+        self.hub = hub
+        self._replies = collections.deque()
+        super(VirtualPumpIO, self).__init__('virtual-{}'.format(id(hub)), timeout=timeout)
+
+    def _owe_reply(self, frame):
+        # Simulated pumps reply at once or never, there is no late reply to wait for
+        pass
+
+    def open(self, port, baudrate=None, timeout=DEFAULT_IO_TIMEOUT):
+        self.logger.debug("Opening virtual port '%s'", self.port)
+
+    def close(self):
+        self.logger.debug("Closing virtual port '%s'", self.port)
+
+    def flushInput(self):
+        self._replies.clear()
+        self._parser.clear()
+
+    def _read_pending(self):
+        return b''
+
+    def write(self, packet):
+        frame = packet.to_string()
+        self.logger.debug("Sending %s", frame)
+        reply = self.hub.handle_frame(frame)
+        if reply is not None:
+            self.hub.clock.sleep(self.hub.reply_delay(frame, reply))
+            self._parser.feed(reply)
+
+    def readline(self, timeout=None):
+        frame = self._parser.next_frame()
+        if frame is None:
+            self.hub.clock.sleep(self.timeout if timeout is None else timeout)
+            raise PumpIOTimeOutError
+        self.logger.debug("Received %s", frame)
+        return frame
+
+
+class VirtualMultiPumpController(MultiPumpController):
+    """
+    This class is a MultiPumpController whose pumps are simulated in process, on a virtual clock.
+
+    The controller sleeps on the virtual clock, so long protocols run in a fraction of their duration while
+    controller.clock.time() still tells when they would have ended on real pumps. The commands of the hubs are applied
+    in a single thread to follow the clock, see VirtualClock.
+
+    Args:
+        setup_config (Dict): The configuration of the setup, the ports of the hubs are ignored.
+
+        clock (VirtualClock): The clock, default set to a new VirtualClock starting at 0.
+
+        **hub_kwargs: Arguments of the SimulatedHub, e.g. latency.
+
+    """
+    def __init__(self, setup_config, clock=None, **hub_kwargs):
+        self.hub_kwargs = hub_kwargs
+        self.simulated_pumps = {}
+        super(VirtualMultiPumpController, self).__init__(setup_config, clock=clock if clock is not None else
+                                                         VirtualClock())
+
+    @property
+    def clock(self):
+        return self._clock
+
+    def _create_io(self, io_config):
+        hub = SimulatedHub(clock=self._clock, **self.hub_kwargs)
+        return VirtualPumpIO(hub, timeout=io_config.get('timeout', DEFAULT_IO_TIMEOUT))
+
+    def _create_pump(self, pump_io, pump_name, pump_config):
+        self.simulated_pumps[pump_name] = pump_io.hub.add_pump(C3000SwitchToAddress[pump_config['switch']])
+        return super(VirtualMultiPumpController, self)._create_pump(pump_io, pump_name, pump_config)
@@ -0,0 +1,241 @@
+"""
+.. module:: transport
+   :platform: Unix
+   :synopsis: A module providing the byte transports under PumpIO: serial ports and serial-over-TCP gateways.
+
+.. moduleauthor:: Jonathan Grizou <Jonathan.Grizou@gla.ac.uk>
+
+The transport is selected by the port of the io configuration:
+
+- "/dev/ttyUSB0", "COM3": a serial port.
+- "tcp://host:4001": a raw TCP connection to an Ethernet-to-serial device server, see TCPTransport.
+- "rfc2217://host:4001": a device server speaking RFC 2217 (Telnet COM port control), through pyserial.
+
+The transports share the interface of serial.Serial used by PumpIO: read(), write(), in_waiting, timeout,
+reset_input_buffer(), fileno() and close(). The response frames are extracted from the byte stream by
+dtprotocol.DTFrameParser, whatever the line endings added or dropped by the gateways.
+
+"""
+# -*- coding: utf-8 -*-
+
+import select
+import socket
+
+import serial
+
+from ._logger import create_logger
+
+#: Prefix of the ports reached through a raw TCP connection
+TCP_PREFIX = 'tcp://'
+#: Prefix of the ports reached through RFC 2217
+RFC2217_PREFIX = 'rfc2217://'
+#: Timeout (in seconds) of the TCP connection to a device server
+TCP_CONNECT_TIMEOUT = 5
+
+
+def open_transport(port, baudrate, timeout):
+    """
+    Opens the transport of a port.
+
+    Args:
+        port (str): The port, e.g. '/dev/ttyUSB0', 'tcp://192.168.0.10:4001' or 'rfc2217://192.168.0.10:4001'.
+
+        baudrate (int): The baudrate of the communication, set on the device server with RFC 2217 only.
+
+        timeout (float): The timeout of the reads, 0 for non-blocking reads.
+
+    Returns:
+        The transport: TCPTransport, or a serial.Serial.
+
+    """
+    if port.startswith(TCP_PREFIX):
+        (host, tcp_port) = split_address(port[len(TCP_PREFIX):])
+        return TCPTransport(host, tcp_port, timeout)
+    elif port.startswith(RFC2217_PREFIX):
+        return serial.serial_for_url(port, baudrate, timeout=timeout)
+    return serial.Serial(port, baudrate, timeout=timeout)
+
+
+def split_address(address):
+    """
+    Splits a network address.
+
+    Args:
+        address (str): The address, 'host:port'.
+
+    Returns:
+        (host, port) (tuple): The host (str) and the port (int).
+
+    Raises:
+        ValueError: The address has no port.
+
+    """
+    (host, separator, port) = address.rpartition(':')
+    if not separator or not port.isdigit():
+        raise ValueError('Address {} has no port'.format(address))
+    return host.strip('[]'), int(port)
+
+
+class TCPTransport(object):
+    """
+    This class reaches a hub through an Ethernet-to-serial device server in raw TCP mode.
+
+    Nagle's algorithm is disabled (TCP_NODELAY) so each packet leaves at once, and the connection is kept open. When
+    the device server closes it, the reads fail at once with ConnectionError, and the next write connects again and
+    writes the packet once more.
+
+    Args:
+        host (str): The host of the device server.
+
+        port (int): The TCP port of the device server.
+
+        timeout (float): The timeout of the reads, default set to None to block, 0 for non-blocking reads.
+
+        connect_timeout (float): The timeout of the connection, default set to TCP_CONNECT_TIMEOUT (5).
+
+    """
+    def __init__(self, host, port, timeout=None, connect_timeout=TCP_CONNECT_TIMEOUT):
+        self.logger = create_logger(self.__class__.__name__)
+
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.reconnections = 0
+        self._timeout = timeout
+        self._socket = None
+
+        self.connect()
+
+    @property
+    def is_open(self):
+        return self._socket is not None
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self._timeout = timeout
+        if self._socket is not None:
+            self._socket.settimeout(timeout)
+
+    def connect(self):
+        """
+        Connects to the device server.
+        """
+        sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.settimeout(self._timeout)
+        self._socket = sock
+        self.logger.debug("Connected to %s:%s", self.host, self.port)
+
+    def _disconnect(self):
+        if self._socket is not None:
+            self.logger.debug("Disconnected from %s:%s", self.host, self.port)
+            self._socket.close()
+            self._socket = None
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self._disconnect()
+
+    def fileno(self):
+        """
+        Gets the file descriptor of the connection, e.g. to wait for it with selectors.
+
+        Returns:
+            fd (int): The file descriptor.
+
+        Raises:
+            AttributeError: The transport is not connected.
+
+        """
+        return self._socket.fileno()
+
+    def write(self, data):
+        """
+        Writes bytes, connecting again if the connection was lost.
+
+        Args:
+            data (bytes): The bytes.
+
+        Returns:
+            size (int): The number of bytes written.
+
+        Raises:
+            OSError: The device server cannot be reached, e.g. ConnectionRefusedError while it is down. The transport
+                is then disconnected and the next write tries to connect again.
+
+        """
+        for attempt in range(2):
+            try:
+                if self._socket is None:
+                    self.connect()
+                    self.reconnections += 1
+                self._socket.sendall(data)
+                return len(data)
+            except OSError as err:
+                self.logger.debug("Write to %s:%s failed: %s", self.host, self.port, err)
+                self._disconnect()
+                if attempt:
+                    raise
+
+    def read(self, size=1):
+        """
+        Reads up to size bytes, waiting at most timeout for the first one.
+
+        Args:
+            size (int): The maximum number of bytes.
+
+        Returns:
+            data (bytes): The bytes read, empty on timeout or if the connection is lost.
+
+        Raises:
+            ConnectionError: The connection was lost before the call, the next write connects again.
+
+        """
+        if self._socket is None:
+            raise ConnectionError('Not connected to {}:{}'.format(self.host, self.port))
+        try:
+            data = self._socket.recv(size)
+        except (socket.timeout, BlockingIOError):
+            return b''
+        except OSError as err:
+            self.logger.debug("Read from %s:%s failed: %s", self.host, self.port, err)
+            self._disconnect()
+            return b''
+        if not data:
+            self._disconnect()  # Closed by the device server
+        return data
+
+    @property
+    def in_waiting(self):
+        """
+        Number of bytes received and not read yet.
+        """
+        if self._socket is None:
+            return 0
+        (readable, _, _) = select.select([self._socket], [], [], 0)
+        if not readable:
+            return 0
+        try:
+            waiting = len(self._socket.recv(4096, socket.MSG_PEEK | socket.MSG_DONTWAIT))
+        except BlockingIOError:
+            return 0
+        except OSError:
+            self._disconnect()
+            return 0
+        if not waiting:
+            self._disconnect()
+        return waiting
+
+    def reset_input_buffer(self):
+        """
+        Discards the bytes received and not read yet.
+        """
+        while self.in_waiting:
+            self._socket.recv(4096)
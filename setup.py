@@ -7,4 +7,5 @@ setup(name="pycont",
       author="Jonathan Grizou",
       author_email='jonathan.grizou@glasgow.ac.uk',
       packages=find_packages(),
+      install_requires=['pyserial'],
       )
@@ -0,0 +1,45 @@
+import os
+import copy
+import json
+
+import pytest
+
+import pycont.sim
+from pycont import pump_protocol
+from pycont.sim import VirtualMultiPumpController
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Scripts driving real pumps, run by hand against the hardware
+collect_ignore = ['pycont_test.py', 'pycont_6way_test.py', 'pycont_test_multihub.py', 'quick_cable_test.py']
+
+with open(os.path.join(HERE, 'pump_multihub_config.json')) as f:
+    MULTIHUB_CONFIG = json.load(f)
+
+
+@pytest.fixture
+def multihub_config():
+    """
+    The multihub configuration: acetone, water and oil1 on the first hub, oil2 to oil4 on the second.
+    """
+    return copy.deepcopy(MULTIHUB_CONFIG)
+
+
+@pytest.fixture
+def controller(multihub_config):
+    """
+    A VirtualMultiPumpController of the multihub configuration, initialized.
+    """
+    controller = VirtualMultiPumpController(multihub_config, latency=0.002, baudrate=38400)
+    controller.smart_initialize()
+    return controller
+
+
+@pytest.fixture
+def fast_simulation(monkeypatch):
+    """
+    Shortens the initializations and valve moves of the simulated pumps, for the tests running on the real clock.
+    """
+    monkeypatch.setattr(pycont.sim, 'SIM_VALVE_INITIALIZE_DURATION', 0.02)
+    monkeypatch.setattr(pycont.sim, 'SIM_PLUNGER_INITIALIZE_DURATION', 0.02)
+    monkeypatch.setattr(pump_protocol, 'VALVE_MOVE_DURATION', 0.02)
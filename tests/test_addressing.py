@@ -0,0 +1,67 @@
+from pycont.controller import C3000Broadcast, C3000Controller, MultiPumpController, dual_group_address, \
+    quad_group_address
+from pycont.sim import SimulatedSetup, VirtualMultiPumpController
+
+
+def addresses(addressing):
+    return [(controller.address, sorted(pump_names)) for (controller, pump_names) in addressing]
+
+
+def test_group_addresses():
+    assert [dual_group_address(address) for address in '1234'] == ['A', 'A', 'C', 'C']
+    assert [quad_group_address(address) for address in '14589'] == ['Q', 'Q', 'U', 'U', 'Y']
+
+
+def test_broadcast_whole_hub(controller):
+    addressing = controller.get_addressing(list(controller.pumps))
+    assert addresses(addressing) == [(C3000Broadcast, ['acetone', 'oil1', 'water']),
+                                     (C3000Broadcast, ['oil2', 'oil3', 'oil4'])]
+
+
+def test_dual_group(controller):
+    assert addresses(controller.get_addressing(['water', 'acetone'])) == [('A', ['acetone', 'water'])]
+    assert addresses(controller.get_addressing(['water', 'oil1'])) == [('2', ['water']), ('3', ['oil1'])]
+
+
+def test_individual_pump(controller):
+    (pump_controller, pump_names), = controller.get_addressing(['oil3'])
+    assert pump_controller is controller.pumps['oil3']
+    assert isinstance(pump_controller, C3000Controller)
+
+
+def test_group_commands_reach_pumps(multihub_config):
+    multihub_config['hardware_groups'] = True
+    controller = VirtualMultiPumpController(multihub_config, latency=0.002, baudrate=38400)
+    controller.smart_initialize()
+    controller.apply_command_to_group('solvents', 'pump', 2, 'I', wait=True)
+    assert [controller.pumps[pump_name].get_plunger_position() for pump_name in ('water', 'acetone', 'oil1')] == \
+        [controller.pumps['water'].volume_to_step(2)] * 2 + [0]
+
+
+def test_shared_port_individual_addressing(multihub_config):
+    with SimulatedSetup(multihub_config, latency=0.002) as setup:
+        controller = MultiPumpController(setup.config)
+        other_controller = MultiPumpController(setup.config)
+        try:
+            # The broadcast would also reach the pumps of the other controller
+            assert addresses(controller.get_addressing(list(controller.pumps))) == \
+                [(pump.address, [pump_name]) for (pump_name, pump) in controller.pumps.items()]
+        finally:
+            other_controller.close()
+        try:
+            assert [address for (address, _) in addresses(controller.get_addressing(list(controller.pumps)))] == \
+                [C3000Broadcast] * 2
+        finally:
+            controller.close()
+
+
+def test_group_top_velocity(multihub_config):
+    multihub_config['hardware_groups'] = True
+    controller = VirtualMultiPumpController(multihub_config, latency=0.002, baudrate=38400)
+    controller.smart_initialize()
+    # A float velocity is sent as an integer operand, as by C3000CommandSequence.velocity()
+    assert controller.apply_command_to_group('solvents', 'set_top_velocity', 3000.0, secure=False)
+    assert [controller.pumps[pump_name].shadow.top_velocity for pump_name in ('water', 'acetone')] == [3000] * 2
+    assert controller.apply_command_to_group('solvents', 'set_top_velocity', 4000.0)
+    assert [controller.pumps[pump_name].get_top_velocity() for pump_name in ('water', 'acetone', 'oil1')] == \
+        [4000, 4000, 6000]
@@ -0,0 +1,149 @@
+import asyncio
+import functools
+
+import pytest
+
+from pycont.aio import AsyncPumpIO, AsyncMultiPumpController
+from pycont.clock import DEFAULT_CLOCK
+from pycont.controller import PumpIOTimeOutError
+from pycont.pump_protocol import C3000Protocol
+from pycont.sim import SimulatedSetup
+
+
+@pytest.fixture
+def setup(multihub_config, fast_simulation):
+    setup = SimulatedSetup(multihub_config, latency=0.002)
+    yield setup
+    setup.close()
+
+
+def test_async_pump_io(setup):
+    pump_io = AsyncPumpIO(setup.config['hubs'][0]['io']['port'], timeout=0.2)
+
+    async def main():
+        response = await pump_io.write_and_readline(C3000Protocol('1').forge_report_plunger_position_packet())
+        with pytest.raises(PumpIOTimeOutError):
+            await pump_io.write_and_readline(C3000Protocol('9').forge_report_status_packet(), timeout=0.05)
+        return response
+
+    try:
+        assert asyncio.run(main()).endswith(b'0\x03')
+    finally:
+        pump_io.close()
+
+
+def test_async_controller(setup):
+    controller = AsyncMultiPumpController(setup.config)
+
+    async def main():
+        await controller.smart_initialize()
+        assert await controller.are_pumps_initialized()
+
+        water = controller.pumps['water']
+        await water.pump(0.5, from_valve='I', wait=True)
+        assert await water.current_volume == pytest.approx(0.5)
+        assert await water.get_valve_position() == 'I'
+
+        # The pumps of both hubs move at once, from a single thread
+        await controller.pump(['acetone', 'oil2'], 0.2, from_valve='I')
+        assert not await controller.are_pumps_idle()
+        await controller.wait_until_pumps_idle(['acetone', 'oil2'])
+        volumes = await controller.apply_command_to_pumps(['acetone', 'oil2'], 'get_volume')
+        assert volumes == {'acetone': pytest.approx(0.2), 'oil2': pytest.approx(0.2)}
+
+    try:
+        asyncio.run(main())
+    finally:
+        controller.close()
+
+
+async def _hub_pump_names(pump_names):
+    return list(pump_names)
+
+
+def test_async_hardware_groups(multihub_config, fast_simulation):
+    multihub_config['hardware_groups'] = True
+    with SimulatedSetup(multihub_config, latency=0.002) as setup:
+        controller = AsyncMultiPumpController(setup.config)
+
+        async def main():
+            await controller.smart_initialize()
+            assert await controller.are_pumps_initialized()
+
+            pumped = await controller.apply_command_to_pumps_at_once(['water', 'acetone', 'oil2'], 'pump', 0.2,
+                                                                      from_valve='I', wait=True)
+            assert pumped == {'water': True, 'acetone': True, 'oil2': True}
+            volumes = await controller.apply_command_to_pumps(['water', 'acetone', 'oil2'], 'get_volume')
+            assert all(volume == pytest.approx(0.2) for volume in volumes.values())
+
+            returns = await controller.run_on_hubs(['oil2', 'water', 'acetone'], _hub_pump_names)
+            assert returns == [['oil2'], ['water', 'acetone']]
+
+            await controller.terminate_all_pumps()
+
+        try:
+            asyncio.run(main())
+        finally:
+            controller.close()
+
+
+def test_async_transfers(setup):
+    setup.config['hubs'][0]['pumps']['water']['volume'] = 0.5
+    controller = AsyncMultiPumpController(setup.config)
+
+    async def main():
+        await controller.smart_initialize()
+
+        # The strokes are planned once, from the room left in the syringe of water
+        await controller.pumps['water'].pump(0.4, from_valve='I', speed_in=48000, wait=True)
+        progress = []
+        await controller.transfer(['water', 'acetone'], 0.2, from_valve='I', to_valve='O', speed_in=48000,
+                                  speed_out=48000, progress=progress.append)
+        assert [stroke.volume_transferred for stroke in progress] == [pytest.approx(0.1), pytest.approx(0.2)]
+        volumes = await controller.apply_command_to_pumps(['water', 'acetone'], 'get_volume')
+        assert volumes == {'water': pytest.approx(0.4), 'acetone': pytest.approx(0)}
+
+        await controller.parallel_transfer({'oil1': 0.1, 'oil2': 0.2}, from_valve='I', to_valve='O', wait=True)
+        await controller.parallel_transfer({'oil1': 0.1, 'oil2': 0.2}, from_valve='I', to_valve='O', wait=True,
+                                           sync=True)
+        assert await controller.are_pumps_idle()
+        with pytest.raises(ValueError):
+            await controller.run_pipelines({'oil1': [functools.partial(controller.pumps['oil1'].pump, 10, 'I')]})
+        assert await controller.pumps['water'].idle_operation() is True
+
+    try:
+        asyncio.run(main())
+    finally:
+        controller.close()
+
+
+def test_async_predictive_wait(setup):
+    controller = AsyncMultiPumpController(setup.config)
+    water = controller.pumps['water']
+    polls = []
+
+    async def main():
+        await controller.smart_initialize()
+        is_busy = water.is_busy
+
+        async def poll():
+            polls.append(DEFAULT_CLOCK.time())
+            return await is_busy()
+        water.is_busy = poll
+
+        start = DEFAULT_CLOCK.time()
+        await water.pump(1, from_valve='I')
+        duration = water.estimated_completion_time() - start
+        operation = water.idle_operation()
+        assert not operation.done()
+        assert await operation is True
+        return start, duration
+
+    try:
+        (start, duration) = asyncio.run(main())
+    finally:
+        controller.close()
+    # The pump is polled around the predicted end of its move only, not every WAIT_SLEEP_TIME
+    assert duration > 1
+    assert polls[0] - start > duration - 0.1
+    assert len(polls) < duration / 0.1 / 2
@@ -0,0 +1,109 @@
+import pytest
+
+from pycont.controller import C3000Broadcast, C3000Controller, C3000GroupController, MultiPumpController
+from pycont.pump_protocol import VALVE_MOVE_DURATION
+from pycont.sim import SimulatedSetup, VirtualMultiPumpController
+
+
+@pytest.fixture
+def triggers(monkeypatch):
+    """
+    The addresses the execute packets are sent to, in order.
+    """
+    triggers = []
+    for cls in (C3000Controller, C3000GroupController):
+        def fire(self, _fire=cls.fire):
+            triggers.append(self.address)
+            return _fire(self)
+        monkeypatch.setattr(cls, 'fire', fire)
+    return triggers
+
+
+@pytest.fixture
+def group_controller(multihub_config):
+    multihub_config['hardware_groups'] = True
+    controller = VirtualMultiPumpController(multihub_config, latency=0.002, baudrate=38400)
+    controller.smart_initialize()
+    return controller
+
+
+def arm(controller, volumes):
+    sequences = {pump_name: controller.pumps[pump_name].sequence().velocity(6000).valve('O').pump(volume)
+                 for pump_name, volume in volumes.items()}
+    assert controller.arm(sequences) == {pump_name: True for pump_name in volumes}
+
+
+def test_fire_group_address(group_controller, triggers):
+    arm(group_controller, {'water': 1, 'acetone': 2})
+    start_times = group_controller.fire()
+    assert triggers == ['A']
+    # A single packet starts both pumps
+    assert start_times['water'] == start_times['acetone']
+
+
+def test_fire_broadcast(group_controller, triggers):
+    arm(group_controller, {'water': 1, 'oil1': 1, 'oil2': 1})
+    start_times = group_controller.fire()
+    # No group address reaches exactly water and oil1, acetone is not armed and ignores the broadcast
+    assert triggers == [C3000Broadcast, C3000Broadcast]
+    assert start_times['water'] == start_times['oil1']
+    assert group_controller.pumps['acetone'].is_idle()
+
+
+def test_fire_other_armed_pumps(group_controller, triggers):
+    arm(group_controller, {'water': 1, 'oil1': 1, 'acetone': 1})
+    start_times = group_controller.fire(['water', 'oil1'])
+    # The broadcast would also start acetone
+    assert triggers == ['2', '3']
+    assert start_times['oil1'] > start_times['water']
+    assert group_controller.pumps['acetone'].is_armed() and group_controller.pumps['acetone'].is_idle()
+    assert list(group_controller.fire()) == ['acetone']
+
+
+def test_fire_without_hardware_groups(controller, triggers):
+    arm(controller, {'water': 1, 'acetone': 2})
+    start_times = controller.fire()
+    assert triggers == ['1', '2']
+    # One trigger per pump, the skew is the time taken by the first one
+    assert 0 < start_times['water'] - start_times['acetone'] < 0.05
+
+
+def test_fire_shared_port(multihub_config, fast_simulation, triggers):
+    multihub_config['hardware_groups'] = True
+    with SimulatedSetup(multihub_config, latency=0.002) as setup:
+        controller = MultiPumpController(setup.config)
+        other_controller = MultiPumpController(setup.config)
+        try:
+            controller.smart_initialize()
+            arm(controller, {'water': 0.1, 'acetone': 0.1})
+            controller.fire()
+            # The pumps of the other controller could have a sequence loaded
+            assert sorted(triggers) == ['1', '2']
+            controller.wait_until_pumps_idle(['water', 'acetone'])
+        finally:
+            other_controller.close()
+            controller.close()
+
+
+def test_fire_tracking(group_controller):
+    water = group_controller.pumps['water']
+    # Reads the state of water, the sequence is then estimated from it
+    assert (water.get_plunger_position(), water.get_valve_position()) == (0, 'I')
+    arm(group_controller, {'water': 1, 'acetone': 2})
+    assert water.estimated_completion_time() is None
+
+    start_times = group_controller.fire()
+    assert not water.is_armed()
+    # The shadow state and the predicted end follow the sequence started
+    assert water.shadow.valve_position == 'O'
+    assert water.shadow.plunger_position == water.volume_to_step(1)
+    completion_time = water.estimated_completion_time()
+    assert completion_time == pytest.approx(
+        start_times['water'] + VALVE_MOVE_DURATION + water.estimate_move_duration(water.volume_to_step(1), 6000))
+
+    completion_times = group_controller.wait_until_pumps_idle(['water', 'acetone'])
+    assert completion_time <= completion_times['water'] < completion_time + 0.1
+    assert completion_times['water'] < completion_times['acetone']
+    for pump_name, volume in (('water', 1), ('acetone', 2)):
+        simulated_pump = group_controller.simulated_pumps[pump_name]
+        assert simulated_pump.plunger_position == group_controller.pumps[pump_name].volume_to_step(volume)
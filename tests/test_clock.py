@@ -0,0 +1,44 @@
+import pytest
+
+from pycont.clock import VirtualClock
+from pycont.operation import get_poller
+from pycont.sim import VirtualMultiPumpController
+
+
+def run_operations(multihub_config):
+    controller = VirtualMultiPumpController(multihub_config, latency=0.002)
+    controller.smart_initialize()
+    start = controller.clock.time()
+    operation = controller.pump(['water', 'oil2'], 1, 'I', operation=True)
+    assert operation.result() == [True, True]
+    return controller.clock.time() - start
+
+
+def test_virtual_clock_runs_hubs_in_a_single_thread(controller):
+    assert isinstance(controller.clock, VirtualClock)
+    assert not controller.concurrent_hubs
+
+
+def test_virtual_makespan_is_the_longest_hub(controller):
+    start = controller.clock.time()
+    controller.pump(['water'], 1, 'I', wait=True)
+    single = controller.clock.time() - start
+
+    start = controller.clock.time()
+    controller.pump(['acetone', 'oil2', 'oil3'], 1, 'I', wait=True)
+    assert controller.clock.time() - start == pytest.approx(single, rel=0.2)
+
+
+def test_virtual_operations_are_deterministic(multihub_config):
+    durations = [run_operations(multihub_config) for _ in range(3)]
+    assert durations[0] > 0
+    assert durations == [durations[0]] * 3
+
+
+def test_virtual_poller_has_no_thread(controller):
+    poller = get_poller(controller.clock)
+    assert controller.pumps['water']._poller is poller
+    operation = controller.pumps['water'].pump(1, 'I', operation=True)
+    assert poller._thread is None
+    assert operation.result() is True
+    assert controller.pumps['water'].current_volume == pytest.approx(1)
@@ -0,0 +1,63 @@
+import pytest
+
+from pycont.clock import VirtualClock
+from pycont.controller import PumpIODispatcher, PumpIOTimeOutError, DISPATCHER_PRIORITY_HIGH
+from pycont.pump_protocol import C3000Protocol
+from pycont.sim import SimulatedHub, VirtualPumpIO
+
+
+@pytest.fixture
+def hub():
+    return SimulatedHub(['1', '2'], latency=0.002, clock=VirtualClock())
+
+
+@pytest.fixture
+def dispatcher(hub):
+    dispatcher = PumpIODispatcher(VirtualPumpIO(hub))
+    yield dispatcher
+    dispatcher.close()
+
+
+def test_dispatcher_answers(dispatcher):
+    response = dispatcher.write_and_readline(C3000Protocol('1').forge_report_plunger_position_packet())
+    assert response.endswith(b'0\x03')
+
+
+def test_dispatcher_coalesces_report_queries(hub, dispatcher):
+    protocol = C3000Protocol('1')
+    query = protocol.forge_report_status_packet()
+
+    # The dispatcher thread is held on the I/O lock by the first request, the queries queue up behind it
+    with dispatcher._io.lock:
+        command = dispatcher.submit(protocol.forge_terminate_packet())
+        first = dispatcher.submit(query)
+        second = dispatcher.submit(query)
+        other = dispatcher.submit(C3000Protocol('2').forge_report_status_packet())
+
+    assert first.result() == second.result()
+    assert command.result() and other.result()
+    assert hub.transactions == 3
+
+
+def test_dispatcher_priority(hub, dispatcher):
+    order = []
+    protocol = C3000Protocol('1')
+
+    with dispatcher._io.lock:
+        blocking = dispatcher.submit(protocol.forge_terminate_packet())
+        normal = dispatcher.submit(protocol.forge_report_plunger_position_packet())
+        urgent = dispatcher.submit(protocol.forge_report_status_packet(), priority=DISPATCHER_PRIORITY_HIGH)
+        normal.add_done_callback(lambda future: order.append('normal'))
+        urgent.add_done_callback(lambda future: order.append('urgent'))
+
+    blocking.result()
+    normal.result()
+    assert order == ['urgent', 'normal']
+
+
+def test_dispatcher_timeout(hub, dispatcher):
+    future = dispatcher.submit(C3000Protocol('3').forge_report_status_packet(), timeout=0.1)
+    with pytest.raises(PumpIOTimeOutError):
+        future.result()
+    # The dispatcher goes on with the next requests
+    assert dispatcher.write_and_readline(C3000Protocol('1').forge_report_status_packet())
@@ -0,0 +1,78 @@
+from pycont import dtprotocol
+from pycont import pump_protocol
+
+
+def read_frames(parser):
+    frames = []
+    frame = parser.next_frame()
+    while frame is not None:
+        frames.append(frame)
+        frame = parser.next_frame()
+    return frames
+
+
+def test_parser_drops_line_endings():
+    parser = dtprotocol.DTFrameParser()
+    parser.feed(b'/0`3000\x03\r\n')
+    assert read_frames(parser) == [b'/0`3000\x03']
+    assert len(parser) == 0
+
+
+def test_parser_joins_fragments():
+    parser = dtprotocol.DTFrameParser()
+    for fragment in (b'/', b'0', b'`30', b'00', b'\x03'):
+        assert parser.next_frame() is None
+        parser.feed(fragment)
+    assert read_frames(parser) == [b'/0`3000\x03']
+
+
+def test_parser_splits_concatenated_frames():
+    parser = dtprotocol.DTFrameParser()
+    parser.feed(b'/0`\x03\r\n/0@\x03/0`14400\x03')
+    assert read_frames(parser) == [b'/0`\x03', b'/0@\x03', b'/0`14400\x03']
+
+
+def test_parser_discards_interrupted_frame():
+    parser = dtprotocol.DTFrameParser()
+    parser.feed(b'noise/0`30/0@\x03')
+    assert read_frames(parser) == [b'/0@\x03']
+
+
+def test_parser_keeps_trailing_start():
+    parser = dtprotocol.DTFrameParser()
+    parser.feed(b'\xff\r\n/')
+    assert parser.next_frame() is None
+    assert len(parser) == 1
+    parser.feed(b'0`\x03')
+    assert read_frames(parser) == [b'/0`\x03']
+
+
+def test_parser_clear():
+    parser = dtprotocol.DTFrameParser()
+    parser.feed(b'/0`30')
+    parser.clear()
+    parser.feed(b'00\x03')
+    assert parser.next_frame() is None
+
+
+def test_status_decode():
+    assert dtprotocol.DTStatus(b'/0`3000\x03\r\n').decode() == ('0', '`', '3000')
+    assert dtprotocol.DTStatus(b'/1QR\r').decode() is None
+
+
+def test_frame_cache():
+    protocol = pump_protocol.C3000Protocol('1')
+    frame = protocol.forge_frame(pump_protocol.CMD_REPORT_STATUS)
+    assert frame is protocol.forge_frame(pump_protocol.CMD_REPORT_STATUS)
+    assert isinstance(frame, dtprotocol.DTFrame)
+    assert frame.to_string() == b'/1QR\r'
+    assert protocol.forge_frame(pump_protocol.CMD_REPORT_STATUS, execute=False) == b'/1Q\r'
+
+
+def test_operand_frame_matches_packet():
+    protocol = pump_protocol.C3000Protocol('2')
+    for value in (0, 7, 3000):
+        packet = protocol.forge_packet(dtprotocol.DTCommand(pump_protocol.CMD_PUMP, str(value)))
+        frame = protocol.forge_operand_frame(pump_protocol.CMD_PUMP, value)
+        assert frame == packet.to_string()
+        assert frame.to_array() == packet.to_array()
@@ -0,0 +1,43 @@
+import pytest
+
+from pycont.aio import AsyncMultiPumpController
+from pycont.flow import ContinuousFlow
+from pycont.sim import SimulatedSetup
+
+
+def test_flow_rate(controller):
+    flow = ContinuousFlow(controller, 'solvents', flow_rate=5, from_valve='I', to_valve='O')
+    assert [plan.pump.name for plan in flow.plans] == ['water', 'acetone']
+    assert all(plan.flow_rate == pytest.approx(5, rel=0.01) for plan in flow.plans)
+
+    flow.run(duration=600)
+    assert flow.strokes >= 10
+    assert flow.volume_delivered == pytest.approx(5 * flow.strokes)
+    assert flow.achieved_flow_rate() == pytest.approx(5, rel=0.01)
+    assert abs(flow.mean_gap()) < 0.1
+    assert all(pump.is_armed() for pump in (plan.pump for plan in flow.plans))
+
+
+def test_flow_resume(controller):
+    flow = ContinuousFlow(controller, ['water', 'acetone'], flow_rate=10, from_valve='I', to_valve='O')
+    flow.run(volume_in_ml=10)
+    assert flow.volume_delivered == pytest.approx(10)
+    flow.run(volume_in_ml=15, prime=False)
+    assert flow.volume_delivered == pytest.approx(15)
+    assert flow.achieved_flow_rate() == pytest.approx(10, rel=0.01)
+
+
+def test_flow_rejected(controller):
+    with pytest.raises(ValueError):
+        ContinuousFlow(controller, ['water'], flow_rate=5, from_valve='I', to_valve='O')
+    with pytest.raises(ValueError):
+        ContinuousFlow(controller, 'solvents', flow_rate=500, from_valve='I', to_valve='O')
+    with pytest.raises(ValueError):
+        ContinuousFlow(controller, 'solvents', flow_rate=100, from_valve='I', to_valve='O', refill_speed=200)
+
+
+def test_flow_rejects_async_controller(multihub_config):
+    with SimulatedSetup(multihub_config) as setup:
+        with AsyncMultiPumpController(setup.config) as controller:
+            with pytest.raises(TypeError):
+                ContinuousFlow(controller, 'solvents', flow_rate=5, from_valve='I', to_valve='O')
@@ -0,0 +1,66 @@
+import time
+import threading
+
+import pytest
+
+from pycont.controller import MultiPumpController
+from pycont.sim import SimulatedSetup
+
+
+@pytest.fixture
+def controller(multihub_config):
+    setup = SimulatedSetup(multihub_config, latency=0.05)
+    controller = MultiPumpController(setup.config)
+    yield controller
+    controller.close()
+    setup.close()
+
+
+def test_hubs_run_concurrently(controller):
+    pump_names = list(controller.pumps)
+    start = time.monotonic()
+    positions = controller.apply_command_to_pumps(pump_names, 'get_plunger_position')
+    elapsed = time.monotonic() - start
+
+    assert set(positions) == set(pump_names)
+    # Three transactions per hub, the two hubs at once
+    assert elapsed < 5 * 0.05
+
+
+def test_run_on_hubs_order_and_errors(controller):
+    def get_names(hub_pump_names):
+        return hub_pump_names
+    assert controller.run_on_hubs(['oil2', 'water', 'acetone'], get_names) == [['oil2'], ['water', 'acetone']]
+
+    def fail_on_second_hub(hub_pump_names):
+        if 'oil2' in hub_pump_names:
+            raise ValueError(hub_pump_names)
+        return hub_pump_names
+    with pytest.raises(ValueError):
+        controller.run_on_hubs(['water', 'oil2'], fail_on_second_hub)
+
+
+def test_nested_run_on_hubs(controller):
+    def nested(hub_pump_names):
+        # Called from the worker thread of the hub, the hub is not waited for by its own worker
+        return controller.apply_command_to_pumps(['water', 'oil2'] if 'water' in hub_pump_names else hub_pump_names,
+                                                 'get_plunger_position')
+
+    returns = []
+    thread = threading.Thread(target=lambda: returns.append(controller.run_on_hubs(['water', 'oil2'], nested)))
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert returns == [[{'water': 0, 'oil2': 0}, {'oil2': 0}]]
+
+
+def test_hub_executors_created_once(controller):
+    hub = controller.pumps['water']._io
+    executors = []
+    threads = [threading.Thread(target=lambda: executors.append(controller._get_hub_executor(hub)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(map(id, executors))) == 1
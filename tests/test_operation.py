@@ -0,0 +1,105 @@
+import concurrent.futures
+
+import pytest
+
+from pycont.controller import MultiPumpController, PumpHWError
+from pycont.operation import PumpOperation, all_of, any_of, next_poll_time
+from pycont.sim import SimulatedSetup, ERROR_PLUNGER_OVERLOAD
+
+
+@pytest.fixture
+def controller(multihub_config, fast_simulation):
+    setup = SimulatedSetup(multihub_config, latency=0.002)
+    controller = MultiPumpController(setup.config)
+    controller.smart_initialize()
+    controller.simulated_pumps = setup.pumps
+    yield controller
+    controller.close()
+    setup.close()
+
+
+def test_operation_completes_when_idle(controller):
+    pump = controller.pumps['water']
+    operation = pump.pump(0.2, 'I', operation=True)
+    assert isinstance(operation, PumpOperation)
+    assert operation.result(timeout=5) is True
+    assert not controller.simulated_pumps['water'].is_busy()
+    assert pump.current_volume == pytest.approx(0.2)
+
+
+def test_refused_operation(controller):
+    pump = controller.pumps['water']
+    operation = pump.deliver(1, 'O', operation=True)
+    assert operation.done() and operation.result() is False
+
+
+def test_cancel_terminates_the_pump(controller):
+    pump = controller.pumps['water']
+    pump.set_top_velocity(50)
+    operation = pump.pump(pump.total_volume, 'I', operation=True)
+    assert controller.simulated_pumps['water'].is_busy()
+
+    assert operation.cancel()
+    assert operation.cancelled()
+    assert not controller.simulated_pumps['water'].is_busy()
+
+
+def test_all_of(controller):
+    operation = controller.pump(['water', 'oil2'], 0.2, 'I', operation=True)
+    assert operation.result(timeout=5) == [True, True]
+    assert controller.pumps['oil2'].current_volume == pytest.approx(0.2)
+    assert all_of().result() == []
+
+
+def test_all_of_cancelled_child_leaves_the_others_running(controller):
+    for pump_name in ('water', 'oil2'):
+        controller.pumps[pump_name].set_top_velocity(50)
+    water = controller.pumps['water'].pump(1, 'I', operation=True)
+    oil2 = controller.pumps['oil2'].pump(1, 'I', operation=True)
+    combined = all_of(water, oil2)
+
+    water.cancel()
+    assert combined.cancelled()
+    assert not oil2.done()
+    assert controller.simulated_pumps['oil2'].is_busy()
+    assert not controller.simulated_pumps['water'].is_busy()
+    oil2.cancel()
+
+
+def test_any_of(controller):
+    controller.pumps['oil2'].set_top_velocity(50)
+    slow = controller.pumps['oil2'].pump(1, 'I', operation=True)
+    fast = controller.pumps['water'].pump(0.1, 'I', operation=True)
+    assert any_of(slow, fast).result(timeout=5) is fast
+    assert not slow.done()
+    slow.cancel()
+
+
+def test_operation_raises_hardware_errors(controller):
+    pump = controller.pumps['water']
+    pump.set_top_velocity(50)
+    operation = pump.pump(0.2, 'I', operation=True)
+    controller.simulated_pumps['water'].inject_error(ERROR_PLUNGER_OVERLOAD)
+    with pytest.raises(PumpHWError):
+        operation.result(timeout=5)
+
+
+def test_next_poll_time(controller):
+    pump = controller.pumps['water']
+    pump.set_top_velocity(50)
+    pump.pump(1, 'I')
+    completion_time = pump.estimated_completion_time()
+    now = controller._clock.time()
+
+    # Not polled before the predicted end, then more and more often
+    assert next_poll_time(pump, now) == pytest.approx(completion_time - 0.05)
+    assert next_poll_time(pump, completion_time, busy=True) == pytest.approx(completion_time + 0.01)
+    assert next_poll_time(pump, completion_time + 1, busy=True) == pytest.approx(completion_time + 1.1)
+    pump.terminate()
+
+
+def test_cancelled_operation_result(controller):
+    operation = controller.pumps['water'].pump(0.1, 'I', operation=True)
+    operation.cancel()
+    with pytest.raises(concurrent.futures.CancelledError):
+        operation.result()
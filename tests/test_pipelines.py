@@ -0,0 +1,82 @@
+import functools
+
+import pytest
+
+from pycont.sim import VirtualMultiPumpController
+
+
+def strokes(pump, volume_in_ml, count):
+    return [functools.partial(pump.pump, volume_in_ml, 'I'), functools.partial(pump.deliver, volume_in_ml, 'O')] * count
+
+
+def test_pumps_run_their_moves_independently(controller):
+    (water, oil2) = (controller.pumps['water'], controller.pumps['oil2'])
+
+    start = controller.clock.time()
+    alone = controller.run_pipelines({'water': strokes(water, 4, 1)})['water'] - start
+
+    start = controller.clock.time()
+    completion_times = controller.run_pipelines({'water': strokes(water, 4, 1), 'oil2': strokes(oil2, 0.5, 2)})
+    # The small strokes of oil2 do not wait for the long strokes of water
+    assert completion_times['oil2'] < completion_times['water']
+    assert completion_times['water'] - start == pytest.approx(alone, rel=0.1)
+    assert oil2.get_plunger_position() == 0 and oil2.get_valve_position() == 'O'
+
+
+def test_pipelines_without_wait(controller):
+    water = controller.pumps['water']
+    assert controller.run_pipelines({'water': strokes(water, 1, 1)}, wait=False) == {}
+    assert water.is_busy()
+    water.wait_until_idle()
+    assert water.get_plunger_position() == 0
+
+
+
+def test_parallel_transfer_pipelined(multihub_config):
+    durations = {}
+    for sync in (True, False):
+        # A fresh controller each, so both transfers start from the same valve positions
+        controller = VirtualMultiPumpController(multihub_config, latency=0.002, baudrate=38400)
+        controller.smart_initialize()
+        start = controller.clock.time()
+        controller.parallel_transfer({'water': 8, 'oil2': 1}, 'I', 'O', wait=True, sync=sync)
+        durations[sync] = controller.clock.time() - start
+        assert controller.pumps['water'].get_plunger_position() == 0
+    assert durations[False] <= durations[True] * 1.01
+
+
+@pytest.mark.parametrize('sync', [True, False])
+def test_parallel_transfer_pick_ups_before_dispenses(controller, monkeypatch, sync):
+    pumps = {pump_name: controller.pumps[pump_name] for pump_name in ('water', 'oil2')}
+    last_moves = {}
+    picking_up_at_dispense = []
+
+    def track(pump_name, method_name):
+        method = getattr(pumps[pump_name], method_name)
+
+        def move(*args, **kwargs):
+            if method_name == 'deliver':
+                picking_up_at_dispense.extend(other for (other, pump) in pumps.items()
+                                              if last_moves.get(other) == 'pump' and pump.is_busy())
+            last_moves[pump_name] = method_name
+            return method(*args, **kwargs)
+        monkeypatch.setattr(pumps[pump_name], method_name, move)
+
+    for pump_name in pumps:
+        track(pump_name, 'pump')
+        track(pump_name, 'deliver')
+
+    controller.parallel_transfer({'water': 8, 'oil2': 1}, 'I', 'O', wait=True, sync=sync)
+    # Synchronised, every pick-up is over before any dispense starts, pipelined the dispense of oil2 does not wait
+    # for the pick-up of water
+    assert picking_up_at_dispense == ([] if sync else ['water'])
+
+
+def test_pipelines_abort_on_refused_move(controller):
+    water = controller.pumps['water']
+    moves = [functools.partial(water.pump, 1, 'I'), functools.partial(water.pump, 10, 'I'),
+             functools.partial(water.deliver, 1, 'O')]
+    with pytest.raises(ValueError):
+        controller.run_pipelines({'water': moves})
+    water.wait_until_idle()
+    assert water.get_plunger_position() == water.volume_to_step(1)
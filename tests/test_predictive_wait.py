@@ -0,0 +1,39 @@
+import pytest
+
+from pycont.retry import PumpDeadlineError
+
+
+def test_long_move_is_polled_a_few_times(controller):
+    pump = controller.pumps['water']
+    pump.set_top_velocity(200)
+    simulated_pump = controller.simulated_pumps['water']
+    pump.pump(pump.total_volume, 'I')
+
+    completion_time = pump.estimated_completion_time()
+    assert completion_time is not None
+
+    transactions = pump._io.hub.transactions
+    pump.wait_until_idle()
+    assert pump._io.hub.transactions - transactions < 10
+    assert not simulated_pump.is_busy()
+    # The end of the move is detected shortly after it happens
+    assert completion_time <= controller.clock.time() < completion_time + 0.1
+    assert pump.estimated_completion_time() is None
+
+
+def test_unpredicted_move_is_polled(controller):
+    pump = controller.pumps['water']
+    pump.pump(1, 'I')
+    pump._schedule_completion(None)
+    pump.wait_until_idle()
+    assert not controller.simulated_pumps['water'].is_busy()
+
+
+def test_wait_until_idle_deadline(controller):
+    pump = controller.pumps['water']
+    pump.set_top_velocity(200)
+    pump.pump(pump.total_volume, 'I')
+    start = controller.clock.time()
+    with pytest.raises(PumpDeadlineError):
+        pump.wait_until_idle(deadline=1)
+    assert controller.clock.time() - start == pytest.approx(1, abs=0.05)
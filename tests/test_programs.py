@@ -0,0 +1,35 @@
+import pytest
+
+from pycont import pump_protocol
+
+
+def test_transfer_program_loops_on_the_pump(controller):
+    pump = controller.pumps['water']
+    sequence = pump.transfer_program(12, 'I', 'O', stroke_volume=4)
+    frame = sequence.to_packet().to_string()
+    assert b'g' in frame and b'G3' in frame
+
+    start = controller.clock.time()
+    sequence.execute(wait=True)
+    assert pump.get_plunger_position() == 0
+    assert controller.clock.time() - start > 3 * pump.estimate_move_duration(pump.volume_to_step(4), 6000)
+
+
+def test_stored_program(controller):
+    pump = controller.pumps['water']
+    assert pump.store_program(2, pump.transfer_program(8, 'I', 'O', stroke_volume=4))
+    assert 2 in controller.simulated_pumps['water'].programs
+
+    assert pump.run_program(2)
+    assert pump.estimated_completion_time() > controller.clock.time()
+    pump.wait_until_idle()
+    assert pump.get_plunger_position() == 0
+    assert pump.get_valve_position() == 'O'
+
+
+def test_store_program_checks_the_sequence(controller):
+    pump = controller.pumps['water']
+    with pytest.raises(ValueError):
+        pump.store_program(pump_protocol.PROGRAM_SLOTS, pump.sequence().pump(1))
+    with pytest.raises(ValueError):
+        pump.store_program(0, pump.sequence().loop_start().pump(1))
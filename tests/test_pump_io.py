@@ -0,0 +1,43 @@
+import pytest
+
+from pycont.controller import PumpIO, PumpIOTimeOutError
+from pycont.pump_protocol import C3000Protocol
+from pycont.sim import SimulatedSetup
+
+
+@pytest.fixture
+def slow_setup(multihub_config):
+    setup = SimulatedSetup(multihub_config, latency=0.3)
+    yield setup
+    setup.close()
+
+
+def test_late_reply_is_not_taken_for_the_next_reply(slow_setup):
+    pump_io = PumpIO(slow_setup.config['hubs'][0]['io']['port'], timeout=1)
+    query = C3000Protocol('1').forge_report_plunger_position_packet()
+    try:
+        with pytest.raises(PumpIOTimeOutError):
+            pump_io.write_and_readline(query, timeout=0.05)
+
+        # The late reply tells the old position, it comes while the same query is asked again
+        slow_setup.pumps['acetone'].plunger_position = 1000
+        response = pump_io.write_and_readline(query)
+        assert C3000Protocol('1').decode_packet(response)[2] == '1000'
+        assert pump_io.late_frames == 1
+        assert not pump_io._owed_replies
+    finally:
+        pump_io.close()
+
+
+def test_stale_frame_is_discarded(slow_setup):
+    pump_io = PumpIO(slow_setup.config['hubs'][0]['io']['port'], timeout=1)
+    protocol = C3000Protocol('1')
+    try:
+        # The reply to the status query carries no data, it cannot answer the ? query
+        pump_io.write(protocol.forge_report_status_packet())
+        slow_setup.pumps['acetone'].plunger_position = 500
+        response = pump_io.write_and_readline(protocol.forge_report_plunger_position_packet())
+        assert protocol.decode_packet(response)[2] == '500'
+        assert pump_io.stale_frames == 1
+    finally:
+        pump_io.close()
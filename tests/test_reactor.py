@@ -0,0 +1,42 @@
+import pytest
+
+from pycont.controller import MultiPumpController, PumpIO, PumpIOTimeOutError
+from pycont.pump_protocol import C3000Protocol
+from pycont.reactor import PumpReactor
+from pycont.sim import SimulatedSetup
+
+
+@pytest.fixture
+def reactor():
+    reactor = PumpReactor()
+    yield reactor
+    reactor.close()
+
+
+def test_reactor_discards_the_late_reply(multihub_config, reactor):
+    with SimulatedSetup(multihub_config, latency=0.3) as setup:
+        pump_io = PumpIO(setup.config['hubs'][0]['io']['port'])
+        reactor_io = reactor.add_hub(pump_io)
+        query = C3000Protocol('1').forge_report_plunger_position_packet()
+        try:
+            with pytest.raises(PumpIOTimeOutError):
+                reactor_io.write_and_readline(query, timeout=0.05)
+
+            setup.pumps['acetone'].plunger_position = 1000
+            response = reactor_io.write_and_readline(query)
+            assert C3000Protocol('1').decode_packet(response)[2] == '1000'
+            assert pump_io.late_frames == 1
+        finally:
+            reactor_io.release()
+
+
+def test_reactor_drives_the_hubs(multihub_config, fast_simulation, reactor):
+    with SimulatedSetup(multihub_config, latency=0.002) as setup:
+        with MultiPumpController(setup.config, reactor=reactor) as controller:
+            controller.smart_initialize()
+            assert not controller.concurrent_hubs
+
+            operation = controller.pump(['water', 'oil2'], 0.2, 'I', operation=True)
+            assert operation.result(timeout=5) == [True, True]
+            volumes = controller.apply_command_to_pumps(['water', 'oil2'], 'get_volume')
+            assert volumes == {'water': pytest.approx(0.2), 'oil2': pytest.approx(0.2)}
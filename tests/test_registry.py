@@ -0,0 +1,45 @@
+import pytest
+
+from pycont.aio import AsyncPumpIO
+from pycont.controller import MultiPumpController, PumpIO, PumpIORegistry, pump_io_registry
+from pycont.sim import SimulatedSetup
+
+
+@pytest.fixture
+def setup(multihub_config, fast_simulation):
+    setup = SimulatedSetup(multihub_config, latency=0.002)
+    yield setup
+    setup.close()
+
+
+def test_controllers_share_the_hubs(setup):
+    port = setup.config['hubs'][0]['io']['port']
+    first = MultiPumpController(setup.config)
+    second = MultiPumpController(setup.config)
+    try:
+        assert first.pumps['water']._io is second.pumps['water']._io
+        assert pump_io_registry.is_shared(first.pumps['water']._io)
+
+        first.close()
+        assert port in pump_io_registry
+        assert second.pumps['water'].is_idle()
+    finally:
+        second.close()
+    assert port not in pump_io_registry
+
+
+def test_registry_refuses_another_setting(setup):
+    registry = PumpIORegistry()
+    port = setup.config['hubs'][0]['io']['port']
+    pump_io = registry.acquire(PumpIO, port, 38400)
+    try:
+        assert registry.acquire(PumpIO, port, 38400) is pump_io
+        registry.release(pump_io)
+        with pytest.raises(ValueError):
+            registry.acquire(PumpIO, port, 9600)
+        with pytest.raises(ValueError):
+            registry.acquire(AsyncPumpIO, port, 38400)
+        assert not registry.is_shared(pump_io)
+    finally:
+        registry.release(pump_io)
+    assert port not in registry
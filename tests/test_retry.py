@@ -0,0 +1,74 @@
+import pytest
+
+from pycont import retry
+from pycont.clock import VirtualClock
+from pycont.controller import ControllerRepeatedError, PumpUnhealthyError
+from pycont.retry import RetryPolicy, PumpDeadlineError
+from pycont.sim import VirtualMultiPumpController
+
+
+def unplug(controller, pump_name):
+    pump = controller.pumps[pump_name]
+    del pump._io.hub.pumps[pump.address]
+    return pump
+
+
+def test_breaker_is_off_by_default():
+    policy = RetryPolicy(clock=VirtualClock())
+    for _ in range(20):
+        policy.record_failure()
+    assert policy.is_healthy() and policy.allow_request()
+
+
+def test_breaker_opens_after_threshold():
+    clock = VirtualClock()
+    policy = RetryPolicy(failure_threshold=2, recovery_time=10, clock=clock)
+    policy.record_failure()
+    assert policy.allow_request()
+    policy.record_failure()
+    assert not policy.is_healthy() and not policy.allow_request()
+
+    # Half open once the recovery time is over: a single request is let through
+    clock.sleep(10)
+    assert policy.allow_request()
+    assert not policy.allow_request()
+    policy.record_success(0.01)
+    assert policy.is_healthy() and policy.allow_request()
+
+
+def test_timeout_adapts_to_latency():
+    policy = RetryPolicy(min_timeout=0.1, max_timeout=1)
+    assert policy.timeout() == 1
+    for _ in range(10):
+        policy.record_success(0.01)
+    assert policy.timeout() == pytest.approx(0.1)
+    assert policy.timeout(report=False) == 1
+    assert policy.backoff(1) < policy.backoff(2) <= policy.backoff_max
+
+
+def test_unresponsive_pump_is_retried(controller):
+    pump = unplug(controller, 'water')
+    packet = pump._protocol.forge_report_status_packet()
+    with pytest.raises(ControllerRepeatedError):
+        pump.write_and_read_from_pump(packet, max_repeat=5)
+    assert pump.retry_policy.is_healthy()
+
+
+def test_unresponsive_pump_opens_the_breaker(multihub_config):
+    multihub_config['hubs'][0]['pumps']['water']['retry_policy'] = {'failure_threshold': 2}
+    controller = VirtualMultiPumpController(multihub_config, latency=0.002)
+    pump = unplug(controller, 'water')
+    packet = pump._protocol.forge_report_status_packet()
+    with pytest.raises(PumpUnhealthyError):
+        pump.write_and_read_from_pump(packet, max_repeat=5)
+    assert not pump.retry_policy.is_healthy()
+    assert pump.retry_policy.max_timeout == multihub_config['hubs'][0]['io']['timeout']
+
+
+def test_deadline(controller):
+    pump = unplug(controller, 'water')
+    start = controller.clock.time()
+    with pytest.raises(PumpDeadlineError):
+        with retry.deadline(0.5, controller.clock):
+            pump.write_and_read_from_pump(pump._protocol.forge_report_status_packet())
+    assert controller.clock.time() - start == pytest.approx(0.5, abs=0.1)
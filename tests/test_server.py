@@ -0,0 +1,58 @@
+import os
+import stat
+import threading
+
+import pytest
+
+from pycont.controller import PumpHWError
+from pycont.server import PumpServer, PumpClient
+from pycont.sim import ERROR_PLUNGER_OVERLOAD
+
+
+@pytest.fixture
+def server(controller, tmp_path):
+    server = PumpServer(controller, str(tmp_path / 'pycont.sock'))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_socket_is_private(server):
+    assert stat.S_IMODE(os.stat(server.path).st_mode) == 0o600
+
+
+def test_clients_share_queries(server):
+    with PumpClient(server.path) as first, PumpClient(server.path) as second:
+        assert first.pumps['water'].get_volume() == second.pumps['water'].get_volume() == 0
+        assert (server.coalescer.queries, server.coalescer.coalesced) == (1, 1)
+
+        # A command drops the results of the pump
+        first.pumps['water'].pump(0.5, 'I', wait=True)
+        assert second.water.current_volume == pytest.approx(0.5)
+        assert second.pumps['water'].get_volume() == pytest.approx(0.5)
+        assert (server.coalescer.queries, server.coalescer.coalesced) == (3, 1)
+
+
+def test_clients_cannot_reach_the_eeprom(server):
+    with PumpClient(server.path) as client:
+        with pytest.raises(AttributeError):
+            client.pumps['water'].set_eeprom_config(1)
+        with pytest.raises(AttributeError):
+            client.pumps['water'].write_and_read_from_pump('/1?R\r')
+        with pytest.raises(AttributeError):
+            client.apply_command_to_all_pumps('set_eeprom_lowlevel_config', 1, 0)
+        with pytest.raises(AttributeError):
+            client.call(None, 'close')
+        assert client.apply_command_to_pumps(['water'], command='get_volume') == {'water': 0}
+
+
+def test_hardware_error_is_reported_once(server, controller, capsys):
+    controller.simulated_pumps['water'].inject_error(ERROR_PLUNGER_OVERLOAD)
+    with PumpClient(server.path) as client:
+        with pytest.raises(PumpHWError) as error:
+            client.pumps['water'].pump(0.5, 'I', wait=True)
+    assert (error.value.pump_name, error.value.error_code) == ('water', 'i')
+    assert capsys.readouterr().out.count('*** ERROR on pump water ***') == 1
@@ -0,0 +1,63 @@
+from pycont import pump_protocol
+from pycont.dtprotocol import DTCommand
+from pycont.controller import C3000ShadowState
+from pycont.sim import VirtualMultiPumpController
+
+
+def commands(*specs):
+    return [DTCommand(command, operand) for (command, operand) in specs]
+
+
+def test_track_command():
+    state = C3000ShadowState()
+    state.track_command(DTCommand(pump_protocol.CMD_TOPVELOCITY, '1200'))
+    state.track_command(DTCommand('I'))
+    assert (state.top_velocity, state.valve_position) == (1200, 'I')
+    state.track_command(DTCommand('I', '4'))
+    assert state.valve_position == '4'
+
+    state.track_command(DTCommand(pump_protocol.CMD_PUMP, '100'))
+    assert state.plunger_position is None  # Relative moves need a known position
+    state.track_command(DTCommand(pump_protocol.CMD_MOVE_TO, '1000'))
+    state.track_command(DTCommand(pump_protocol.CMD_PUMP, '500'))
+    state.track_command(DTCommand(pump_protocol.CMD_DELIVER, '200'))
+    assert state.plunger_position == 1300
+
+
+def test_track_initialization():
+    for command in (pump_protocol.CMD_INITIALIZE_VALVE_RIGHT, pump_protocol.CMD_INITIALIZE_VALVE_LEFT,
+                    pump_protocol.CMD_INITIALIZE_NO_VALVE):
+        state = C3000ShadowState()
+        state.track_commands(commands(('A', '3000'), ('O', None), (command, None)))
+        assert (state.plunger_position, state.valve_position) == (0, None)
+
+    state = C3000ShadowState()
+    state.track_commands(commands(('A', '3000'), ('O', None), (pump_protocol.CMD_INITIALIZE_VALVE_ONLY, None)))
+    assert (state.plunger_position, state.valve_position) == (3000, None)
+
+
+def test_track_loops():
+    state = C3000ShadowState()
+    state.track_commands(commands(('A', '0'), ('g', None), ('P', '100'), ('g', None), ('D', '10'), ('G', '3'),
+                                  ('G', '5')))
+    assert state.plunger_position == 5 * (100 - 3 * 10)
+
+
+def test_shadow_follows_initialization(multihub_config):
+    # Regression: the plunger position was kept through an initialization, so the pumps rejected valid moves
+    multihub_config['default']['shadow_state'] = True
+    controller = VirtualMultiPumpController(multihub_config, latency=0.002, baudrate=38400)
+    controller.smart_initialize()
+    pump = controller.pumps['water']
+
+    assert pump.pump(4, 'I', wait=True)
+    pump.initialize_valve_right()
+    assert pump.shadow.plunger_position == 0
+    assert pump.pump(3, 'I', wait=True)
+    assert pump.get_plunger_position() == pump.volume_to_step(3)
+
+    pump.set_valve_position('O')
+    pump.initialize_valve_only()
+    assert pump.shadow.valve_position is None
+    pump.set_valve_position('O')
+    assert pump.get_valve_position() == 'O'
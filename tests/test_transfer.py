@@ -0,0 +1,48 @@
+import pytest
+
+
+def test_plan_transfer_adds_up(controller):
+    pump = controller.pumps['water']
+    plan = pump.plan_transfer(12.3, 'I', 'O', speed_in=3000)
+
+    assert [stroke.volume_in_ml for stroke in plan[:-1]] == [pump.total_volume] * 2
+    assert 0 < plan[-1].volume_in_ml < pump.total_volume
+    assert sum(pump.volume_to_step(stroke.volume_in_ml) for stroke in plan) == pump.volume_to_step(12.3)
+    assert all((stroke.from_valve, stroke.to_valve, stroke.speed_in) == ('I', 'O', 3000) for stroke in plan)
+
+
+def test_plan_transfer_stroke_volume(controller):
+    pump = controller.pumps['water']
+    assert [stroke.volume_in_ml for stroke in pump.plan_transfer(4, 'I', 'O', stroke_volume=2)] == [2, 2]
+
+    # The strokes default to the room left in the syringe
+    pump.pump(3, 'I', wait=True)
+    plan = pump.plan_transfer(5, 'I', 'O')
+    assert plan[0].volume_in_ml == pytest.approx(pump.total_volume - 3)
+
+
+def test_plan_transfer_full_syringe(controller):
+    pump = controller.pumps['water']
+    pump.pump(pump.total_volume, 'I', wait=True)
+    with pytest.raises(ValueError):
+        pump.plan_transfer(1, 'I', 'O')
+
+
+@pytest.mark.parametrize('chained', [False, True])
+def test_transfer(controller, chained):
+    pump = controller.pumps['water']
+    progress = []
+    pump.transfer(12, 'I', 'O', chained=chained, progress=progress.append)
+
+    assert [item.stroke for item in progress] == [1, 2, 3]
+    assert progress[-1].volume_transferred == pytest.approx(12)
+    assert pump.get_plunger_position() == 0
+    assert pump.get_valve_position() == 'O'
+
+
+def test_transfer_looped(controller):
+    pump = controller.pumps['water']
+    start = controller.clock.time()
+    pump.transfer(12, 'I', 'O', looped=True)
+    assert pump.get_plunger_position() == 0
+    assert controller.clock.time() - start > 3 * pump.estimate_move_duration(pump.volume_to_step(4), 6000)
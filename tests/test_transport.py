@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+from pycont.controller import C3000Controller, ControllerRepeatedError, PumpIO, PumpIOConnectionError
+from pycont.sim import SimulatedHub, TCPHub
+
+
+@pytest.fixture
+def hub():
+    return SimulatedHub(['1'], latency=0.002)
+
+
+@pytest.fixture
+def pump(hub):
+    tcp_hub = TCPHub(hub)
+    pump = C3000Controller(PumpIO(tcp_hub.port, timeout=0.2), 'water', '1', 5)
+    pump.tcp_hub = tcp_hub
+    yield pump
+    pump._io.close()
+    pump.tcp_hub.close()
+
+
+def restart(pump):
+    tcp_port = int(pump.tcp_hub.port.rpartition(':')[2])
+    pump.tcp_hub = TCPHub(pump.tcp_hub.hub, tcp_port=tcp_port)
+
+
+def test_reconnects_after_restart(pump):
+    assert pump.get_plunger_position() == 0
+
+    pump.tcp_hub.close()
+    with pytest.raises(PumpIOConnectionError):
+        pump._io.write_and_readline(pump._protocol.forge_report_status_packet())
+    with pytest.raises(ControllerRepeatedError):
+        pump.write_and_read_from_pump(pump._protocol.forge_report_status_packet(), max_repeat=3)
+
+    restart(pump)
+    assert pump.get_plunger_position() == 0
+    assert pump._io._transport.reconnections == 1
+
+
+def test_retries_while_restarting(pump):
+    pump.tcp_hub.close()
+    timer = threading.Timer(0.1, restart, [pump])
+    timer.start()
+    try:
+        assert pump.get_plunger_position() == 0
+    finally:
+        timer.join()
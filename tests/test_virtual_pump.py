@@ -0,0 +1,53 @@
+import pytest
+
+from pycont.aio import AsyncMultiPumpController
+from pycont.controller import VirtualPump
+from pycont.sim import SimulatedSetup
+
+
+def test_split_volume(controller):
+    virtual_pump = VirtualPump(controller, 'solvents')
+    assert virtual_pump.total_volume == 10
+    assert virtual_pump.split_volume(3) == {'water': 1.5, 'acetone': 1.5}
+
+
+def test_virtual_pump_moves_all_pumps(controller):
+    virtual_pump = VirtualPump(controller, ['water', 'oil2'])
+    assert virtual_pump.pump(4, 'I', wait=True)
+    assert controller.pumps['water'].get_volume() == pytest.approx(2)
+    assert controller.pumps['oil2'].get_volume() == pytest.approx(2)
+    assert virtual_pump.current_volume == pytest.approx(4)
+
+    assert virtual_pump.deliver(1, 'O', wait=True)
+    assert virtual_pump.remaining_volume == pytest.approx(7)
+
+
+def test_virtual_pump_all_or_none(controller):
+    virtual_pump = VirtualPump(controller, ['water', 'oil2'])
+    controller.pumps['water'].pump(4, 'I', wait=True)
+
+    # water cannot pump its share, oil2 does not move either
+    assert not virtual_pump.pump(4, 'I', wait=True)
+    assert controller.pumps['oil2'].get_volume() == 0
+    assert virtual_pump.pump(2, 'I', operation=True).result() == [True, True]
+
+
+def test_virtual_pump_transfer(controller):
+    virtual_pump = VirtualPump(controller, ['water', 'oil2'])
+    virtual_pump.transfer(25, 'I', 'O')
+    assert virtual_pump.current_volume == 0
+    assert controller.simulated_pumps['water'].plunger_position == 0
+
+
+def test_virtual_pump_rejected(controller, multihub_config):
+    with pytest.raises(ValueError):
+        VirtualPump(controller, [])
+    with pytest.raises(ValueError):
+        VirtualPump(controller, ['water', 'nitrogen'])
+    with pytest.raises(ValueError):
+        VirtualPump(controller, ['water', 'water'])
+
+    with SimulatedSetup(multihub_config) as setup:
+        with AsyncMultiPumpController(setup.config) as async_controller:
+            with pytest.raises(TypeError):
+                VirtualPump(async_controller, 'solvents')